@@ -0,0 +1,87 @@
+"""
+Benchmark: latency of /health and /payment/{id}/status while QR renders run concurrently.
+
+Start the gateway first, e.g.
+    uvicorn main:app --port 8001
+then run
+    python bench_qr_load.py --url http://localhost:8001 --duration 20 --qr-concurrency 16
+
+Every QR request uses a fresh transaction so each one is a cache miss and
+really renders. Compare runs with QR_POOL_WORKERS=0 (thread pool) and the
+default process pool to see how much QR load leaks into other endpoints.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentile(samples, pct):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def qr_load(client, stop_at, counters):
+    while time.perf_counter() < stop_at:
+        res = await client.post("/payment/create", json={"amount": 123.45, "note": "bench"})
+        txn = res.json()["transaction_id"]
+        res = await client.get(f"/payment/{txn}/qr")
+        counters[res.status_code] = counters.get(res.status_code, 0) + 1
+
+
+async def probe(client, path, stop_at, samples, interval):
+    while time.perf_counter() < stop_at:
+        started = time.perf_counter()
+        res = await client.get(path)
+        res.raise_for_status()
+        samples.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+
+
+def report(name, samples):
+    print(
+        f"{name:<28} n={len(samples):<6} "
+        f"p50={percentile(samples, 50):7.2f}ms  "
+        f"p95={percentile(samples, 95):7.2f}ms  "
+        f"p99={percentile(samples, 99):7.2f}ms  "
+        f"max={max(samples) if samples else float('nan'):7.2f}ms  "
+        f"mean={statistics.fmean(samples) if samples else float('nan'):7.2f}ms"
+    )
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.qr_concurrency + 8)
+    async with httpx.AsyncClient(base_url=args.url, timeout=30, limits=limits) as client:
+        res = await client.post("/payment/create", json={"amount": 1.0, "note": "bench-probe"})
+        status_path = f"/payment/{res.json()['transaction_id']}/status"
+
+        for phase, concurrency in (("idle", 0), ("under QR load", args.qr_concurrency)):
+            stop_at = time.perf_counter() + args.duration
+            health, status, counters = [], [], {}
+            tasks = [probe(client, "/health", stop_at, health, args.interval),
+                     probe(client, status_path, stop_at, status, args.interval)]
+            tasks += [qr_load(client, stop_at, counters) for _ in range(concurrency)]
+            await asyncio.gather(*tasks)
+
+            print(f"\n--- {phase} (QR concurrency={concurrency}, {args.duration}s) ---")
+            report("GET /health", health)
+            report("GET /payment/{id}/status", status)
+            if counters:
+                print(f"QR responses by status code: {counters}")
+
+        print("\nGateway QR metrics:", (await client.get("/metrics/qr")).json())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per phase")
+    parser.add_argument("--qr-concurrency", type=int, default=16)
+    parser.add_argument("--interval", type=float, default=0.01, help="delay between probe requests")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,195 @@
+"""
+TTL expiry for pending payments.
+
+Every tracked transaction has one deadline in a min-heap:
+  - PENDING records expire `ttl` seconds after creation (status -> EXPIRED);
+  - terminal records (SUCCESS / FAILED / EXPIRED) are evicted from the
+    store's hot set `retention` seconds after their last update.
+
+Re-tracking a transaction pushes a new heap entry and leaves the old one to
+be skipped when popped (lazy deletion), so both scheduling and expiring are
+O(log n). All methods run on the event loop thread; the due transactions of
+a pass (up to `batch_size`) are expired with one conditional UPDATE in a
+worker thread, so a burst of expiries never blocks requests and workers
+sharing a database skip what another worker already expired.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from models import PaymentRecord, PaymentStatus
+from store import TransactionStore
+
+
+log = logging.getLogger("gateway.expiry")
+
+PAYMENT_TTL_SECONDS = float(os.getenv("PAYMENT_TTL_SECONDS", "900"))
+PAYMENT_RETENTION_SECONDS = float(os.getenv("PAYMENT_RETENTION_SECONDS", "3600"))
+
+EXPIRE = "expire"
+EVICT = "evict"
+
+
+class ExpiryScheduler:
+    def __init__(
+        self,
+        store: TransactionStore,
+        ttl: float = PAYMENT_TTL_SECONDS,
+        retention: float = PAYMENT_RETENTION_SECONDS,
+        max_sleep: float = 1.0,
+        batch_size: int = 500,
+        max_retry_delay: float = 60.0,
+    ):
+        self.store = store
+        self.ttl = ttl
+        self.retention = retention
+        self.max_sleep = max_sleep
+        self.batch_size = batch_size
+        self.max_retry_delay = max_retry_delay
+        self._failures = 0
+        self._heap: List[Tuple[float, str, str]] = []          # (deadline, kind, transaction_id)
+        self._tracked: Dict[str, Tuple[str, float]] = {}       # transaction_id -> (kind, deadline)
+        self._live = 0
+        self.expired_total = 0
+        self.evicted_total = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, record: PaymentRecord):
+        """(Re)schedule a transaction after it was created or changed status."""
+        if record.status == PaymentStatus.PENDING:
+            self._schedule(record.transaction_id, EXPIRE, record.created_at + self.ttl)
+        else:
+            self._schedule(record.transaction_id, EVICT, record.updated_at + self.retention)
+
+    def _schedule(self, transaction_id: str, kind: str, deadline: float):
+        entry = (kind, deadline)
+        previous = self._tracked.get(transaction_id)
+        if previous == entry:
+            return
+        self._live += (kind == EXPIRE) - (previous is not None and previous[0] == EXPIRE)
+        self._tracked[transaction_id] = entry
+        heapq.heappush(self._heap, (deadline, kind, transaction_id))
+
+    def _untrack(self, transaction_id: str):
+        previous = self._tracked.pop(transaction_id, None)
+        if previous is not None and previous[0] == EXPIRE:
+            self._live -= 1
+
+    def rebuild(self, now: Optional[float] = None):
+        """Schedule everything in the store in one pass (startup)."""
+        now = time.time() if now is None else now
+        for record in self.store.values():
+            if record.status == PaymentStatus.PENDING or record.updated_at + self.retention > now:
+                self.track(record)
+
+    def _pop_due(self, now: float) -> Tuple[int, List[Tuple[str, float]]]:
+        """
+        Pop passed deadlines, evicting inline, until `batch_size` expiries are
+        collected. Returns the number handled and the (transaction_id,
+        deadline) pairs to expire.
+        """
+        handled = 0
+        due: List[Tuple[str, float]] = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            deadline, kind, transaction_id = heapq.heappop(self._heap)
+            if self._tracked.get(transaction_id) != (kind, deadline):
+                continue  # superseded by a later track()
+            handled += 1
+
+            if kind == EVICT:
+                self._untrack(transaction_id)
+                self.store.evict(transaction_id)
+                self.evicted_total += 1
+            else:
+                due.append((transaction_id, deadline))
+        return handled, due
+
+    def _expired(self, due: List[Tuple[str, float]], expired: List[str], now: float):
+        expired = set(expired)
+        self.expired_total += len(expired)
+        for transaction_id, deadline in due:
+            if self._tracked.get(transaction_id) != (EXPIRE, deadline):
+                continue  # re-tracked while the batch was being written
+            if transaction_id in expired:
+                self._schedule(transaction_id, EVICT, now + self.retention)
+            else:
+                # Paid, or expired by another worker, meanwhile: whoever changed
+                # it tracks it, and the store has dropped its stale copy
+                self._untrack(transaction_id)
+
+    def _retry(self, due: List[Tuple[str, float]], now: float):
+        """
+        Put a batch whose write failed back on the heap. Its entries were
+        already popped; the delay doubles with each failure in a row (up to
+        `max_retry_delay`) so a store outage is not retried every pass.
+        """
+        self._failures += 1
+        retry_at = now + min(self.max_sleep * 2 ** self._failures, self.max_retry_delay)
+        for transaction_id, deadline in due:
+            if self._tracked.get(transaction_id) == (EXPIRE, deadline):
+                self._schedule(transaction_id, EXPIRE, retry_at)
+
+    def run_due(self, now: Optional[float] = None) -> int:
+        """Process every deadline that has passed, in the calling thread. Returns the number handled."""
+        now = time.time() if now is None else now
+        total = 0
+        while True:
+            handled, due = self._pop_due(now)
+            if due:
+                try:
+                    expired = self.store.expire_many([t for t, _ in due], now)
+                except Exception:
+                    self._retry(due, now)
+                    raise
+                self._failures = 0
+                self._expired(due, expired, now)
+            total += handled
+            if len(due) < self.batch_size:
+                return total
+
+    async def run(self):
+        while True:
+            try:
+                now = time.time()
+                _, due = self._pop_due(now)
+                if due:
+                    try:
+                        expired = await asyncio.to_thread(self.store.expire_many, [t for t, _ in due], now)
+                    except Exception:
+                        self._retry(due, now)
+                        raise
+                    self._failures = 0
+                    self._expired(due, expired, now)
+            except Exception:
+                log.exception("Payment expiry pass failed")
+            delay = self.max_sleep
+            if self._heap:
+                delay = min(delay, max(0.0, self._heap[0][0] - time.time()))
+            await asyncio.sleep(delay)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "live": self._live,
+            "terminal_hot": len(self._tracked) - self._live,
+            "expired_total": self.expired_total,
+            "evicted_total": self.evicted_total,
+            "ttl_seconds": self.ttl,
+            "retention_seconds": self.retention,
+        }
@@ -0,0 +1,131 @@
+"""
+Synthetic gateway transactions for scale testing (the backend counterpart is
+backend/generate_data.py).
+
+    python generate_transactions.py --transactions 1000000 --days 365
+
+Writes straight into the gateway's SQLite file (GATEWAY_DB_PATH) with batched
+executemany() inserts, one transaction per batch and synchronous=OFF during
+the load. Run it with the gateway stopped: the running store caches UTRs and
+hot records and would not see the new rows until restart.
+
+  - statuses follow --status-mix; pending payments are younger than
+    PAYMENT_TTL_SECONDS (older ones would have expired);
+  - creation times spread over --days, denser towards today;
+  - every SUCCESS payment has a unique 12-digit UTR, so the duplicate-UTR
+    index is loaded at full size on the next start.
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import time
+
+from expiry import PAYMENT_TTL_SECONDS
+from store import _COLUMNS, _SCHEMA, _UTR_UNIQUE_INDEX, GATEWAY_DB_PATH
+from utils.upi_links import build_upi_uri
+
+DEFAULT_STATUS_MIX = "SUCCESS=75,EXPIRED=15,FAILED=5,PENDING=5"
+NOTES = ("Leaf plates order", "Bulk order", "Event catering", "Payment", "Wedding order", "Restaurant supplies")
+URI_PLACEHOLDER = "TXNPLACEHOLDER"
+NAMES = ("Arun Kumar", "Priya Raman", "Karthik Iyer", "Divya Nair", None, "Meena Reddy", "Vijay Das", None)
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip().upper()] = float(weight)
+    if not mix or any(w < 0 for w in mix.values()) or not sum(mix.values()):
+        raise ValueError(f"Invalid status mix '{text}'")
+    return mix
+
+
+def transaction_batch(rng: random.Random, args, count: int, now: float, utr_state: list, uri_templates: dict):
+    mix = parse_mix(args.status_mix)
+    statuses = rng.choices(list(mix), cum_weights=list(itertools.accumulate(mix.values())), k=count)
+    span_seconds = args.days * 86400
+    rows, utrs = [], []
+    for status in statuses:
+        if status == "PENDING":
+            age = rng.random() * max(PAYMENT_TTL_SECONDS - 30, 1)
+        else:
+            age = span_seconds * (1 - (1 - rng.random()) ** 0.5)
+        created_at = now - age
+        transaction_id = f"TXN-{rng.getrandbits(48):012X}"
+        amount = float(rng.choice((10, 15, 25, 50, 120, 250, 500, 1200, 2500)) * rng.randint(1, 4))
+        note = rng.choice(NOTES)
+        # URL-encoding dominates otherwise; transaction ids are URL-safe
+        template = uri_templates.get((amount, note))
+        if template is None:
+            template = uri_templates[amount, note] = build_upi_uri(amount, note, URI_PLACEHOLDER)
+        updated_at = created_at if status == "PENDING" else min(now, created_at + rng.uniform(20, PAYMENT_TTL_SECONDS))
+        rows.append((
+            transaction_id, amount, note, rng.choice(NAMES),
+            template.replace(URI_PLACEHOLDER, transaction_id), status, created_at, updated_at,
+        ))
+        if status == "SUCCESS":
+            # Stepping by a number coprime with 10**12 never repeats a UTR
+            utr_state[0] = (utr_state[0] + 7919) % 10 ** 12
+            utrs.append((transaction_id, f"{utr_state[0]:012d}"))
+    return rows, utrs
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")   # 256 MB: the random-key indexes stay in memory
+    conn.executescript(_SCHEMA)
+    conn.execute(_UTR_UNIQUE_INDEX)
+    insert_transaction = (
+        f"INSERT OR IGNORE INTO transactions ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+    )
+
+    now = time.time()
+    # Continue from the largest numeric UTR already stored
+    last_utr = conn.execute("SELECT MAX(utr_number) FROM utrs WHERE utr_number GLOB '[0-9]*'").fetchone()[0]
+    utr_state = [int(last_utr) if last_utr and last_utr.isdigit() else rng.randrange(10 ** 11, 10 ** 12)]
+
+    uri_templates = {}
+    written = 0
+    started = time.perf_counter()
+    while written < args.transactions:
+        count = min(args.batch_size, args.transactions - written)
+        rows, utrs = transaction_batch(rng, args, count, now, utr_state, uri_templates)
+        # Key order touches each B-tree page once per batch instead of at random
+        rows.sort()
+        utrs.sort()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(insert_transaction, rows)
+            conn.executemany("INSERT OR IGNORE INTO utrs (transaction_id, utr_number) VALUES (?, ?)", utrs)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        written += count
+        elapsed = time.perf_counter() - started
+        print(f"\r{written}/{args.transactions} transactions ({written / elapsed:,.0f}/s)", end="", flush=True)
+    print()
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=365, help="history covered by creation times")
+    parser.add_argument("--status-mix", default=DEFAULT_STATUS_MIX, help="STATUS=weight,...")
+    parser.add_argument("--batch-size", type=int, default=20000, help="rows per insert transaction")
+    parser.add_argument("--db", default=GATEWAY_DB_PATH, help="gateway SQLite file (default: GATEWAY_DB_PATH)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    try:
+        parse_mix(args.status_mix)
+    except ValueError as e:
+        parser.error(str(e))
+    run(args)
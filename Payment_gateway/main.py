@@ -1,3 +1,5 @@
+import asyncio
+import logging
 import time
 import os
 import sys
@@ -7,38 +9,79 @@ from typing import Dict, Optional
 # Add current directory to path so imports work correctly
 sys.path.insert(0, os.path.dirname(__file__))
 
-from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query, Request, Response
 from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
 from models import (
+    BatchWebhookPayload,
     PaymentRequest,
     PaymentRecord,
     PaymentStatus,
     PaymentStatusResponse,
+    QRFormat,
+    QRStyle,
     WebhookPayload,
 )
-from utils.upi import build_upi_uri, build_gpay_intent_url, generate_qr_code_bytes
+from expiry import ExpiryScheduler
+from store import DuplicateUTRError, TransactionStore, create_store, normalize_utr
+from utils.compression import CompressionMiddleware
+from utils.structured_log import RequestLogMiddleware, configure_logging
+from utils import tracing
+from utils.upi import build_upi_uri, build_gpay_intent_url, render_qr_variant
+from utils.qr_cache import CachedQR, QRCodeCache
+from utils.qr_pool import QRPoolBusy, QRRenderPool, QRRenderTimeout
+
+configure_logging("gateway")
+log = logging.getLogger("gateway.payments")
 
 # ---------------------------------------------------------------------------
-# In-memory transaction store (replace with a DB for production)
+# Transaction store (GATEWAY_STORE=sqlite by default, "memory" for tests)
 # ---------------------------------------------------------------------------
-transaction_store: Dict[str, PaymentRecord] = {}
-utr_store: Dict[str, str] = {}   # utr_number -> transaction_id
+# Store calls block on SQLite, so handlers make them with asyncio.to_thread
+transaction_store: TransactionStore = create_store()
+expiry = ExpiryScheduler(transaction_store)
 
 # ---------------------------------------------------------------------------
 # Shared webhook secret (set via env var in production)
 # ---------------------------------------------------------------------------
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "supersecret123change_me")
 
+# ---------------------------------------------------------------------------
+# Rendered QR codes (a transaction's UPI URI never changes, so neither does its QR)
+# ---------------------------------------------------------------------------
+qr_cache = QRCodeCache()
+qr_pool = QRRenderPool()
+_qr_inflight: Dict[str, asyncio.Future] = {}   # cache key -> render in progress
+QR_EAGER_RENDER = os.getenv("QR_EAGER_RENDER", "0") == "1"
+QR_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: ensure directories exist
     os.makedirs("static", exist_ok=True)
     os.makedirs("templates", exist_ok=True)
+    qr_pool.start()
+    expiry.rebuild()
+    expiry.start()
     yield
+    await expiry.stop()
+    qr_pool.shutdown()
+    transaction_store.close()
+
+
+def prepare_fork():
+    """serve.py: runs once in the parent before workers are forked."""
+    # SQLite connections must not cross a fork; the
+    # loaded cache and UTR index are inherited by the workers
+    transaction_store.close()
+
+
+def warm_up():
+    """serve.py: runs in each worker before it accepts connections."""
+    transaction_store.reopen()
 
 
 app = FastAPI(
@@ -48,6 +91,12 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+app.add_middleware(CompressionMiddleware)
+# Opt-in span tracing: X-Debug-Trace: <WEBHOOK_SECRET>, or TRACE_SAMPLE_RATE
+app.add_middleware(tracing.TracingMiddleware, secret=WEBHOOK_SECRET)
+# Outermost, so the logged duration covers compression too
+app.add_middleware(RequestLogMiddleware)
+
 # Mount static files directory
 if os.path.isdir("static"):
     app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -67,7 +116,7 @@ async def health():
 # Create a payment session
 # ---------------------------------------------------------------------------
 @app.post("/payment/create", response_model=dict, tags=["Payments"])
-async def create_payment(req: PaymentRequest):
+async def create_payment(req: PaymentRequest, background_tasks: BackgroundTasks):
     """
     Creates a new payment session.
     Returns:
@@ -90,7 +139,14 @@ async def create_payment(req: PaymentRequest):
         payer_name=req.payer_name,
         upi_uri=upi_uri,
     )
-    transaction_store[req.transaction_id] = record
+    await asyncio.to_thread(transaction_store.put, record)
+    expiry.track(record)
+
+    log.info("Payment created", extra={"transaction_id": req.transaction_id, "amount": req.amount})
+
+    if QR_EAGER_RENDER:
+        # Warm the QR cache after the response is sent
+        background_tasks.add_task(_prerender_qr, upi_uri)
 
     return {
         "transaction_id": req.transaction_id,
@@ -109,7 +165,7 @@ async def create_payment(req: PaymentRequest):
 # ---------------------------------------------------------------------------
 @app.get("/payment/{transaction_id}", response_class=HTMLResponse, tags=["Payments"])
 async def payment_page(request: Request, transaction_id: str):
-    record = transaction_store.get(transaction_id)
+    record = await asyncio.to_thread(transaction_store.get, transaction_id)
     if not record:
         raise HTTPException(status_code=404, detail="Transaction not found")
 
@@ -130,28 +186,129 @@ async def payment_page(request: Request, transaction_id: str):
 
 
 # ---------------------------------------------------------------------------
-# QR Code endpoint – returns a PNG image
+# QR Code endpoint – returns a PNG or SVG image
 # ---------------------------------------------------------------------------
+QR_MEDIA_TYPES = {QRFormat.PNG: "image/png", QRFormat.SVG: "image/svg+xml"}
+
+
+async def render_qr(
+    upi_uri: str,
+    fmt: QRFormat = QRFormat.PNG,
+    style: QRStyle = QRStyle.STYLED,
+    size: Optional[int] = None,
+) -> CachedQR:
+    """
+    Returns the cached QR variant for a URI, rendering it in the process pool on a miss.
+    Concurrent misses for the same variant share a single render.
+    """
+    if fmt == QRFormat.SVG:
+        style = QRStyle.PLAIN
+    key = f"{upi_uri}|{fmt.value}|{style.value}|{size or ''}"
+    entry = qr_cache.get(key)
+    if entry is not None:
+        return entry
+
+    inflight = _qr_inflight.get(key)
+    if inflight is not None:
+        return await asyncio.shield(inflight)
+
+    inflight = asyncio.get_running_loop().create_future()
+    _qr_inflight[key] = inflight
+    try:
+        with tracing.span("qr.render", fmt=fmt.value, style=style.value):
+            content, seconds = await qr_pool.submit(
+                render_qr_variant, upi_uri, fmt.value, style.value, size
+            )
+        qr_cache.record_render(seconds)
+        entry = qr_cache.put(key, content)
+        inflight.set_result(entry)
+        return entry
+    except asyncio.CancelledError:
+        inflight.cancel()
+        raise
+    except Exception as e:
+        inflight.set_exception(e)
+        inflight.exception()  # followers re-raise it; don't warn if there are none
+        raise
+    finally:
+        _qr_inflight.pop(key, None)
+
+
+async def _prerender_qr(upi_uri: str):
+    try:
+        await render_qr(upi_uri)
+    except (QRPoolBusy, QRRenderTimeout):
+        pass  # best effort; the QR endpoint will render on demand
+
+
 @app.get("/payment/{transaction_id}/qr", tags=["Payments"])
-async def payment_qr(transaction_id: str):
-    record = transaction_store.get(transaction_id)
+async def payment_qr(
+    request: Request,
+    transaction_id: str,
+    fmt: QRFormat = Query(QRFormat.PNG, alias="format"),
+    style: QRStyle = QRStyle.STYLED,
+    size: Optional[int] = Query(None, ge=64, le=1024, description="Approximate width in pixels"),
+):
+    """
+    QR code for a transaction.
+    Defaults to the styled PNG; `style=plain` or `format=svg` give small,
+    fast-rendering codes for mobile clients.
+    """
+    record = await asyncio.to_thread(transaction_store.get, transaction_id)
     if not record:
         raise HTTPException(status_code=404, detail="Transaction not found")
 
-    png_bytes = generate_qr_code_bytes(record.upi_uri)
-    return Response(content=png_bytes, media_type="image/png")
+    if size:
+        # Bucket sizes so clients can't fill the cache with near-identical variants
+        size = 32 * round(size / 32)
+
+    try:
+        entry = await render_qr(record.upi_uri, fmt, style, size)
+    except QRPoolBusy:
+        raise HTTPException(
+            status_code=503, detail="QR renderer is busy, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    except QRRenderTimeout:
+        raise HTTPException(
+            status_code=503, detail="QR rendering timed out, retry shortly",
+            headers={"Retry-After": "2"},
+        )
+    headers = {"ETag": entry.etag, "Cache-Control": QR_CACHE_CONTROL}
+    if entry.etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.content, media_type=QR_MEDIA_TYPES[fmt], headers=headers)
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+@app.get("/metrics/payments", tags=["Utility"])
+async def payment_metrics():
+    """Live (pending) vs expired/terminal sessions tracked by the expiry scheduler."""
+    return expiry.stats()
+
+
+@app.get("/metrics/qr", tags=["Utility"])
+async def qr_metrics():
+    return {**qr_cache.stats(), "pool": qr_pool.stats()}
 
 
 # ---------------------------------------------------------------------------
 # Payment status check
 # ---------------------------------------------------------------------------
+def _record_and_utr(transaction_id: str):
+    record = transaction_store.get(transaction_id)
+    return record, (transaction_store.get_utr(transaction_id) if record else None)
+
+
 @app.get(
     "/payment/{transaction_id}/status",
     response_model=PaymentStatusResponse,
     tags=["Payments"],
 )
 async def payment_status(transaction_id: str):
-    record = transaction_store.get(transaction_id)
+    record, utr = await asyncio.to_thread(_record_and_utr, transaction_id)
     if not record:
         raise HTTPException(status_code=404, detail="Transaction not found")
 
@@ -162,8 +319,6 @@ async def payment_status(transaction_id: str):
         PaymentStatus.EXPIRED: "Payment link has expired.",
     }
 
-    utr = utr_store.get(transaction_id)
-
     return PaymentStatusResponse(
         transaction_id=record.transaction_id,
         amount=record.amount,
@@ -173,6 +328,16 @@ async def payment_status(transaction_id: str):
     )
 
 
+def _record_utr(transaction_id: str, utr_number: str):
+    try:
+        transaction_store.set_utr(transaction_id, utr_number)
+    except DuplicateUTRError as e:
+        log.warning("Duplicate UTR rejected", extra={
+            "transaction_id": transaction_id, "utr_number": e.utr_number, "owner": e.owner,
+        })
+        raise HTTPException(status_code=409, detail=str(e))
+
+
 # ---------------------------------------------------------------------------
 # Webhook – receives payment confirmation from middleware / manual tool
 # ---------------------------------------------------------------------------
@@ -191,15 +356,22 @@ async def payment_webhook(payload: WebhookPayload):
     if payload.secret_key != WEBHOOK_SECRET:
         raise HTTPException(status_code=403, detail="Invalid webhook secret")
 
-    record = transaction_store.get(payload.transaction_id)
+    record = await asyncio.to_thread(transaction_store.get, payload.transaction_id)
     if not record:
         raise HTTPException(status_code=404, detail="Transaction not found")
 
+    # Record the UTR first: a UTR already used for another payment rejects the update
+    if payload.upi_transaction_id:
+        await asyncio.to_thread(_record_utr, payload.transaction_id, payload.upi_transaction_id)
+
     record.status = payload.status
     record.updated_at = time.time()
+    await asyncio.to_thread(transaction_store.put, record)
+    expiry.track(record)
 
-    if payload.upi_transaction_id:
-        utr_store[payload.transaction_id] = payload.upi_transaction_id
+    log.info("Payment status updated by webhook", extra={
+        "transaction_id": payload.transaction_id, "status": payload.status,
+    })
 
     return {
         "message": f"Transaction {payload.transaction_id} updated to {payload.status}",
@@ -208,6 +380,78 @@ async def payment_webhook(payload: WebhookPayload):
     }
 
 
+@app.post("/webhook/payment/batch", tags=["Webhook"])
+async def payment_webhook_batch(payload: BatchWebhookPayload):
+    """
+    Applies many status updates in one request (up to 10,000).
+    The secret is checked once; all updates are written to the store together.
+    Returns one result per update, in request order. An update whose UTR is
+    already recorded for another transaction (or earlier in the batch for a
+    different one) fails. With `all_or_nothing`, a single failed update
+    rejects the whole batch with 409.
+    """
+    if payload.secret_key != WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid webhook secret")
+
+    records, results, failed = await asyncio.to_thread(_apply_batch, payload)
+    if records is None:
+        return JSONResponse(
+            status_code=409,
+            content={"applied": 0, "failed": failed, "results": results},
+        )
+    for record in records:
+        expiry.track(record)
+    log.info("Batch webhook applied", extra={"applied": len(results) - failed, "failed": failed})
+
+    return {"applied": len(results) - failed, "failed": failed, "results": results}
+
+
+def _apply_batch(payload: BatchWebhookPayload):
+    """
+    Validate and write a batch webhook (in a worker thread). Returns the
+    written records (None if `all_or_nothing` rejected the batch), the
+    per-update results and the number of failed updates.
+    """
+    records = {}
+    results = []
+    accepted = []
+    batch_utrs: Dict[str, str] = {}   # normalized UTR -> transaction_id, within this batch
+    for item in payload.updates:
+        record = records.get(item.transaction_id) or transaction_store.get(item.transaction_id)
+        if record is None:
+            results.append({"transaction_id": item.transaction_id, "ok": False, "error": "Transaction not found"})
+            continue
+        if item.upi_transaction_id:
+            utr = normalize_utr(item.upi_transaction_id)
+            owner = batch_utrs.get(utr) or transaction_store.utr_owner(utr)
+            if owner is not None and owner != item.transaction_id:
+                results.append({
+                    "transaction_id": item.transaction_id, "ok": False,
+                    "error": f"UTR {utr} is already recorded for transaction {owner}",
+                })
+                continue
+            batch_utrs[utr] = item.transaction_id
+        records[item.transaction_id] = record
+        accepted.append(item)
+        results.append({"transaction_id": item.transaction_id, "ok": True, "status": item.status})
+
+    failed = sum(not r["ok"] for r in results)
+    if failed and payload.all_or_nothing:
+        return None, results, failed
+
+    # Validation done: mutate and persist in one go
+    now = time.time()
+    utrs = {}
+    for item in accepted:
+        record = records[item.transaction_id]
+        record.status = item.status
+        record.updated_at = now
+        if item.upi_transaction_id:
+            utrs[item.transaction_id] = item.upi_transaction_id
+    transaction_store.put_many(list(records.values()), utrs)
+    return list(records.values()), results, failed
+
+
 # ---------------------------------------------------------------------------
 # Manual status update (admin tool) – useful for confirming via bank app
 # ---------------------------------------------------------------------------
@@ -224,15 +468,19 @@ async def admin_confirm_payment(
     if secret != WEBHOOK_SECRET:
         raise HTTPException(status_code=403, detail="Invalid secret")
 
-    record = transaction_store.get(transaction_id)
+    record = await asyncio.to_thread(transaction_store.get, transaction_id)
     if not record:
         raise HTTPException(status_code=404, detail="Transaction not found")
 
+    if utr_number:
+        await asyncio.to_thread(_record_utr, transaction_id, utr_number)
+
     record.status = PaymentStatus.SUCCESS
     record.updated_at = time.time()
+    await asyncio.to_thread(transaction_store.put, record)
+    expiry.track(record)
 
-    if utr_number:
-        utr_store[transaction_id] = utr_number
+    log.info("Payment confirmed by admin", extra={"transaction_id": transaction_id, "utr_number": utr_number})
 
     return {
         "message": "Payment confirmed successfully",
@@ -245,17 +493,41 @@ async def admin_confirm_payment(
 # List all transactions (admin overview)
 # ---------------------------------------------------------------------------
 @app.get("/admin/transactions", tags=["Admin"])
-async def list_transactions(secret: str = ""):
+async def list_transactions(
+    secret: str = "",
+    status: Optional[PaymentStatus] = None,
+    created_from: Optional[float] = Query(None, description="Unix timestamp, inclusive"),
+    created_to: Optional[float] = Query(None, description="Unix timestamp, inclusive"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Newest-first page of transactions, optionally filtered by status and
+    creation time. Pass `next_cursor` back as `cursor` to get the next page.
+    """
     if secret != WEBHOOK_SECRET:
         raise HTTPException(status_code=403, detail="Invalid secret")
-    return [
-        {
-            "transaction_id": r.transaction_id,
-            "amount": r.amount,
-            "note": r.note,
-            "status": r.status,
-            "created_at": r.created_at,
-            "updated_at": r.updated_at,
-        }
-        for r in transaction_store.values()
-    ]
+    try:
+        records, next_cursor = await asyncio.to_thread(
+            transaction_store.page, status, created_from, created_to, cursor, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "items": [
+            {
+                "transaction_id": r.transaction_id,
+                "amount": r.amount,
+                "note": r.note,
+                "status": r.status,
+                "created_at": r.created_at,
+                "updated_at": r.updated_at,
+            }
+            for r in records
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+# After every route is registered
+tracing.instrument_endpoints(app)
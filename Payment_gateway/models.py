@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from enum import Enum
 import uuid
 import time
@@ -12,6 +12,16 @@ class PaymentStatus(str, Enum):
     EXPIRED = "EXPIRED"
 
 
+class QRFormat(str, Enum):
+    PNG = "png"
+    SVG = "svg"
+
+
+class QRStyle(str, Enum):
+    STYLED = "styled"
+    PLAIN = "plain"
+
+
 class PaymentRequest(BaseModel):
     amount: float = Field(..., gt=0, description="Amount in INR (must be > 0)")
     note: Optional[str] = Field(default="Payment", description="Transaction note")
@@ -53,6 +63,30 @@ class WebhookPayload(BaseModel):
     secret_key: str = Field(..., description="Shared secret for webhook verification")
 
 
+class BatchWebhookItem(BaseModel):
+    transaction_id: str
+    status: PaymentStatus
+    upi_transaction_id: Optional[str] = Field(
+        default=None, description="UTR number from the UPI transaction"
+    )
+    payer_vpa: Optional[str] = Field(
+        default=None, description="Payer's VPA (UPI ID)"
+    )
+
+
+class BatchWebhookPayload(BaseModel):
+    """
+    Many status updates in one call, e.g. from a reconciliation tool
+    after a bank statement download. Authenticated once for the whole batch.
+    """
+    secret_key: str = Field(..., description="Shared secret for webhook verification")
+    updates: List[BatchWebhookItem] = Field(..., min_length=1, max_length=10000)
+    all_or_nothing: bool = Field(
+        default=False,
+        description="Apply nothing if any update fails: an unknown transaction, or a UTR already used by another transaction (or repeated for a different one in the batch)",
+    )
+
+
 class PaymentStatusResponse(BaseModel):
     transaction_id: str
     amount: float
@@ -0,0 +1,17 @@
+"""
+Production entry point for the gateway: preforked, warmed-up uvicorn workers.
+
+    python serve.py [--workers N] [--port 8000]
+
+See utils/launcher.py for the environment variables.
+"""
+
+import os
+
+from utils.launcher import main
+
+if __name__ == "__main__":
+    # Workers are forked from a preloaded parent and recycled, so even a
+    # single worker has to pick up writes its predecessors made
+    os.environ.setdefault("GATEWAY_SHARED", "1")
+    main("main:app", prepare="main:prepare_fork", warm_up="main:warm_up")
@@ -0,0 +1,737 @@
+"""
+Transaction storage for the payment gateway.
+
+`MemoryTransactionStore` keeps everything in dicts (tests, local dev).
+`SQLiteTransactionStore` persists to a WAL-mode SQLite file so pending
+payments survive restarts and redeploys. `put()`, `set_utr()` and
+`put_many()` return once their write is committed, so an acknowledged
+payment or confirmation survives a crash of the process (with
+synchronous=NORMAL a power loss can still drop the last commits). Writers
+that arrive while a commit is in progress are committed together in the
+next one. Reads go through a bounded LRU of hot records before falling back
+to the database. All calls block on SQLite: async code runs them in a
+thread (asyncio.to_thread).
+
+Records handed out by the store are live objects: after mutating one,
+call `put()` again so the change is persisted.
+
+Both stores index transactions by status and by `created_at`, so
+`page()` costs the size of the page rather than the whole history.
+
+UTR numbers are unique: each can confirm only one transaction. Both stores
+keep a two-way UTR index in memory (rebuilt from the `utrs` table in one
+pass at startup), so `set_utr` rejects a reused UTR with DuplicateUTRError
+without scanning, and `utr_owner` answers "which transaction has this UTR".
+
+For multi-worker deployments the SQLite store has a shared mode: writes go
+straight to disk and are recorded in a `changes` log, and every read first
+checks `PRAGMA data_version` (which changes when another process commits)
+to drop cache entries other workers have modified.
+"""
+
+import base64
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from models import PaymentRecord, PaymentStatus
+from utils.tracing import span
+
+log = logging.getLogger("gateway.store")
+
+
+GATEWAY_STORE = os.getenv("GATEWAY_STORE", "sqlite")
+GATEWAY_DB_PATH = os.getenv(
+    "GATEWAY_DB_PATH", os.path.join(os.path.dirname(__file__), "gateway.db")
+)
+GATEWAY_STORE_CACHE_SIZE = int(os.getenv("GATEWAY_STORE_CACHE_SIZE", "10000"))
+# Shared mode is needed as soon as uvicorn runs more than one worker
+GATEWAY_SHARED = os.getenv(
+    "GATEWAY_SHARED", "1" if int(os.getenv("WEB_CONCURRENCY", "1")) > 1 else "0"
+) == "1"
+CHANGE_LOG_KEEP = 10000
+
+# Position in the (created_at, transaction_id) ordering used for pagination
+IndexKey = Tuple[float, str]
+
+
+class DuplicateUTRError(ValueError):
+    def __init__(self, utr_number: str, owner: str):
+        super().__init__(f"UTR {utr_number} is already recorded for transaction {owner}")
+        self.utr_number = utr_number
+        self.owner = owner
+
+
+def normalize_utr(utr_number: str) -> str:
+    return utr_number.strip().upper()
+
+
+class UTRIndex:
+    """transaction_id <-> utr_number, one UTR per transaction and vice versa. Not thread-safe."""
+
+    def __init__(self):
+        self.by_transaction: Dict[str, str] = {}
+        self.by_utr: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.by_transaction)
+
+    def get(self, transaction_id: str) -> Optional[str]:
+        return self.by_transaction.get(transaction_id)
+
+    def owner(self, utr_number: str) -> Optional[str]:
+        return self.by_utr.get(utr_number)
+
+    def check(self, transaction_id: str, utr_number: str):
+        owner = self.by_utr.get(utr_number)
+        if owner is not None and owner != transaction_id:
+            raise DuplicateUTRError(utr_number, owner)
+
+    def set(self, transaction_id: str, utr_number: str):
+        """Record a UTR (replacing the transaction's previous one). Raises DuplicateUTRError."""
+        self.check(transaction_id, utr_number)
+        self.force(transaction_id, utr_number)
+
+    def force(self, transaction_id: str, utr_number: str):
+        # Loading persisted rows: the database is the authority
+        previous = self.by_transaction.get(transaction_id)
+        if previous is not None and self.by_utr.get(previous) == transaction_id:
+            del self.by_utr[previous]
+        self.by_transaction[transaction_id] = utr_number
+        self.by_utr[utr_number] = transaction_id
+
+    def discard(self, transaction_id: str):
+        utr_number = self.by_transaction.pop(transaction_id, None)
+        if utr_number is not None and self.by_utr.get(utr_number) == transaction_id:
+            del self.by_utr[utr_number]
+
+
+def encode_cursor(key: IndexKey) -> str:
+    return base64.urlsafe_b64encode(f"{key[0]!r}|{key[1]}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> IndexKey:
+    """Raises ValueError for a malformed cursor."""
+    try:
+        created_at, _, transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition("|")
+        return float(created_at), transaction_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class TransactionStore(ABC):
+    """Interface shared by all gateway stores."""
+
+    @abstractmethod
+    def get(self, transaction_id: str) -> Optional[PaymentRecord]:
+        ...
+
+    @abstractmethod
+    def put(self, record: PaymentRecord) -> None:
+        ...
+
+    @abstractmethod
+    def values(self) -> Iterator[PaymentRecord]:
+        ...
+
+    @abstractmethod
+    def get_utr(self, transaction_id: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set_utr(self, transaction_id: str, utr_number: str) -> None:
+        """Raises DuplicateUTRError if another transaction already has the UTR."""
+
+    @abstractmethod
+    def utr_owner(self, utr_number: str) -> Optional[str]:
+        """The transaction a UTR is recorded for, if any."""
+
+    @abstractmethod
+    def evict(self, transaction_id: str) -> None:
+        """Drop a record from the hot (in-memory) set."""
+
+    @abstractmethod
+    def query(
+        self,
+        status: Optional[PaymentStatus] = None,
+        created_from: Optional[float] = None,
+        created_to: Optional[float] = None,
+        before: Optional[IndexKey] = None,
+        limit: int = 100,
+    ) -> List[PaymentRecord]:
+        """
+        Newest-first records matching the filters, strictly older than
+        `before` in (created_at, transaction_id) order.
+        """
+
+    def page(
+        self,
+        status: Optional[PaymentStatus] = None,
+        created_from: Optional[float] = None,
+        created_to: Optional[float] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[PaymentRecord], Optional[str]]:
+        """One page of query() results plus the cursor for the next page (None at the end)."""
+        before = decode_cursor(cursor) if cursor else None
+        records = self.query(status, created_from, created_to, before, limit)
+        next_cursor = None
+        if len(records) == limit:
+            last = records[-1]
+            next_cursor = encode_cursor((last.created_at, last.transaction_id))
+        return records, next_cursor
+
+    def mark_expired(self, transaction_id: str, now: float) -> bool:
+        """
+        Atomically move a PENDING transaction to EXPIRED.
+        Returns False if it is unknown or no longer pending.
+        """
+        record = self.get(transaction_id)
+        if record is None or record.status != PaymentStatus.PENDING:
+            return False
+        # A new object: handlers may be changing the one they hold right now
+        self.put(record.model_copy(update={"status": PaymentStatus.EXPIRED, "updated_at": now}))
+        return True
+
+    def expire_many(self, transaction_ids: List[str], now: float) -> List[str]:
+        """mark_expired() for a batch. Returns the ids that were moved to EXPIRED."""
+        return [t for t in transaction_ids if self.mark_expired(t, now)]
+
+    def put_many(self, records: List[PaymentRecord], utrs: Dict[str, str]) -> None:
+        """
+        Store a batch of records and UTRs together. Persistent stores write
+        the whole batch in a single database transaction. UTRs must have been
+        checked with utr_owner() first; a UTR that turns out to be taken is
+        skipped (and logged) rather than failing the batch.
+        """
+        for record in records:
+            self.put(record)
+        for transaction_id, utr_number in utrs.items():
+            try:
+                self.set_utr(transaction_id, utr_number)
+            except DuplicateUTRError as e:
+                log.warning("Skipped duplicate UTR in batch: %s", e, extra={"transaction_id": transaction_id})
+        self.flush()
+
+    def flush(self) -> None:
+        """Persist any queued writes."""
+
+    def close(self) -> None:
+        self.flush()
+
+    def reopen(self) -> None:
+        """
+        Reconnect after close() in a process forked from the one that closed
+        it (serve.py preloads the app). In-memory state copied from the parent
+        is kept and brought up to date.
+        """
+
+    def __contains__(self, transaction_id: str) -> bool:
+        return self.get(transaction_id) is not None
+
+
+class MemoryTransactionStore(TransactionStore):
+    def __init__(self):
+        # Expiry runs in a worker thread (see expiry.py)
+        self._lock = threading.RLock()
+        self.transactions: Dict[str, PaymentRecord] = {}
+        self.utrs = UTRIndex()
+        # Sorted (created_at, transaction_id) keys, overall and per status
+        self._by_created: List[IndexKey] = []
+        self._by_status: Dict[PaymentStatus, List[IndexKey]] = {s: [] for s in PaymentStatus}
+        # Status each transaction is currently indexed under (records mutate in place)
+        self._indexed_status: Dict[str, PaymentStatus] = {}
+
+    @staticmethod
+    def _remove_key(index: List[IndexKey], key: IndexKey):
+        i = bisect_left(index, key)
+        if i < len(index) and index[i] == key:
+            del index[i]
+
+    def get(self, transaction_id: str) -> Optional[PaymentRecord]:
+        return self.transactions.get(transaction_id)
+
+    def put(self, record: PaymentRecord) -> None:
+        key = (record.created_at, record.transaction_id)
+        with self._lock:
+            old_status = self._indexed_status.get(record.transaction_id)
+            if old_status is None:
+                insort(self._by_created, key)
+            if old_status != record.status:
+                if old_status is not None:
+                    self._remove_key(self._by_status[old_status], key)
+                insort(self._by_status[record.status], key)
+                self._indexed_status[record.transaction_id] = record.status
+            self.transactions[record.transaction_id] = record
+
+    def mark_expired(self, transaction_id: str, now: float) -> bool:
+        with self._lock:
+            return super().mark_expired(transaction_id, now)
+
+    def values(self) -> Iterator[PaymentRecord]:
+        with self._lock:
+            return iter(list(self.transactions.values()))
+
+    def get_utr(self, transaction_id: str) -> Optional[str]:
+        return self.utrs.get(transaction_id)
+
+    def set_utr(self, transaction_id: str, utr_number: str) -> None:
+        with self._lock:
+            self.utrs.set(transaction_id, normalize_utr(utr_number))
+
+    def utr_owner(self, utr_number: str) -> Optional[str]:
+        return self.utrs.owner(normalize_utr(utr_number))
+
+    def evict(self, transaction_id: str) -> None:
+        # Memory is the only tier here, so evicting forgets the record
+        with self._lock:
+            record = self.transactions.pop(transaction_id, None)
+            self.utrs.discard(transaction_id)
+            status = self._indexed_status.pop(transaction_id, None)
+            if record is not None:
+                key = (record.created_at, transaction_id)
+                self._remove_key(self._by_created, key)
+                if status is not None:
+                    self._remove_key(self._by_status[status], key)
+
+    def query(self, status=None, created_from=None, created_to=None, before=None, limit=100):
+        with self._lock:
+            index = self._by_created if status is None else self._by_status[status]
+            hi = len(index)
+            if created_to is not None:
+                hi = bisect_right(index, (created_to, "\uffff"))
+            if before is not None:
+                hi = min(hi, bisect_left(index, before))
+            lo = 0 if created_from is None else bisect_left(index, (created_from, ""))
+            keys = index[max(lo, hi - limit):hi]
+            return [self.transactions[txn_id] for _, txn_id in reversed(keys)]
+
+    def __len__(self) -> int:
+        return len(self.transactions)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id TEXT PRIMARY KEY,
+    amount         REAL NOT NULL,
+    note           TEXT NOT NULL,
+    payer_name     TEXT,
+    upi_uri        TEXT NOT NULL,
+    status         TEXT NOT NULL,
+    created_at     REAL NOT NULL,
+    updated_at     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_transactions_status_created
+    ON transactions (status, created_at, transaction_id);
+CREATE INDEX IF NOT EXISTS ix_transactions_created
+    ON transactions (created_at, transaction_id);
+CREATE TABLE IF NOT EXISTS utrs (
+    transaction_id TEXT PRIMARY KEY,
+    utr_number     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq            INTEGER PRIMARY KEY AUTOINCREMENT,
+    transaction_id TEXT NOT NULL
+);
+"""
+
+# Databases from before UTRs were unique may hold duplicates, so this is
+# created separately and tolerated if it fails
+_UTR_UNIQUE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS ux_utrs_utr_number ON utrs (utr_number)"
+
+_COLUMNS = ("transaction_id", "amount", "note", "payer_name", "upi_uri", "status", "created_at", "updated_at")
+
+_UPSERT_TRANSACTION = (
+    f"INSERT INTO transactions ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))}) "
+    "ON CONFLICT(transaction_id) DO UPDATE SET "
+    + ", ".join(f"{c} = excluded.{c}" for c in _COLUMNS[1:])
+)
+# Skips (rather than fails on) a UTR another worker recorded for a different
+# transaction, so one conflict can't wedge a whole write batch
+_UPSERT_UTR = (
+    "INSERT INTO utrs (transaction_id, utr_number) SELECT ?1, ?2 "
+    "WHERE NOT EXISTS (SELECT 1 FROM utrs WHERE utr_number = ?2 AND transaction_id != ?1) "
+    "ON CONFLICT(transaction_id) DO UPDATE SET utr_number = excluded.utr_number"
+)
+
+
+def _to_row(record: PaymentRecord) -> tuple:
+    return (
+        record.transaction_id, record.amount, record.note, record.payer_name,
+        record.upi_uri, record.status.value, record.created_at, record.updated_at,
+    )
+
+
+def _from_row(row: tuple) -> PaymentRecord:
+    return PaymentRecord(**dict(zip(_COLUMNS, row)))
+
+
+class SQLiteTransactionStore(TransactionStore):
+    def __init__(
+        self,
+        path: str = GATEWAY_DB_PATH,
+        cache_size: int = GATEWAY_STORE_CACHE_SIZE,
+        shared: bool = GATEWAY_SHARED,
+    ):
+        self.path = path
+        self.cache_size = cache_size
+        self.shared = shared
+
+        self._conn = self._connect()
+        self._conn.executescript(_SCHEMA)
+        try:
+            self._conn.execute(_UTR_UNIQUE_INDEX)
+        except sqlite3.IntegrityError:
+            log.warning("Gateway DB has duplicate UTRs; uniqueness is enforced for new UTRs only")
+        self._db_lock = threading.Lock()
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        self._change_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self._flushes = 0
+
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, PaymentRecord]" = OrderedDict()
+        self._pending: Dict[str, tuple] = {}        # transaction_id -> row, until committed
+        self._pending_utrs: Dict[str, str] = {}     # transaction_id -> utr_number, until committed
+        self._utrs = UTRIndex()                     # every persisted + pending UTR
+
+        self._warm()
+        self._load_utrs()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=5000")
+        for attempt in range(50):
+            # Workers starting together race on switching the file to WAL,
+            # which ignores busy_timeout
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                break
+            except sqlite3.OperationalError:
+                if attempt == 49:
+                    raise
+                time.sleep(0.1)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # -- cache ---------------------------------------------------------------
+
+    def _remember(self, record: PaymentRecord):
+        # Caller holds self._lock
+        self._cache[record.transaction_id] = record
+        self._cache.move_to_end(record.transaction_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _sync(self):
+        """Shared mode: forget cached records that other processes changed."""
+        if not self.shared:
+            return
+        with span("store.sync", "db"), self._db_lock:
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_version:
+                return
+            self._data_version = version
+            oldest = self._conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+            changed = self._conn.execute(
+                "SELECT seq, transaction_id FROM changes WHERE seq > ? ORDER BY seq",
+                (self._change_seq,),
+            ).fetchall()
+        with self._lock:
+            if oldest is not None and oldest > self._change_seq + 1:
+                # Log was pruned past our position: we can't tell what changed
+                self._cache.clear()
+                reload_utrs = None
+            else:
+                for _, transaction_id in changed:
+                    self._cache.pop(transaction_id, None)
+                reload_utrs = {transaction_id for _, transaction_id in changed}
+        if reload_utrs is None:
+            self._load_utrs()
+        elif reload_utrs:
+            self._load_utrs(list(reload_utrs))
+        if changed:
+            self._change_seq = changed[-1][0]
+
+    def _warm(self):
+        # Pending payments are the ones customers are actively polling
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM transactions WHERE status = ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (PaymentStatus.PENDING.value, self.cache_size),
+            ).fetchall()
+        with self._lock:
+            for row in reversed(rows):
+                self._remember(_from_row(row))
+
+    def _load_utrs(self, transaction_ids: Optional[List[str]] = None):
+        """Fill the UTR index from the database: everything, or just these transactions."""
+        with self._db_lock:
+            if transaction_ids is None:
+                rows = self._conn.execute("SELECT transaction_id, utr_number FROM utrs").fetchall()
+            else:
+                rows = []
+                for i in range(0, len(transaction_ids), 500):
+                    chunk = transaction_ids[i:i + 500]
+                    rows += self._conn.execute(
+                        f"SELECT transaction_id, utr_number FROM utrs "
+                        f"WHERE transaction_id IN ({', '.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+        with self._lock:
+            if transaction_ids is None:
+                self._utrs = UTRIndex()
+            else:
+                for transaction_id in transaction_ids:
+                    self._utrs.discard(transaction_id)
+            for transaction_id, utr_number in rows:
+                self._utrs.force(transaction_id, utr_number)
+            for transaction_id, utr_number in self._pending_utrs.items():
+                self._utrs.force(transaction_id, utr_number)
+
+    # -- writes --------------------------------------------------------------
+
+    def put(self, record: PaymentRecord) -> None:
+        with self._lock:
+            self._remember(record)
+            self._pending[record.transaction_id] = _to_row(record)
+        self.flush()
+
+    def set_utr(self, transaction_id: str, utr_number: str) -> None:
+        utr_number = normalize_utr(utr_number)
+        self._sync()
+        with self._lock:
+            self._utrs.set(transaction_id, utr_number)
+            self._pending_utrs[transaction_id] = utr_number
+        self.flush()
+        if self.shared:
+            # Another worker may have recorded it between our sync and commit
+            owner = self._utr_owner_in_db(utr_number)
+            if owner != transaction_id:
+                self._load_utrs([t for t in (transaction_id, owner) if t is not None])
+                raise DuplicateUTRError(utr_number, owner)
+
+    def put_many(self, records: List[PaymentRecord], utrs: Dict[str, str]) -> None:
+        # Queue everything first so shared mode still commits one transaction
+        self._sync()
+        with self._lock:
+            for record in records:
+                self._remember(record)
+                self._pending[record.transaction_id] = _to_row(record)
+            for transaction_id, utr_number in utrs.items():
+                utr_number = normalize_utr(utr_number)
+                try:
+                    self._utrs.set(transaction_id, utr_number)
+                except DuplicateUTRError as e:
+                    log.warning("Skipped duplicate UTR in batch: %s", e, extra={"transaction_id": transaction_id})
+                    continue
+                self._pending_utrs[transaction_id] = utr_number
+        self.flush()
+
+    def flush(self) -> None:
+        # Taking the queue under the DB lock makes a caller whose write is in
+        # another thread's commit wait for that commit (group commit)
+        with self._db_lock:
+            with self._lock:
+                rows, self._pending = list(self._pending.values()), {}
+                utrs, self._pending_utrs = list(self._pending_utrs.items()), {}
+            if not rows and not utrs:
+                return
+            self._commit(rows, utrs)
+
+    def _commit(self, rows: List[tuple], utrs: List[Tuple[str, str]]):
+        # Caller holds self._db_lock
+        with span("store.flush", "db", rows=len(rows), utrs=len(utrs)):
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if rows:
+                    self._conn.executemany(_UPSERT_TRANSACTION, rows)
+                if utrs:
+                    written = self._conn.executemany(_UPSERT_UTR, utrs).rowcount
+                    if written < len(utrs):
+                        log.warning("Skipped %d UTRs already recorded by another worker", len(utrs) - written)
+                if self.shared:
+                    self._log_changes([row[0] for row in rows] + [txn_id for txn_id, _ in utrs])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                # Put the batch back so the next flush retries it
+                with self._lock:
+                    for row in rows:
+                        self._pending.setdefault(row[0], row)
+                    for txn_id, utr in utrs:
+                        self._pending_utrs.setdefault(txn_id, utr)
+                raise
+
+    def _log_changes(self, transaction_ids: List[str]):
+        # Caller holds self._db_lock inside an open transaction
+        self._conn.executemany(
+            "INSERT INTO changes (transaction_id) VALUES (?)", [(t,) for t in transaction_ids]
+        )
+        self._flushes += 1
+        if self._flushes % 256 == 0:
+            self._conn.execute(
+                "DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?",
+                (CHANGE_LOG_KEEP,),
+            )
+
+    def mark_expired(self, transaction_id: str, now: float) -> bool:
+        return bool(self.expire_many([transaction_id], now))
+
+    def expire_many(self, transaction_ids: List[str], now: float) -> List[str]:
+        # Conditional UPDATE so a concurrent SUCCESS from another worker is
+        # never overwritten; the write lock is held from the SELECT on, so
+        # the ids read are exactly the ones updated
+        self.flush()
+        expired: List[str] = []
+        with span("store.expire", "db", transactions=len(transaction_ids)), self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for i in range(0, len(transaction_ids), 500):
+                    chunk = transaction_ids[i:i + 500]
+                    where = f"WHERE status = ? AND transaction_id IN ({', '.join('?' * len(chunk))})"
+                    params = (PaymentStatus.PENDING.value, *chunk)
+                    ids = [row[0] for row in self._conn.execute(f"SELECT transaction_id FROM transactions {where}", params)]
+                    if ids:
+                        self._conn.execute(
+                            f"UPDATE transactions SET status = ?, updated_at = ? {where}",
+                            (PaymentStatus.EXPIRED.value, now, *params),
+                        )
+                        expired += ids
+                if expired and self.shared:
+                    self._log_changes(expired)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        # Drop rather than update the cached records: they are live objects a
+        # webhook may be changing in another thread. Reads reload from SQLite.
+        with self._lock:
+            for transaction_id in transaction_ids:
+                self._cache.pop(transaction_id, None)
+        return expired
+
+    def evict(self, transaction_id: str) -> None:
+        # The record remains readable from SQLite
+        with self._lock:
+            self._cache.pop(transaction_id, None)
+
+    def close(self) -> None:
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+    def reopen(self) -> None:
+        self._conn = self._connect()
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        if self.shared:
+            # Catch up through the change log from where the parent stopped
+            self._data_version = None
+            self._sync()
+        else:
+            with self._lock:
+                self._cache.clear()
+            self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            self._warm()
+            self._load_utrs()
+
+    # -- reads ---------------------------------------------------------------
+
+    def get(self, transaction_id: str) -> Optional[PaymentRecord]:
+        self._sync()
+        with self._lock:
+            record = self._cache.get(transaction_id)
+            if record is not None:
+                self._cache.move_to_end(transaction_id)
+                return record
+            row = self._pending.get(transaction_id)
+        if row is None:
+            with span("store.read_miss", "db"), self._db_lock:
+                row = self._conn.execute(
+                    f"SELECT {', '.join(_COLUMNS)} FROM transactions WHERE transaction_id = ?",
+                    (transaction_id,),
+                ).fetchone()
+        if row is None:
+            return None
+        record = _from_row(row)
+        with self._lock:
+            # Another thread may have cached it meanwhile; keep a single live object
+            record = self._cache.get(transaction_id, record)
+            self._remember(record)
+        return record
+
+    def values(self) -> Iterator[PaymentRecord]:
+        self._sync()
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM transactions").fetchall()
+        with self._lock:
+            cached = dict(self._cache)
+        for row in rows:
+            yield cached.get(row[0]) or _from_row(row)
+
+    def query(self, status=None, created_from=None, created_to=None, before=None, limit=100):
+        clauses, params = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(PaymentStatus(status).value)
+        if created_from is not None:
+            clauses.append("created_at >= ?")
+            params.append(created_from)
+        if created_to is not None:
+            clauses.append("created_at <= ?")
+            params.append(created_to)
+        if before is not None:
+            clauses.append("(created_at, transaction_id) < (?, ?)")
+            params.extend(before)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+
+        self._sync()
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM transactions {where}"
+                "ORDER BY created_at DESC, transaction_id DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        with self._lock:
+            return [self._cache.get(row[0]) or _from_row(row) for row in rows]
+
+    def get_utr(self, transaction_id: str) -> Optional[str]:
+        self._sync()
+        with self._lock:
+            return self._utrs.get(transaction_id)
+
+    def utr_owner(self, utr_number: str) -> Optional[str]:
+        self._sync()
+        with self._lock:
+            return self._utrs.owner(normalize_utr(utr_number))
+
+    def _utr_owner_in_db(self, utr_number: str) -> Optional[str]:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT transaction_id FROM utrs WHERE utr_number = ?", (utr_number,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def __len__(self) -> int:
+        self.flush()
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+
+
+def create_store(kind: str = GATEWAY_STORE) -> TransactionStore:
+    if kind == "memory":
+        if GATEWAY_SHARED:
+            log.warning("GATEWAY_STORE=memory is per-process; workers will not see each other's transactions")
+        return MemoryTransactionStore()
+    if kind == "sqlite":
+        return SQLiteTransactionStore()
+    raise ValueError(f"Unknown GATEWAY_STORE '{kind}' (expected 'memory' or 'sqlite')")
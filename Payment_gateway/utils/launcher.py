@@ -0,0 +1,295 @@
+"""
+Pre-forking production launcher, shared by the gateway and the backend.
+
+    python serve.py [--workers N] [--port 8000]    # in Payment_gateway/ or backend/
+
+The parent imports the app once, so module-level setup (migrations, the
+gateway's UTR index, heavy imports) runs once and is shared copy-on-write.
+It then binds the listening socket and forks WEB_CONCURRENCY workers. The
+default is one per CPU available to the process, cgroup quota included.
+Before the first fork it calls the app's `prepare` hook, which releases
+what must not cross a fork (database connections, threads).
+
+Each worker runs the app's `warm_up` hook (DB pool, caches) and only then
+starts accepting. Until then, new connections wait in the shared backlog
+and are taken by workers that are already warm.
+
+A worker exits after MAX_REQUESTS requests, plus a random part of
+MAX_REQUESTS_JITTER so workers don't all restart at once. The parent then
+forks a replacement, which caps memory growth. Signals:
+  - SIGTERM / SIGINT stop all workers gracefully;
+  - SIGHUP starts a fresh set of workers and retires one old worker each
+    time a new one is ready, so capacity never drops.
+Workers that crash are restarted with backoff.
+
+Without os.fork (Windows) the app runs under plain uvicorn workers instead,
+without preloading or warm-up.
+"""
+
+import argparse
+import atexit
+import importlib
+import logging
+import math
+import os
+import random
+import select
+import signal
+import socket
+import time
+from typing import Callable, Dict, Optional
+
+from . import structured_log
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "10000"))           # 0 = never recycle
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+BACKLOG = int(os.getenv("BACKLOG", "2048"))
+RESTART_BACKOFF_MAX = 30.0
+BOOT_FAILED = 3              # worker exit code: warm-up or app startup failed
+
+log = logging.getLogger("launcher")
+
+
+def available_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        # cgroup v2 quota, e.g. "200000 100000" = 2 CPUs (containers, PaaS)
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(cpus, 1)
+
+
+def _load(path: Optional[str]) -> Optional[Callable]:
+    if not path:
+        return None
+    module, _, attr = path.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+# ---------------------------------------------------------------------------
+# Worker process
+# ---------------------------------------------------------------------------
+def _exit_on_signal(signum, frame):
+    raise SystemExit(0)
+
+
+def _run_worker(app, warm_up: Optional[Callable], sock: socket.socket, ready_fd: int) -> int:
+    import uvicorn
+
+    class _Server(uvicorn.Server):
+        async def startup(self, sockets=None):
+            await super().startup(sockets=sockets)
+            if not self.should_exit:
+                os.write(ready_fd, b"1")
+
+    random.seed()   # siblings must not share the parent's random state
+    started = time.perf_counter()
+    try:
+        if warm_up is not None:
+            warm_up()
+    except Exception:
+        log.exception("Worker warm-up failed")
+        return BOOT_FAILED
+    log.info("Worker warmed up", extra={"warm_up_ms": round((time.perf_counter() - started) * 1000, 1)})
+
+    max_requests = MAX_REQUESTS + random.randint(0, MAX_REQUESTS_JITTER) if MAX_REQUESTS > 0 else None
+    server = _Server(uvicorn.Config(
+        app,
+        lifespan="on",
+        log_config=None,               # structured_log already owns logging
+        limit_max_requests=max_requests,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+    ))
+    server.run(sockets=[sock])
+    return 0 if server.started else BOOT_FAILED
+
+
+# ---------------------------------------------------------------------------
+# Parent process
+# ---------------------------------------------------------------------------
+class Arbiter:
+    def __init__(self, app, warm_up: Optional[Callable], sock: socket.socket, workers: int):
+        self.app = app
+        self.warm_up = warm_up
+        self.sock = sock
+        self.size = workers
+        self.workers: Dict[int, float] = {}      # pid -> fork time
+        self.ready_pipes: Dict[int, int] = {}    # read fd -> pid, until the worker reports ready
+        self.replacing: set = set()              # pids to retire (SIGHUP)
+        self.failures = 0
+        self.next_spawn = 0.0
+        self.signals: list = []
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+
+    def _on_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def spawn(self):
+        ready_r, ready_w = os.pipe()
+        structured_log.before_fork()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                structured_log.after_fork()
+                signal.set_wakeup_fd(-1)
+                # uvicorn handles these while serving and re-raises them after a
+                # graceful shutdown; exit through SystemExit so the log queue is flushed
+                signal.signal(signal.SIGTERM, _exit_on_signal)
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                signal.signal(signal.SIGHUP, signal.SIG_DFL)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                for fd in (ready_r, self._wakeup_r, self._wakeup_w, *self.ready_pipes):
+                    os.close(fd)
+                code = _run_worker(self.app, self.warm_up, self.sock, ready_w)
+            except KeyboardInterrupt:
+                code = 0
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 0
+            except BaseException:
+                log.exception("Worker crashed")
+            finally:
+                atexit._run_exitfuncs()    # flushes the log queue
+                os._exit(code)
+        structured_log.after_fork()
+        os.close(ready_w)
+        self.workers[pid] = time.monotonic()
+        self.ready_pipes[ready_r] = pid
+        log.info("Worker started", extra={"pid": pid})
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+            self.replacing.discard(pid)
+            for fd, owner in list(self.ready_pipes.items()):
+                if owner == pid:
+                    os.close(fd)
+                    del self.ready_pipes[fd]
+            code = os.waitstatus_to_exitcode(status)
+            if code == 0:
+                log.info("Worker exited", extra={"pid": pid})
+                continue
+            self.failures += 1
+            delay = min(0.5 * 2 ** self.failures, RESTART_BACKOFF_MAX)
+            self.next_spawn = time.monotonic() + delay
+            log.warning("Worker died, restarting", extra={
+                "pid": pid, "exit_code": code, "uptime_s": round(time.monotonic() - started, 1), "retry_in_s": delay,
+            })
+
+    def _on_ready(self, fd: int):
+        pid = self.ready_pipes.pop(fd)
+        ready = os.read(fd, 1)
+        os.close(fd)
+        if not ready:
+            return      # exited before it started; _reap deals with it
+        self.failures = 0
+        log.info("Worker ready", extra={"pid": pid, "startup_s": round(time.monotonic() - self.workers[pid], 2)})
+        if self.replacing:
+            # Rolling restart: one warm worker in, one old worker out
+            os.kill(self.replacing.pop(), signal.SIGTERM)
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+        signal.set_wakeup_fd(self._wakeup_w)
+        log.info("Launcher listening", extra={"address": self.sock.getsockname()[:2], "workers": self.size})
+        try:
+            while True:
+                for signum in self.signals:
+                    if signum in (signal.SIGTERM, signal.SIGINT):
+                        return
+                    if signum == signal.SIGHUP and not self.replacing:
+                        log.info("Reloading workers")
+                        self.replacing = set(self.workers)
+                self.signals.clear()
+                self._reap()
+                # Workers being retired don't count towards the target
+                if len(self.workers) - len(self.replacing) < self.size and time.monotonic() >= self.next_spawn:
+                    self.spawn()
+                    continue
+                readable, _, _ = select.select([self._wakeup_r, *self.ready_pipes], [], [], 1.0)
+                for fd in readable:
+                    if fd == self._wakeup_r:
+                        os.read(fd, 512)
+                    else:
+                        self._on_ready(fd)
+        finally:
+            self.stop()
+
+    def stop(self):
+        log.info("Stopping workers", extra={"workers": len(self.workers)})
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in self.workers:
+            log.warning("Worker did not stop in time, killing it", extra={"pid": pid})
+            os.kill(pid, signal.SIGKILL)
+        self.sock.close()
+
+
+def serve(app: str, prepare: Optional[str] = None, warm_up: Optional[str] = None,
+          host: str = HOST, port: int = PORT, workers: Optional[int] = None):
+    """
+    Run `app` ("module:attr") in `workers` preforked processes. `prepare` and
+    `warm_up` are "module:function" hooks: the first runs once in the parent
+    before forking, the second in every worker before it accepts.
+    """
+    workers = workers or int(os.getenv("WEB_CONCURRENCY", "0")) or available_cpus()
+    # Set before the import: the apps size themselves from it
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+    if not hasattr(os, "fork"):
+        import uvicorn
+        uvicorn.run(app, host=host, port=port, workers=workers, limit_max_requests=MAX_REQUESTS or None)
+        return
+
+    sock = _bind(host, port)
+    application = _load(app)
+    prepare_hook, warm_up_hook = _load(prepare), _load(warm_up)
+    if prepare_hook is not None:
+        prepare_hook()
+    Arbiter(application, warm_up_hook, sock, workers).run()
+
+
+def main(app: str, prepare: Optional[str] = None, warm_up: Optional[str] = None):
+    parser = argparse.ArgumentParser(description=f"Serve {app} with preforked, warmed-up workers")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=None, help="default: WEB_CONCURRENCY, else one per CPU")
+    args = parser.parse_args()
+    serve(app, prepare, warm_up, args.host, args.port, args.workers)
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional
+
+
+QR_CACHE_MAX_ENTRIES = int(os.getenv("QR_CACHE_MAX_ENTRIES", "1024"))
+QR_CACHE_MAX_BYTES = int(os.getenv("QR_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+class CachedQR(NamedTuple):
+    content: bytes
+    etag: str
+
+
+class QRCodeCache:
+    """
+    Bounded LRU cache of rendered QR images keyed by UPI URI.
+    A transaction's URI never changes, so an entry never goes stale;
+    it is only evicted when the cache is over its entry or byte budget.
+    """
+
+    def __init__(self, max_entries: int = QR_CACHE_MAX_ENTRIES, max_bytes: int = QR_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CachedQR]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.renders = 0
+        self.render_seconds = 0.0
+        self.render_seconds_max = 0.0
+
+    def get(self, key: str) -> Optional[CachedQR]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, content: bytes) -> CachedQR:
+        entry = CachedQR(content=content, etag=f'"{hashlib.sha256(content).hexdigest()[:32]}"')
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.content)
+            self._entries[key] = entry
+            self._size += len(content)
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.content)
+                self.evictions += 1
+        return entry
+
+    def record_render(self, seconds: float):
+        with self._lock:
+            self.renders += 1
+            self.render_seconds += seconds
+            self.render_seconds_max = max(self.render_seconds_max, seconds)
+
+    def get_or_render(self, key: str, render: Callable[[], bytes]) -> CachedQR:
+        """
+        Synchronous helper: returns the cached entry or renders, times and stores it.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        started = time.perf_counter()
+        content = render()
+        self.record_render(time.perf_counter() - started)
+        return self.put(key, content)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "renders": self.renders,
+                "render_ms_avg": round(1000 * self.render_seconds / self.renders, 3) if self.renders else 0.0,
+                "render_ms_max": round(1000 * self.render_seconds_max, 3),
+            }
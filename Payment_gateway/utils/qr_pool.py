@@ -0,0 +1,95 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+
+QR_POOL_WORKERS = int(os.getenv("QR_POOL_WORKERS", "2"))
+QR_POOL_MAX_PENDING = int(os.getenv("QR_POOL_MAX_PENDING", "32"))
+QR_RENDER_TIMEOUT = float(os.getenv("QR_RENDER_TIMEOUT", "5"))
+
+
+class QRPoolBusy(Exception):
+    """Raised when the render queue is full; callers should answer 503."""
+
+
+class QRRenderTimeout(Exception):
+    """Raised when a render takes longer than the configured timeout."""
+
+
+def _timed_call(fn: Callable, *args) -> Tuple[Any, float]:
+    # Runs inside the worker process, so the timing excludes queue wait
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class QRRenderPool:
+    """
+    Runs CPU-bound QR rendering off the event loop in a process pool.
+    At most `max_pending` renders are queued or running at once; beyond that
+    submit() fails fast with QRPoolBusy instead of stalling other requests.
+    With workers=0 renders go to the loop's default thread pool instead.
+    """
+
+    def __init__(
+        self,
+        workers: int = QR_POOL_WORKERS,
+        max_pending: int = QR_POOL_MAX_PENDING,
+        timeout: float = QR_RENDER_TIMEOUT,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def start(self):
+        if self.workers > 0 and self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _release(self, fut):
+        # Slots are freed when the work really finishes, not when the caller
+        # gives up, so timed-out renders still count against the queue bound.
+        self._pending -= 1
+        self.completed += 1
+        if not fut.cancelled():
+            fut.exception()  # mark retrieved even if the caller timed out
+
+    async def submit(self, fn: Callable, *args) -> Tuple[Any, float]:
+        """
+        Run fn(*args) in the pool and return (result, render_seconds).
+        """
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise QRPoolBusy("QR render queue is full")
+
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        fut = loop.run_in_executor(self._executor, _timed_call, fn, *args)
+        fut.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise QRRenderTimeout(f"QR render exceeded {self.timeout}s")
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "timeout_s": self.timeout,
+            "pending": self._pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
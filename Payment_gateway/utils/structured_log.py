@@ -0,0 +1,222 @@
+"""
+Structured, non-blocking logging shared by the gateway and the backend.
+
+    configure_logging("backend")
+    app.add_middleware(RequestLogMiddleware)
+    log = logging.getLogger("backend.orders")
+    log.info("order created", extra={"order_id": 42})
+
+Log calls only format the message and put the record on a bounded queue;
+a QueueListener thread writes JSON lines to stdout. If stdout stalls and the
+queue fills, records are dropped (and counted) rather than blocking a
+request. Records carry the current request ID, and `extra` fields become
+top-level JSON keys.
+
+Sampling: pass extra={"sample": 0.1} to keep ~10% of a high-volume event.
+The per-request access log is sampled by LOG_SAMPLE_RATE, but errors and
+slow requests (>= LOG_SLOW_MS) are always kept.
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from typing import Optional
+
+from starlette.datastructures import MutableHeaders
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")           # json | text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_SLOW_MS = float(os.getenv("LOG_SLOW_MS", "500"))
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sample", "taskName", "color_message"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _ContextFilter(logging.Filter):
+    """Runs on the calling thread: tags the request ID and applies sampling."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample = getattr(record, "sample", None)
+        if sample is not None and random.random() >= sample:
+            return False
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id_var.get()
+        return True
+
+
+_plain = logging.Formatter()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args and render the traceback now (the record may reference
+        # objects that change later), but keep the traceback out of `msg`
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _plain.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def stop(self):
+        # Flush what's queued at exit, but never hang on a full queue or a
+        # stuck stdout
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(self._sentinel, timeout=2)
+            self._thread.join(timeout=2)
+        except queue.Full:
+            pass
+        self._thread = None
+
+
+_listener: Optional[_Listener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+
+
+def configure_logging(service: str, level: str = LOG_LEVEL) -> logging.Logger:
+    """Route the root logger through the queue. Safe to call more than once."""
+    global _listener, _queue_handler
+    logger = logging.getLogger(service)
+    if _listener is not None:
+        return logger
+
+    stream = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(_ContextFilter())
+    root = logging.getLogger()
+    root.handlers = [_queue_handler]
+    root.setLevel(level)
+    # uvicorn's own loggers go through the same queue
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+    # RequestLogMiddleware writes the access log
+    logging.getLogger("uvicorn.access").disabled = True
+
+    _listener = _Listener(_queue_handler.queue, stream)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return logger
+
+
+def before_fork():
+    """Stop the writer thread so a fork never copies it mid-write (utils/launcher.py)."""
+    if _listener is not None:
+        _listener.stop()
+
+
+def after_fork():
+    """Restart the writer thread; call in both the parent and the child."""
+    if _listener is not None and _listener._thread is None:
+        _listener.start()
+
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+class RequestLogMiddleware:
+    """
+    Assigns each HTTP request an ID (X-Request-ID is honoured and echoed),
+    makes it available to every log call made while handling the request,
+    and writes one access record with the status and duration.
+    """
+
+    def __init__(self, app, logger_name: str = "access", sample_rate: float = LOG_SAMPLE_RATE, slow_ms: float = LOG_SLOW_MS):
+        self.app = app
+        self.log = logging.getLogger(logger_name)
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)["X-Request-ID"] = request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            keep = status_code >= 400 or duration_ms >= self.slow_ms or random.random() < self.sample_rate
+            if keep:
+                self.log.log(
+                    logging.WARNING if status_code >= 500 else logging.INFO,
+                    "%s %s %s", scope["method"], scope["path"], status_code,
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status_code,
+                        "duration_ms": round(duration_ms, 2),
+                    },
+                )
+            request_id_var.reset(token)
@@ -0,0 +1,291 @@
+"""
+Opt-in request tracing and profiling, shared by the gateway and the backend.
+
+A request is traced when it carries `X-Debug-Trace: <admin secret>`, or at
+random with probability TRACE_SAMPLE_RATE (default 0: off). A traced request
+records a span tree:
+  - the request itself and the endpoint function;
+  - every SQL statement (instrument_sqlalchemy) and any block wrapped in
+    `with span("name"):` (password hashing, QR rendering, store reads, ...);
+  - "serialize": from the endpoint returning to the response starting.
+Add `X-Debug-Profile: 1` (with the secret) to also cProfile the endpoint;
+the .prof file lands next to the trace file.
+
+Spans are written in Chrome trace-event format, one event per line, to a
+size-rotated file (TRACE_FILE). Each file is a valid unterminated JSON array,
+which chrome://tracing, Perfetto and speedscope load directly. Writing goes
+through a background thread, like utils/structured_log.py.
+
+When a request isn't traced, `span()` costs one context-variable lookup.
+"""
+
+import atexit
+import contextvars
+import cProfile
+import functools
+import hmac
+import inspect
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Optional
+
+from starlette.datastructures import MutableHeaders
+
+from .structured_log import DroppingQueueHandler, _Listener, request_id_var
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(tempfile.gettempdir(), "webplate-traces", "trace.json"))
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_FILE_BACKUPS = int(os.getenv("TRACE_FILE_BACKUPS", "5"))
+TRACE_HEADER = "x-debug-trace"
+PROFILE_HEADER = "x-debug-profile"
+MAX_SPANS = 2000
+MAX_STATEMENT_CHARS = 300
+
+log = logging.getLogger("tracing")
+
+
+class Trace:
+    __slots__ = ("trace_id", "tid", "profile", "spans", "handler_ended", "profile_path")
+
+    _tids = itertools.count(1)
+
+    def __init__(self, profile: bool = False):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.tid = next(self._tids)      # one row per request in the viewer
+        self.profile = profile
+        self.spans: List[dict] = []
+        self.handler_ended: Optional[float] = None
+        self.profile_path: Optional[str] = None
+
+    def add(self, name: str, category: str, start: float, end: float, args: Optional[dict] = None):
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": round(start * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": os.getpid(),
+                "tid": self.tid,
+                "args": args or {},
+            })
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, category: str = "app", **args):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        trace.add(name, category, start, time.time(), args)
+
+
+# ---------------------------------------------------------------------------
+# Trace file: rotating, one Chrome trace event per line, written off-thread
+# ---------------------------------------------------------------------------
+class _TraceFileHandler(logging.handlers.RotatingFileHandler):
+    def _open(self):
+        stream = super()._open()
+        if stream.tell() == 0:
+            stream.write("[\n")
+        return stream
+
+    def format(self, record: logging.LogRecord) -> str:
+        return record.getMessage() + ","
+
+
+_writer: Optional[logging.Logger] = None
+_writer_lock = threading.Lock()
+
+
+def _trace_writer() -> logging.Logger:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+            target = _TraceFileHandler(TRACE_FILE, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=TRACE_FILE_BACKUPS)
+            handler = DroppingQueueHandler(queue.Queue(maxsize=10000))
+            listener = _Listener(handler.queue, target)
+            listener.start()
+            atexit.register(listener.stop)
+            writer = logging.getLogger("tracing.file")
+            writer.propagate = False
+            writer.handlers = [handler]
+            writer.setLevel(logging.INFO)
+            _writer = writer
+    return _writer
+
+
+def _write(trace: Trace):
+    writer = _trace_writer()
+    request_id = request_id_var.get()
+    for event in trace.spans:
+        event["args"]["trace_id"] = trace.trace_id
+        event["args"]["request_id"] = request_id
+        writer.info("%s", json.dumps(event, default=str))
+
+
+# ---------------------------------------------------------------------------
+# Middleware and endpoint instrumentation
+# ---------------------------------------------------------------------------
+class TracingMiddleware:
+    """
+    Starts a trace for requests that ask for one (with the secret) or are
+    sampled, and writes it when the response is done. Traced responses carry
+    X-Trace-Id.
+    """
+
+    def __init__(self, app, secret: str = "", sample_rate: float = TRACE_SAMPLE_RATE):
+        self.app = app
+        self.secret = secret.encode()
+        self.sample_rate = sample_rate
+
+    def _requested(self, scope) -> tuple:
+        trace = profile = False
+        for name, value in scope.get("headers", ()):
+            if name == TRACE_HEADER.encode():
+                trace = bool(self.secret) and hmac.compare_digest(value, self.secret)
+            elif name == PROFILE_HEADER.encode():
+                profile = value in (b"1", b"true")
+        return trace, trace and profile
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested, profile = self._requested(scope)
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(profile=profile)
+        token = _current.set(trace)
+        start = time.time()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if trace.handler_ended is not None:
+                    trace.add("serialize", "app", trace.handler_ended, time.time())
+                MutableHeaders(scope=message)["X-Trace-Id"] = trace.trace_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            args = {"status": status_code, "sampled": not requested}
+            if trace.profile_path:
+                args["profile"] = trace.profile_path
+            trace.add(f"{scope['method']} {scope['path']}", "request", start, time.time(), args)
+            _write(trace)
+            log.info("Request traced", extra={"trace_id": trace.trace_id, "spans": len(trace.spans)})
+
+
+def _dump_profile(trace: Trace, profiler: cProfile.Profile):
+    profiler.disable()
+    path = os.path.join(os.path.dirname(TRACE_FILE) or ".", f"{trace.trace_id}.prof")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profiler.dump_stats(path)
+        trace.profile_path = path
+    except OSError as e:
+        log.warning("Could not write profile: %s", e, extra={"trace_id": trace.trace_id})
+
+
+def _traced_endpoint(fn):
+    name = getattr(fn, "__name__", "endpoint")
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if trace is None:
+                return await fn(*args, **kwargs)
+            start = time.time()
+            profiler = cProfile.Profile() if trace.profile else None
+            try:
+                if profiler:
+                    profiler.enable()   # the event loop thread: may include other tasks
+                return await fn(*args, **kwargs)
+            finally:
+                if profiler:
+                    _dump_profile(trace, profiler)
+                trace.handler_ended = time.time()
+                trace.add(f"endpoint {name}", "app", start, trace.handler_ended)
+        return wrapper
+
+    @functools.wraps(fn)
+    def sync_wrapper(*args, **kwargs):
+        trace = _current.get()
+        if trace is None:
+            return fn(*args, **kwargs)
+        start = time.time()
+        profiler = cProfile.Profile() if trace.profile else None
+        try:
+            if profiler:
+                profiler.enable()
+            return fn(*args, **kwargs)
+        finally:
+            if profiler:
+                _dump_profile(trace, profiler)
+            trace.handler_ended = time.time()
+            trace.add(f"endpoint {name}", "app", start, trace.handler_ended)
+    return sync_wrapper
+
+
+def instrument_endpoints(app):
+    """Wrap every route's endpoint so traced requests get an endpoint span (and profile)."""
+    from fastapi.routing import APIRoute
+
+    for route in app.routes:
+        if isinstance(route, APIRoute) and not getattr(route.dependant.call, "_traced", False):
+            wrapped = _traced_endpoint(route.dependant.call)
+            wrapped._traced = True
+            route.dependant.call = wrapped
+
+
+def instrument_sqlalchemy(engine):
+    """A "db" span for every statement executed during a traced request."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("trace_starts", []).append(time.time())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        trace = _current.get()
+        starts = conn.info.get("trace_starts")
+        if trace is None or not starts:
+            return
+        start = starts.pop()
+        trace.add("db", "db", start, time.time(), {
+            "statement": " ".join(statement.split())[:MAX_STATEMENT_CHARS],
+            "executemany": executemany,
+        })
@@ -1,60 +1,115 @@
 import qrcode
 from qrcode.image.styledpil import StyledPilImage
 from qrcode.image.styles.moduledrawers import RoundedModuleDrawer
+from PIL import Image
 import io
-import urllib.parse
+from typing import List, Optional
 
+# Link builders live in upi_links so the backend can share them without qrcode/PIL
+from .upi_links import RECEIVER_NAME, RECEIVER_UPI_ID, build_gpay_intent_url, build_upi_uri
 
-RECEIVER_UPI_ID = "naveen1998726-1@okicici"
-RECEIVER_NAME = "Naveen"
 
+QR_BORDER = 4
+QR_FILL_COLOR = (26, 42, 108)
 
-def build_upi_uri(amount: float, note: str, transaction_id: str) -> str:
-    """
-    Constructs a standard UPI payment URI.
-    Format: upi://pay?pa=<VPA>&pn=<Name>&am=<Amount>&cu=INR&tn=<Note>&tr=<TxnRef>
-    """
-    params = {
-        "pa": RECEIVER_UPI_ID,
-        "pn": RECEIVER_NAME,
-        "am": f"{amount:.2f}",
-        "cu": "INR",
-        "tn": note,
-        "tr": transaction_id,
-    }
-    query_string = urllib.parse.urlencode(params)
-    return f"upi://pay?{query_string}"
 
+def _box_size(size: Optional[int], modules: int, default: int = 10) -> int:
+    # Pixel size per module so the image (border included) is at most `size` wide
+    return max(1, size // modules) if size else default
 
-def build_gpay_intent_url(upi_uri: str) -> str:
-    """
-    Builds a Google Pay specific intent URL for Android deep linking.
-    """
-    encoded_uri = urllib.parse.quote(upi_uri, safe="")
-    return f"intent://pay?{upi_uri.split('?')[1]}#Intent;scheme=upi;package=com.google.android.apps.nbu.paisa.user;end"
 
-
-def generate_qr_code_bytes(upi_uri: str) -> bytes:
+def generate_qr_code_bytes(upi_uri: str, size: Optional[int] = None) -> bytes:
     """
     Generates a styled QR code image from a UPI URI and returns it as PNG bytes.
+    `size` is the approximate image width in pixels (default: 10px per module).
     """
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=10,
-        border=4,
+        border=QR_BORDER,
     )
     qr.add_data(upi_uri)
     qr.make(fit=True)
+    qr.box_size = _box_size(size, qr.modules_count + 2 * QR_BORDER)
 
     img = qr.make_image(
         image_factory=StyledPilImage,
         module_drawer=RoundedModuleDrawer(),
         back_color=(255, 255, 255),
-        fill_color=(26, 42, 108),
+        fill_color=QR_FILL_COLOR,
     )
 
     buf = io.BytesIO()
     img.save(buf, format="PNG")
     buf.seek(0)
     return buf.getvalue()
+
+
+def _qr_matrix(upi_uri: str) -> List[List[bool]]:
+    """
+    Module matrix (border included) at medium error correction.
+    UPI URIs are short, so M keeps the code small while still scanning reliably
+    from a screen; the styled image needs H only because of its rounded modules.
+    """
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=QR_BORDER)
+    qr.add_data(upi_uri)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def generate_plain_qr_png(upi_uri: str, size: Optional[int] = None) -> bytes:
+    """
+    Fast unstyled QR: a 1-bit image with one pixel per module, scaled up with
+    nearest-neighbour resampling. Typically well under 1 KB.
+    """
+    matrix = _qr_matrix(upi_uri)
+    n = len(matrix)
+    img = Image.new("1", (n, n), 255)
+    img.putdata([0 if cell else 255 for row in matrix for cell in row])
+    box = _box_size(size, n)
+    if box > 1:
+        img = img.resize((n * box, n * box), Image.NEAREST)
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def generate_qr_code_svg(upi_uri: str, size: Optional[int] = None) -> bytes:
+    """
+    Compact SVG QR: each horizontal run of dark modules becomes one path segment
+    in a single <path>, drawn on a module-unit viewBox so it scales losslessly.
+    """
+    matrix = _qr_matrix(upi_uri)
+    n = len(matrix)
+    segments = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < n:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < n and row[x]:
+                x += 1
+            segments.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+
+    dims = f' width="{size}" height="{size}"' if size else ""
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {n} {n}"{dims} shape-rendering="crispEdges">'
+        f'<rect width="{n}" height="{n}" fill="#fff"/>'
+        f'<path fill="#1a2a6c" d="{"".join(segments)}"/></svg>'
+    )
+    return svg.encode("ascii")
+
+
+def render_qr_variant(upi_uri: str, fmt: str = "png", style: str = "styled", size: Optional[int] = None) -> bytes:
+    """
+    Renders one output variant of a UPI QR code.
+    fmt: "png" | "svg"; style: "styled" | "plain" (SVG is always plain).
+    """
+    if fmt == "svg":
+        return generate_qr_code_svg(upi_uri, size)
+    if style == "plain":
+        return generate_plain_qr_png(upi_uri, size)
+    return generate_qr_code_bytes(upi_uri, size)
@@ -0,0 +1,34 @@
+"""
+UPI payment link builders shared by the gateway and the backend.
+Standard library only, so the backend can use it without the QR dependencies.
+"""
+import os
+import urllib.parse
+
+
+RECEIVER_UPI_ID = os.getenv("RECEIVER_UPI_ID", "naveen1998726-1@okicici")
+RECEIVER_NAME = os.getenv("RECEIVER_NAME", "Naveen")
+
+
+def build_upi_uri(amount: float, note: str, transaction_id: str) -> str:
+    """
+    Constructs a standard UPI payment URI.
+    Format: upi://pay?pa=<VPA>&pn=<Name>&am=<Amount>&cu=INR&tn=<Note>&tr=<TxnRef>
+    """
+    params = {
+        "pa": RECEIVER_UPI_ID,
+        "pn": RECEIVER_NAME,
+        "am": f"{amount:.2f}",
+        "cu": "INR",
+        "tn": note,
+        "tr": transaction_id,
+    }
+    query_string = urllib.parse.urlencode(params)
+    return f"upi://pay?{query_string}"
+
+
+def build_gpay_intent_url(upi_uri: str) -> str:
+    """
+    Builds a Google Pay specific intent URL for Android deep linking.
+    """
+    return f"intent://pay?{upi_uri.split('?')[1]}#Intent;scheme=upi;package=com.google.android.apps.nbu.paisa.user;end"
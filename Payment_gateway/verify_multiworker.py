@@ -0,0 +1,127 @@
+"""
+Consistency check for the gateway running with several uvicorn workers.
+
+Spawns `uvicorn main:app --workers N` on a throwaway SQLite file in shared
+mode, then creates transactions, confirms them through the webhooks and
+admin endpoint, and polls their status over fresh connections (so requests
+are spread across workers). Every poll must see the latest write.
+
+    python verify_multiworker.py --workers 4 --transactions 200
+    python verify_multiworker.py --launcher --max-requests 50   # serve.py, with worker recycling
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Gateway did not start in time")
+
+
+def fresh_get(url: str, path: str, **kwargs):
+    # New connection per request, so the OS hands it to any worker
+    with httpx.Client(base_url=url, timeout=10) as client:
+        return client.get(path, **kwargs)
+
+
+def run(args) -> bool:
+    workdir = tempfile.mkdtemp(prefix="gateway-mw-")
+    env = dict(
+        os.environ,
+        GATEWAY_STORE="sqlite",
+        GATEWAY_SHARED="1",
+        GATEWAY_DB_PATH=os.path.join(workdir, "gateway.db"),
+        WEB_CONCURRENCY=str(args.workers),
+    )
+    if args.max_requests:
+        env.update(MAX_REQUESTS=str(args.max_requests), MAX_REQUESTS_JITTER=str(args.max_requests // 5))
+    secret = env.setdefault("WEBHOOK_SECRET", "supersecret123change_me")
+    url = f"http://127.0.0.1:{args.port}"
+    if args.launcher:
+        command = [sys.executable, "serve.py", "--host", "127.0.0.1"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app"]
+    server = subprocess.Popen(
+        command + ["--port", str(args.port), "--workers", str(args.workers)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    failures = []
+    try:
+        wait_until_up(url)
+        print(f"--- {args.workers} workers up, creating {args.transactions} transactions ---")
+        ids = []
+        for i in range(args.transactions):
+            with httpx.Client(base_url=url, timeout=10) as client:
+                ids.append(client.post("/payment/create", json={"amount": i + 1}).json()["transaction_id"])
+
+        print("--- Every worker sees every new transaction as PENDING ---")
+        for txn in ids:
+            res = fresh_get(url, f"/payment/{txn}/status")
+            if res.status_code != 200 or res.json()["status"] != "PENDING":
+                failures.append(f"{txn}: expected PENDING, got {res.status_code} {res.text}")
+
+        print("--- Confirming: half via single webhooks, half via one batch ---")
+        half = len(ids) // 2
+        for i, txn in enumerate(ids[:half]):
+            with httpx.Client(base_url=url, timeout=10) as client:
+                client.post("/webhook/payment", json={
+                    "transaction_id": txn, "status": "SUCCESS",
+                    "upi_transaction_id": f"{i:012d}", "secret_key": secret,
+                }).raise_for_status()
+        with httpx.Client(base_url=url, timeout=30) as client:
+            client.post("/webhook/payment/batch", json={
+                "secret_key": secret,
+                "updates": [
+                    {"transaction_id": txn, "status": "SUCCESS", "upi_transaction_id": f"{half + i:012d}"}
+                    for i, txn in enumerate(ids[half:])
+                ],
+            }).raise_for_status()
+
+        print("--- Polling every transaction from fresh connections ---")
+        for i, txn in enumerate(ids):
+            for _ in range(args.polls):
+                body = fresh_get(url, f"/payment/{txn}/status").json()
+                if body["status"] != "SUCCESS" or body["upi_transaction_id"] != f"{i:012d}":
+                    failures.append(f"{txn}: stale read {body}")
+                    break
+
+        listed = fresh_get(url, "/admin/transactions", params={"secret": secret, "status": "SUCCESS", "limit": 1000})
+        if len(listed.json()["items"]) != len(ids):
+            failures.append(f"admin listing shows {len(listed.json()['items'])} SUCCESS, expected {len(ids)}")
+    finally:
+        server.terminate()
+        server.wait(timeout=15)
+
+    if failures:
+        print(f"FAILURE: {len(failures)} inconsistencies")
+        for failure in failures[:20]:
+            print("  " + failure)
+        return False
+    print(f"SUCCESS: {len(ids)} transactions consistent across {args.workers} workers.")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--transactions", type=int, default=100)
+    parser.add_argument("--polls", type=int, default=3, help="status polls per transaction")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--launcher", action="store_true", help="run serve.py instead of uvicorn --workers")
+    parser.add_argument("--max-requests", type=int, default=0, help="with --launcher: recycle workers this often")
+    sys.exit(0 if run(parser.parse_args()) else 1)
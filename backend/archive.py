@@ -0,0 +1,195 @@
+"""
+Hot/cold order storage.
+
+Orders that reached a terminal status (confirmed, cancelled, expired) and are
+older than ORDER_ARCHIVE_AFTER_DAYS are moved, with their items, from
+`orders` / `order_items` into `orders_archive` / `order_items_archive`. The
+live tables then only hold recent and in-flight orders, so status updates,
+the duplicate-UTR check and expiry scans stay cheap however long the shop
+has been running.
+
+Orders move in batches of ORDER_ARCHIVE_BATCH_SIZE, one short transaction
+each (copy, then delete; ids are kept). The status filter is re-applied
+inside the transaction, and on Postgres the batch is locked FOR UPDATE SKIP
+LOCKED, so an order reopened meanwhile is never archived.
+
+Readers that need the whole history use the helpers here, which look at
+both tiers. Archived orders are read-only.
+
+Usage as a script:
+    python archive.py [--older-than-days 180] [--dry-run]
+"""
+
+import heapq
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import models
+from sqlalchemy import func, literal, select, union_all
+from sqlalchemy.orm import Session, selectinload
+
+ORDER_ARCHIVE_AFTER_DAYS = float(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "180"))   # 0 disables
+ORDER_ARCHIVE_BATCH_SIZE = int(os.getenv("ORDER_ARCHIVE_BATCH_SIZE", "500"))
+ORDER_ARCHIVE_INTERVAL = float(os.getenv("ORDER_ARCHIVE_INTERVAL", "3600"))
+ARCHIVABLE_STATUSES = ("confirmed", "cancelled", "expired")
+
+ORDER_COLUMNS = ("id", "user_id", "total_amount", "status", "transaction_id", "utr_number", "created_at")
+ITEM_COLUMNS = ("id", "order_id", "product_id", "product_name", "quantity", "price")
+
+
+def cutoff(older_than_days: float) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=older_than_days)).isoformat(timespec="seconds")
+
+
+def _archivable(before: str):
+    Order = models.Order
+    newest = Order.__table__.alias("newest")
+    return (
+        Order.status.in_(ARCHIVABLE_STATUSES),
+        Order.created_at.isnot(None),
+        Order.created_at < before,
+        # SQLite hands out max(id) + 1: keep the newest order so archived ids are never reused
+        Order.id < select(func.max(newest.c.id)).scalar_subquery(),
+    )
+
+
+def archive_batch(db: Session, before: str, limit: int = ORDER_ARCHIVE_BATCH_SIZE) -> int:
+    """Move up to `limit` terminal orders created before `before` to the archive. Commits."""
+    Order, Item = models.Order, models.OrderItem
+    candidates = db.query(Order.id).filter(*_archivable(before)).order_by(Order.id).limit(limit)
+    if db.get_bind().dialect.name == "postgresql":
+        candidates = candidates.with_for_update(skip_locked=True)
+    ids = [order_id for order_id, in candidates]
+    if not ids:
+        db.rollback()
+        return 0
+
+    archived_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    orders_table = models.ArchivedOrder.__table__
+    items_table = models.ArchivedOrderItem.__table__
+    try:
+        # Re-check the status: on SQLite this INSERT takes the write lock, so
+        # nothing changes between it and the DELETEs below
+        db.execute(orders_table.insert().from_select(
+            [*ORDER_COLUMNS, "archived_at"],
+            select(*(Order.__table__.c[c] for c in ORDER_COLUMNS), literal(archived_at))
+            .where(Order.id.in_(ids), *_archivable(before)),
+        ))
+        moved = [order_id for order_id, in db.execute(
+            select(orders_table.c.id).where(orders_table.c.id.in_(ids))
+        )]
+        if moved:
+            db.execute(items_table.insert().from_select(
+                list(ITEM_COLUMNS),
+                select(*(Item.__table__.c[c] for c in ITEM_COLUMNS)).where(Item.order_id.in_(moved)),
+            ))
+            db.query(Item).filter(Item.order_id.in_(moved)).delete(synchronize_session=False)
+            db.query(Order).filter(Order.id.in_(moved)).delete(synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(moved)
+
+
+def archive_old_orders(db: Session, older_than_days: float = ORDER_ARCHIVE_AFTER_DAYS,
+                       batch_size: int = ORDER_ARCHIVE_BATCH_SIZE, pause: float = 0.05) -> int:
+    """Archive everything eligible, batch by batch, pausing so other writers get a turn."""
+    before = cutoff(older_than_days)
+    total = 0
+    while True:
+        moved = archive_batch(db, before, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+        time.sleep(pause)
+
+
+def count_archivable(db: Session, older_than_days: float = ORDER_ARCHIVE_AFTER_DAYS) -> int:
+    return db.query(models.Order.id).filter(*_archivable(cutoff(older_than_days))).count()
+
+
+# ---------------------------------------------------------------------------
+# Reading across both tiers
+# ---------------------------------------------------------------------------
+def get_archived_order(db: Session, order_id: int, user_id: Optional[int] = None):
+    q = db.query(models.ArchivedOrder).filter(models.ArchivedOrder.id == order_id)
+    if user_id is not None:
+        q = q.filter(models.ArchivedOrder.user_id == user_id)
+    return q.first()
+
+
+def utr_used_by(db: Session, utr: str, exclude_order_id: Optional[int] = None) -> Optional[int]:
+    """Id of another order (live or archived) that already has this UTR."""
+    for model in (models.Order, models.ArchivedOrder):
+        q = db.query(model.id).filter(model.utr_number == utr)
+        if exclude_order_id is not None:
+            q = q.filter(model.id != exclude_order_id)
+        found = q.first()
+        if found is not None:
+            return found[0]
+    return None
+
+
+def list_orders(db: Session, user_id: Optional[int] = None, before_id: Optional[int] = None,
+                limit: Optional[int] = None) -> List:
+    """
+    Orders from both tiers, newest (highest id) first, with items and user
+    loaded. Live orders are models.Order, archived ones models.ArchivedOrder;
+    both have the same attributes.
+    """
+    tiers = []
+    for model, item_attr in ((models.Order, models.Order.items), (models.ArchivedOrder, models.ArchivedOrder.items)):
+        q = db.query(model).options(selectinload(item_attr), selectinload(model.user))
+        if user_id is not None:
+            q = q.filter(model.user_id == user_id)
+        if before_id is not None:
+            q = q.filter(model.id < before_id)
+        q = q.order_by(model.id.desc())
+        if limit is not None:
+            q = q.limit(limit)
+        tiers.append(q.all())
+    merged = heapq.merge(*tiers, key=lambda o: -o.id)
+    return list(merged if limit is None else (o for _, o in zip(range(limit), merged)))
+
+
+def all_orders():
+    """Subquery with the order columns of both tiers (for aggregate queries)."""
+    live = select(*(models.Order.__table__.c[c] for c in ORDER_COLUMNS))
+    cold = select(*(models.ArchivedOrder.__table__.c[c] for c in ORDER_COLUMNS))
+    return union_all(live, cold).subquery("all_orders")
+
+
+def all_items():
+    """Subquery with the item columns of both tiers (for aggregate queries)."""
+    live = select(*(models.OrderItem.__table__.c[c] for c in ITEM_COLUMNS))
+    cold = select(*(models.ArchivedOrderItem.__table__.c[c] for c in ITEM_COLUMNS))
+    return union_all(live, cold).subquery("all_items")
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="Move old finished orders to the archive tables")
+    parser.add_argument("--older-than-days", type=float, default=ORDER_ARCHIVE_AFTER_DAYS or 180)
+    parser.add_argument("--batch-size", type=int, default=ORDER_ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="only count the orders that would move")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if args.dry_run:
+            print(f"{count_archivable(db, args.older_than_days)} orders would be archived")
+        else:
+            started = time.perf_counter()
+            moved = archive_old_orders(db, args.older_than_days, args.batch_size, pause=0)
+            print(f"Archived {moved} orders in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
@@ -1,11 +1,29 @@
 import models
 import schemas
-from sqlalchemy.orm import Session
+import rollups
+import pricing
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import case, or_, update
+from sqlalchemy.orm import Session, selectinload
 from auth import get_password_hash
 
+log = logging.getLogger("backend.crud")
+
 def get_products(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Product).offset(skip).limit(limit).all()
 
+def get_product(db: Session, product_id: int):
+    return db.query(models.Product).filter(models.Product.id == product_id).first()
+
+def get_products_by_ids(db: Session, ids: list):
+    # Preserve the order of `ids` (e.g. search ranking)
+    if not ids:
+        return []
+    products = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(ids))}
+    return [products[i] for i in ids if i in products]
+
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
@@ -25,7 +43,7 @@ def create_user(db: Session, user: schemas.UserCreate):
         return db_user
     except Exception as e:
         db.rollback()
-        print(f"Database error in create_user: {str(e)}")
+        log.exception("Database error in create_user")
         raise e
 
 def create_product(db: Session, product: schemas.ProductCreate):
@@ -46,13 +64,95 @@ def create_contact(db: Session, contact: schemas.ContactCreate):
     db.refresh(db_contact)
     return db_contact
 
+# Orders in these statuses hold no stock
+STOCK_RELEASED_STATUSES = {"cancelled", "expired"}
+# Unpaid orders give their stock back after this long
+ORDER_RESERVATION_TTL = int(os.getenv("ORDER_RESERVATION_TTL", "1800"))
+
+class OutOfStockError(Exception):
+    def __init__(self, product_names: list):
+        self.product_names = product_names
+        super().__init__(f"Not enough stock for: {', '.join(product_names)}")
+
+class InvalidQuantityError(ValueError):
+    pass
+
+def _quantities(items) -> dict:
+    totals = {}
+    for item in items:
+        totals[item.product_id] = totals.get(item.product_id, 0) + item.quantity
+    return totals
+
+def reserve_stock(db: Session, quantities: dict):
+    """
+    Take stock for a whole cart with one conditional UPDATE (no SELECT ... FOR
+    UPDATE): each row is decremented only if it still has enough units, so
+    concurrent checkouts can never drive stock negative. Products with NULL
+    stock are not tracked. On OutOfStockError the caller must roll back, as
+    the lines that did fit were decremented.
+    """
+    if not quantities:
+        return
+    needed = case(quantities, value=models.Product.id)
+    result = db.execute(
+        update(models.Product)
+        .where(
+            models.Product.id.in_(list(quantities)),
+            or_(models.Product.stock.is_(None), models.Product.stock >= needed),
+        )
+        .values(stock=models.Product.stock - needed)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(quantities):
+        short = db.query(models.Product.id, models.Product.name, models.Product.stock).filter(
+            models.Product.id.in_(list(quantities))
+        ).all()
+        raise OutOfStockError([
+            name for product_id, name, stock in short
+            if stock is not None and stock < quantities[product_id]
+        ] or ["requested products"])
+
+def release_stock(db: Session, quantities: dict):
+    if not quantities:
+        return
+    returned = case(quantities, value=models.Product.id)
+    db.execute(
+        update(models.Product)
+        .where(models.Product.id.in_(list(quantities)), models.Product.stock.isnot(None))
+        .values(stock=models.Product.stock + returned)
+        .execution_options(synchronize_session=False)
+    )
+
 def create_order(db: Session, order: schemas.OrderCreate, user_id: int):
     # Calculate the total amount on the backend for security
     calculated_total = 0
     order_items_data = []
     
+    # schemas.OrderItemCreate already refuses these; a negative line would
+    # otherwise put stock back and lower the total
+    if any(item.quantity < 1 for item in order.items):
+        raise InvalidQuantityError("Quantities must be at least 1")
+    quantities = _quantities(order.items)
+    snapshot = pricing.price_book.matching(db, order.price_version)
+    quoted = {pid: snapshot.products.get(pid) for pid in quantities} if snapshot else {}
+    if quoted and all(p is not None and p.price is not None for p in quoted.values()):
+        # Quoted against the current prices: no need to read them again
+        products = quoted
+    else:
+        products = {
+            p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(list(quantities)))
+        }
+        # Cheap read-only check first: a sold-out SKU is rejected without
+        # taking any write lock (reserve_stock below is the real guard)
+        short = [
+            p.name for p in products.values()
+            if p.stock is not None and p.stock < quantities[p.id]
+        ]
+        if short:
+            raise OutOfStockError(short)
+
     for item in order.items:
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
+        product = products.get(item.product_id)
         if not product:
             raise Exception(f"Product with id {item.product_id} not found")
         
@@ -69,16 +169,72 @@ def create_order(db: Session, order: schemas.OrderCreate, user_id: int):
     db_order = models.Order(
         user_id=user_id,
         total_amount=calculated_total,
-        status="pending"
+        status="pending",
+        created_at=datetime.now(timezone.utc).isoformat(timespec="seconds"),
     )
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
+    db.flush()
 
     for db_item in order_items_data:
         db_item.order_id = db_order.id
         db.add(db_item)
-    
+    db.flush()
+
+    # Same transaction as the order itself, so analytics never drift
+    db_order.items = order_items_data
+    rollups.record_order(db, db_order)
+
+    # Reserve last, so the hot product rows stay locked only until commit
+    try:
+        reserve_stock(db, quantities)
+    except OutOfStockError:
+        db.rollback()
+        raise
     db.commit()
     db.refresh(db_order)
     return db_order
+
+def set_order_status(db: Session, db_order: models.Order, new_status: str):
+    """
+    Change an order's status, moving it between sales rollups and releasing
+    (or re-reserving) its stock. Caller commits, or rolls back on OutOfStockError.
+    """
+    old_status = db_order.status or "pending"
+    quantities = _quantities(db_order.items)
+    if new_status in STOCK_RELEASED_STATUSES and old_status not in STOCK_RELEASED_STATUSES:
+        release_stock(db, quantities)
+    elif old_status in STOCK_RELEASED_STATUSES and new_status not in STOCK_RELEASED_STATUSES:
+        reserve_stock(db, quantities)
+    rollups.record_status_change(db, db_order, old_status, new_status)
+    db_order.status = new_status
+
+def expire_stale_orders(db: Session, limit: int = 500) -> list:
+    """
+    Expire unpaid orders older than ORDER_RESERVATION_TTL and release their
+    stock. Each order is claimed with a conditional status UPDATE, so several
+    workers sweeping at once never release the same order twice.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=ORDER_RESERVATION_TTL)).isoformat(timespec="seconds")
+    stale = db.query(models.Order).options(selectinload(models.Order.items)).filter(
+        models.Order.status == "pending",
+        models.Order.created_at.isnot(None),
+        models.Order.created_at < cutoff,
+    ).limit(limit).all()
+
+    expired = []
+    for db_order in stale:
+        claimed = db.execute(
+            update(models.Order)
+            .where(models.Order.id == db_order.id, models.Order.status == "pending")
+            .values(status="expired")
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            continue
+        release_stock(db, _quantities(db_order.items))
+        rollups.record_status_change(db, db_order, "pending", "expired")
+        expired.append(db_order)
+    db.commit()
+    for db_order in expired:
+        db.refresh(db_order)
+    return expired
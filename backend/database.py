@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -15,6 +15,16 @@ if "supabase" in SQLALCHEMY_DATABASE_URL and "sslmode" not in SQLALCHEMY_DATABAS
     SQLALCHEMY_DATABASE_URL += "?sslmode=require"
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+if engine.dialect.name == "sqlite":
+    # WAL lets readers run alongside the single writer and commits with far
+    # fewer fsyncs, so concurrent checkouts queue for much less time
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, _record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -0,0 +1,281 @@
+"""
+Order event feed for the admin dashboard, shared by every worker process.
+
+Order handlers add events to their own session and commit them with the change
+they describe (like jobs.enqueue), so an event exists if and only if the change
+does:
+
+    events.order_events.publish(db, "order.status_changed", db_order)
+    db.commit()
+    events.order_events.wake()
+
+Each process polls the `order_events` table (ORDER_EVENT_POLL_INTERVAL, or at
+once after `wake()`) and hands new rows to its WebSocket subscribers. The row
+id is the cursor, so a client can resume on any worker, and after a restart,
+as long as the events it missed are still in the buffer.
+
+Postgres can commit ids out of order; an id skipped by the poll is looked for
+again for ORDER_EVENT_GAP_TIMEOUT seconds (a rolled-back insert never shows
+up), so a late event is still delivered, after the ones that overtook it.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import database
+import models
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+# How many recent events are kept for resuming clients
+EVENT_BUFFER_SIZE = int(os.getenv("ORDER_EVENT_BUFFER_SIZE", "1000"))
+# Per-subscriber queue; a client that falls further behind is asked to resume
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("ORDER_EVENT_QUEUE_SIZE", "500"))
+# How long other workers' events may take to reach this worker's subscribers
+ORDER_EVENT_POLL_INTERVAL = float(os.getenv("ORDER_EVENT_POLL_INTERVAL", "0.5"))
+ORDER_EVENT_GAP_TIMEOUT = float(os.getenv("ORDER_EVENT_GAP_TIMEOUT", "10"))
+ORDER_EVENT_RETENTION_SECONDS = float(os.getenv("ORDER_EVENT_RETENTION_SECONDS", str(24 * 3600)))
+
+log = logging.getLogger("backend.events")
+
+
+def _event(row: models.OrderEvent) -> dict:
+    return {
+        "type": row.type,
+        "cursor": str(row.id),
+        "order_id": row.order_id,
+        "status": row.status,
+        "total_amount": row.total_amount,
+        "transaction_id": row.transaction_id,
+        "utr_number": row.utr_number,
+        "timestamp": row.created_at,
+    }
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, backlog: list, reset: bool, cursor: str, skip_through: int = 0):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.backlog = backlog
+        self.reset = reset
+        # Position right after `backlog`; later events arrive through the queue
+        self.cursor = cursor
+        # Resumed with a cursor this worker hasn't polled up to yet
+        self.skip_through = skip_through
+        self.lagged = False
+
+    def _deliver(self, event: dict):
+        # Runs on the subscriber's loop
+        if self.lagged or int(event["cursor"]) <= self.skip_through:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    async def get(self, timeout: Optional[float] = None) -> dict:
+        return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+
+
+class OrderEventBroker:
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE, poll_interval: float = ORDER_EVENT_POLL_INTERVAL):
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+        self._last_id = 0
+        # Events with an id at or below this are no longer in the buffer
+        self._floor = 0
+        self._gaps: Dict[int, float] = {}   # id -> when the poll first skipped it
+        self._buffer: deque = deque()
+        self._subscribers: set = set()
+        self._lock = threading.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def cursor(self) -> str:
+        return str(self._last_id)
+
+    def publish(self, db: Session, event_type: str, order) -> models.OrderEvent:
+        """
+        Add an order event to the caller's session; the caller commits, then
+        calls `wake()`. `order` is a models.Order (only plain column values
+        are read).
+        """
+        row = models.OrderEvent(
+            type=event_type,
+            order_id=order.id,
+            status=order.status,
+            total_amount=order.total_amount,
+            transaction_id=order.transaction_id,
+            utr_number=order.utr_number,
+            created_at=time.time(),
+        )
+        db.add(row)
+        return row
+
+    def wake(self):
+        """Thread-safe nudge after committing events from a request handler."""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _append(self, events: List[dict]):
+        # Caller holds the lock
+        for event in events:
+            self._buffer.append((int(event["cursor"]), event))
+        while len(self._buffer) > self.buffer_size:
+            self._floor = max(self._floor, self._buffer.popleft()[0])
+
+    def load(self, db: Session):
+        """Start from the newest events in the table (startup)."""
+        rows = db.query(models.OrderEvent).order_by(models.OrderEvent.id.desc()).limit(self.buffer_size).all()
+        rows.reverse()
+        with self._lock:
+            self._buffer.clear()
+            self._gaps.clear()
+            self._floor = rows[0].id - 1 if rows else 0
+            self._last_id = rows[-1].id if rows else 0
+            self._append([_event(row) for row in rows])
+
+    def poll(self, db: Session) -> List[dict]:
+        """Read events committed since the last poll and push them to subscribers."""
+        now = time.time()
+        with self._lock:
+            last_id = self._last_id
+            self._gaps = {i: t for i, t in self._gaps.items() if now - t < ORDER_EVENT_GAP_TIMEOUT}
+            gaps = list(self._gaps)
+        query = db.query(models.OrderEvent).filter(
+            or_(models.OrderEvent.id > last_id, models.OrderEvent.id.in_(gaps)) if gaps
+            else models.OrderEvent.id > last_id
+        )
+        rows = query.order_by(models.OrderEvent.id).all()
+        if not rows:
+            return []
+
+        events = [_event(row) for row in rows]
+        with self._lock:
+            expected = self._last_id + 1
+            for row in rows:
+                if row.id <= self._last_id:
+                    self._gaps.pop(row.id, None)   # a late commit filling a gap
+                    continue
+                self._gaps.update((i, now) for i in range(expected, row.id))
+                expected = row.id + 1
+            self._last_id = max(self._last_id, rows[-1].id)
+            self._append(events)
+            subscribers = list(self._subscribers)
+
+        for sub in subscribers:
+            for event in events:
+                try:
+                    sub.loop.call_soon_threadsafe(sub._deliver, event)
+                except RuntimeError:
+                    # Subscriber's loop already closed
+                    self.unsubscribe(sub)
+                    break
+        return events
+
+    def _parse_cursor(self, cursor: Optional[str]) -> Optional[int]:
+        if not cursor or not cursor.isdigit():
+            return None
+        return int(cursor)
+
+    def subscribe(self, cursor: Optional[str] = None) -> Subscription:
+        """
+        Register a subscriber on the running loop.
+        The returned subscription carries the missed events (`backlog`), a
+        `reset` flag when the cursor can't be resumed and a full reload is
+        needed, and the `cursor` the backlog ends at. All three are taken
+        under the same lock as the registration, so no event falls between
+        the backlog and the live queue.
+        """
+        loop = asyncio.get_running_loop()
+        last_seen = self._parse_cursor(cursor)
+        skip_through = 0
+        with self._lock:
+            if last_seen is None:
+                # No cursor (or one from before the shared feed): only a fresh
+                # client needs no reload
+                backlog, reset = [], bool(cursor)
+            elif last_seen < self._floor:
+                # Client missed more events than we kept
+                backlog, reset = [], True
+            else:
+                backlog = [e for seq, e in self._buffer if seq > last_seen]
+                reset = False
+                # Seen on a worker that has polled further than this one
+                skip_through = last_seen if last_seen > self._last_id else 0
+            sub = Subscription(loop, backlog, reset, str(max(self._last_id, last_seen or 0)), skip_through)
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def prune(self, db: Session, older_than: float = ORDER_EVENT_RETENTION_SECONDS) -> int:
+        deleted = db.query(models.OrderEvent).filter(
+            models.OrderEvent.created_at < time.time() - older_than
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+
+    def _in_session(self, method):
+        db = database.SessionLocal()
+        try:
+            return method(db)
+        finally:
+            db.close()
+
+    async def _poller(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self._in_session, self.poll)
+            except Exception as e:
+                log.exception("Order event poll failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _pruner(self):
+        while True:
+            await asyncio.sleep(3600)
+            try:
+                await asyncio.to_thread(self._in_session, self.prune)
+            except Exception as e:
+                log.exception("Order event prune failed")
+
+    async def start(self):
+        if self._tasks:
+            return
+        try:
+            await asyncio.to_thread(self._in_session, self.load)
+        except Exception as e:
+            log.exception("Order event feed load failed")
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [self._loop.create_task(self._poller()), self._loop.create_task(self._pruner())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._loop = None
+
+
+order_events = OrderEventBroker()
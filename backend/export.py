@@ -0,0 +1,186 @@
+"""
+Streaming order export (CSV or NDJSON) for accounting.
+
+Orders from both tiers (live and archived) are read in id order through
+server-side cursors (`stream_results` + `yield_per`), EXPORT_BATCH_SIZE at a
+time, with the customer joined in. The items of each batch come from one
+`IN` query. Memory therefore stays at one batch whatever the history size,
+and the first rows go out as soon as the first batch is read.
+
+  - csv:    one row per order item, order and customer columns repeated
+            (an order without items gets one row with empty item columns);
+  - ndjson: one JSON object per order, items nested.
+
+Usage as a script:
+    python export.py orders.csv [--format ndjson] [--status confirmed] [--date-from 2025-04-01]
+"""
+
+import csv
+import heapq
+import io
+import json
+import os
+import sys
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Iterator, Optional
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import models
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+CHUNK_BYTES = 64 * 1024      # response chunk size: small enough to start the download right away
+FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+ORDER_FIELDS = ("order_id", "created_at", "status", "total_amount", "transaction_id", "utr_number")
+CUSTOMER_FIELDS = ("customer_name", "customer_email", "customer_phone", "shipping_address")
+ITEM_FIELDS = ("product_id", "product_name", "quantity", "price", "line_total")
+CSV_COLUMNS = ORDER_FIELDS + CUSTOMER_FIELDS + ITEM_FIELDS
+
+
+def _created_bounds(date_from: Optional[str], date_to: Optional[str]) -> tuple:
+    """Inclusive YYYY-MM-DD bounds as created_at (ISO-8601) string bounds."""
+    low = date.fromisoformat(date_from).isoformat() if date_from else None
+    high = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat() if date_to else None
+    return low, high
+
+
+def _iter_tier(db: Session, order_model, item_model, status: Optional[str], low: Optional[str],
+               high: Optional[str], batch_size: int) -> Iterator[tuple]:
+    """(order row, [item rows]) for one tier, in id order."""
+    User = models.User
+    stmt = (
+        select(
+            order_model.id.label("order_id"), order_model.created_at, order_model.status,
+            order_model.total_amount, order_model.transaction_id, order_model.utr_number,
+            User.full_name.label("customer_name"), User.email.label("customer_email"),
+            User.phone.label("customer_phone"), User.shipping_address,
+        )
+        .outerjoin(User, User.id == order_model.user_id)
+        .order_by(order_model.id)
+    )
+    if status:
+        stmt = stmt.where(order_model.status == status)
+    if low:
+        stmt = stmt.where(order_model.created_at >= low)
+    if high:
+        stmt = stmt.where(order_model.created_at < high)
+
+    # Core rows through the session's connection: no ORM loading overhead per row
+    conn = db.connection()
+    result = conn.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+    for batch in result.partitions():
+        items = defaultdict(list)
+        for item in conn.execute(
+            select(item_model.order_id, item_model.product_id, item_model.product_name,
+                   item_model.quantity, item_model.price)
+            .where(item_model.order_id.in_([row.order_id for row in batch]))
+            .order_by(item_model.order_id, item_model.id)
+        ):
+            items[item.order_id].append(item)
+        for row in batch:
+            yield row, items.get(row.order_id, ())
+
+
+def iter_orders(db: Session, status: Optional[str] = None, date_from: Optional[str] = None,
+                date_to: Optional[str] = None, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[tuple]:
+    """(order row, [item rows]) from both tiers, merged in id order. Raises ValueError on bad dates."""
+    low, high = _created_bounds(date_from, date_to)
+    return heapq.merge(
+        _iter_tier(db, models.Order, models.OrderItem, status, low, high, batch_size),
+        _iter_tier(db, models.ArchivedOrder, models.ArchivedOrderItem, status, low, high, batch_size),
+        key=lambda pair: pair[0].order_id,
+    )
+
+
+def _line_total(item) -> Optional[float]:
+    if item.quantity is None or item.price is None:
+        return None
+    return round(item.quantity * item.price, 2)
+
+
+def iter_csv(orders: Iterator[tuple]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    empty_item = (None,) * len(ITEM_FIELDS)
+    for order, items in orders:
+        head = tuple(order)
+        if not items:
+            writer.writerow(head + empty_item)
+        writer.writerows(
+            head + (item.product_id, item.product_name, item.quantity, item.price, _line_total(item))
+            for item in items
+        )
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(orders: Iterator[tuple]) -> Iterator[str]:
+    lines, size = [], 0
+    for order, items in orders:
+        record = dict(zip(ORDER_FIELDS, order[:len(ORDER_FIELDS)]))
+        record["customer"] = {
+            "name": order.customer_name,
+            "email": order.customer_email,
+            "phone": order.customer_phone,
+            "shipping_address": order.shipping_address,
+        }
+        record["items"] = [
+            {
+                "product_id": item.product_id,
+                "product_name": item.product_name,
+                "quantity": item.quantity,
+                "price": item.price,
+                "line_total": _line_total(item),
+            }
+            for item in items
+        ]
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield "".join(lines)
+            lines, size = [], 0
+    if lines:
+        yield "".join(lines)
+
+
+def stream(db: Session, fmt: str, status: Optional[str] = None, date_from: Optional[str] = None,
+           date_to: Optional[str] = None) -> Iterator[str]:
+    """Export chunks in `fmt` (see FORMATS). Raises ValueError on bad dates before yielding."""
+    orders = iter_orders(db, status, date_from, date_to)
+    return iter_csv(orders) if fmt == "csv" else iter_ndjson(orders)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Export all orders (live and archived)")
+    parser.add_argument("output", help="file to write, '-' for stdout")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--status")
+    parser.add_argument("--date-from", help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--date-to", help="YYYY-MM-DD, inclusive")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    try:
+        started = time.perf_counter()
+        for chunk in stream(db, args.format, args.status, args.date_from, args.date_to):
+            out.write(chunk)
+        if out is not sys.stdout:
+            print(f"Exported to {args.output} in {time.perf_counter() - started:.1f}s")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        db.close()
@@ -0,0 +1,374 @@
+"""
+Synthetic data for scale testing: users, products, orders and order items.
+
+    python generate_data.py --users 50000 --products 500 --orders 1000000
+
+Order batches are generated in parallel by --jobs processes (default: one
+per CPU) while the main process writes them with the fastest bulk path of
+the target database:
+  - SQLite:   executemany() of a prepared INSERT, one transaction per batch,
+              with synchronous=OFF for the duration of the load;
+  - Postgres: COPY ... FROM STDIN (CSV), then the id sequences are moved past
+              the new rows.
+User, product and order IDs are assigned here (continuing after the current
+maximum), so order items reference their orders without a round trip. Existing rows are kept; the
+sales rollups are rebuilt at the end so analytics match the new orders.
+
+Distributions (all configurable):
+  - order dates spread over --days, denser towards today (growth);
+  - customers follow a power law (--user-skew): a few order a lot;
+  - products follow Zipf (--product-skew): best-sellers dominate;
+  - lines per order average --items-per-order; quantities are mostly 1-3;
+  - statuses follow --status-mix; pending orders are recent (as they'd
+    otherwise have expired), confirmed/awaiting ones carry a unique 12-digit
+    UTR.
+Generated users share the password given by --password.
+
+Runs against DATABASE_URL, like the app. Use the same --seed for the same data.
+Gateway transactions: see Payment_gateway/generate_transactions.py.
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import os
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import auth
+import crud
+import database
+import models
+import rollups
+from sqlalchemy import func
+
+DEFAULT_STATUS_MIX = "confirmed=70,cancelled=8,expired=12,awaiting_verification=5,pending=5"
+UTR_STATUSES = {"confirmed", "awaiting_verification"}
+CITIES = ("Chennai", "Bengaluru", "Hyderabad", "Mumbai", "Pune", "Kochi", "Madurai", "Coimbatore", "Delhi", "Jaipur")
+FIRST_NAMES = ("Arun", "Priya", "Karthik", "Divya", "Naveen", "Lakshmi", "Rahul", "Meena", "Vijay", "Anitha", "Suresh", "Kavya")
+LAST_NAMES = ("Kumar", "Raman", "Sharma", "Iyer", "Reddy", "Nair", "Patel", "Singh", "Das", "Menon")
+PRODUCT_KINDS = (
+    ("Dinner Plate", 12, 18, 35), ("Breakfast Plate", 8, 10, 20), ("Leaf Bowl", 6, 6, 14),
+    ("Meal Tray", 10, 20, 45), ("Snack Plate", 6, 5, 12), ("Serving Platter", 14, 30, 80),
+)
+QUANTITIES = (1, 2, 3, 4, 5, 10, 20, 50)
+QUANTITY_WEIGHTS = (40, 25, 12, 6, 5, 6, 4, 2)
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    if not mix or any(w < 0 for w in mix.values()) or not sum(mix.values()):
+        raise ValueError(f"Invalid status mix '{text}'")
+    return mix
+
+
+# ---------------------------------------------------------------------------
+# Bulk writers
+# ---------------------------------------------------------------------------
+class BulkWriter:
+    """Writes batches of tuples into a table over one raw DBAPI connection."""
+
+    def __init__(self, engine):
+        self.dialect = engine.dialect.name
+        if self.dialect not in ("sqlite", "postgresql"):
+            raise RuntimeError(f"Bulk loading doesn't support the '{self.dialect}' database")
+        self.conn = engine.raw_connection()
+        self.rows_written = 0
+        if self.dialect == "sqlite":
+            cursor = self.conn.cursor()
+            cursor.execute("PRAGMA synchronous=OFF")
+            cursor.execute("PRAGMA cache_size=-262144")   # 256 MB, for the index pages
+            cursor.close()
+
+    def write(self, table: str, columns: Sequence[str], rows: List[tuple]):
+        if not rows:
+            return
+        cursor = self.conn.cursor()
+        try:
+            if self.dialect == "sqlite":
+                cursor.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    rows,
+                )
+            else:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in rows:
+                    writer.writerow(["\\N" if v is None else v for v in row])
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer
+                )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        self.rows_written += len(rows)
+
+    def close(self, tables: Iterable[str]):
+        cursor = self.conn.cursor()
+        if self.dialect == "postgresql":
+            # COPY with explicit ids leaves the serial sequences behind
+            for table in tables:
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {table}), 1))"
+                )
+        else:
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        self.conn.commit()
+        cursor.close()
+        self.conn.close()
+
+
+def next_id(db, model) -> int:
+    return (db.query(func.max(model.id)).scalar() or 0) + 1
+
+
+# ---------------------------------------------------------------------------
+# Generators
+# ---------------------------------------------------------------------------
+def generate_users(rng: random.Random, first_id: int, count: int, hashed_password: str):
+    for user_id in range(first_id, first_id + count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield (
+            user_id,
+            f"{first.lower()}.{last.lower()}.{user_id}@example.test",
+            hashed_password,
+            f"{first} {last}",
+            f"9{rng.randrange(10 ** 9):09d}",
+            f"{rng.randint(1, 300)}, {rng.choice(LAST_NAMES)} Street, {rng.choice(CITIES)}",
+            True,
+        )
+
+
+def generate_products(rng: random.Random, first_id: int, count: int):
+    for product_id in range(first_id, first_id + count):
+        kind, inches, low, high = rng.choice(PRODUCT_KINDS)
+        yield (
+            product_id,
+            f"{kind} ({inches} inch) #{product_id}",
+            f"Eco-friendly {kind.lower()} made from pressed leaves. Pack of {rng.choice((10, 25, 50, 100))}.",
+            float(rng.randint(low, high)),
+            "",
+            rng.random() > 0.05,
+            None,  # stock not tracked
+        )
+
+
+# Order batches are generated independently (in worker processes with
+# --jobs > 1): each batch has its own seeded RNG and a fixed range of order
+# ids. Order item ids are left to the database, nothing refers to them.
+_batch_context: dict = {}
+
+
+def init_order_batches(args, user_ids: range, products: List[tuple], now: float, utr_base: int):
+    mix = parse_mix(args.status_mix)
+    _batch_context.update(
+        args=args,
+        user_ids=user_ids,
+        products=products,
+        now=now,
+        utr_base=utr_base,
+        statuses=list(mix),
+        status_weights=list(itertools.accumulate(mix.values())),
+        product_weights=list(itertools.accumulate(
+            1 / (rank ** args.product_skew) for rank in range(1, len(products) + 1)
+        )),
+        quantity_weights=list(itertools.accumulate(QUANTITY_WEIGHTS)),
+        pending_window=max(60, crud.ORDER_RESERVATION_TTL - 60),
+        day_prefixes={},   # days since epoch -> "YYYY-MM-DDT"
+    )
+
+
+def order_batch(first_order_id: int, last_order_id: int) -> Tuple[List[tuple], List[tuple]]:
+    """(order rows, item rows) for order ids [first_order_id, last_order_id)."""
+    ctx = _batch_context
+    args, user_ids, products, now = ctx["args"], ctx["user_ids"], ctx["products"], ctx["now"]
+    rng = random.Random(None if args.seed is None else args.seed * 1_000_003 + first_order_id)
+    span_seconds = args.days * 86400
+    extra_lines = max(args.items_per_order - 1, 0)
+    user_count, user_skew, utr_base = len(user_ids), args.user_skew, ctx["utr_base"]
+    day_prefixes = ctx["day_prefixes"]
+
+    # Random draws are made for the whole batch (choices(k=n) is far cheaper
+    # than n single draws), then stitched into rows
+    choices, rand, expovariate = rng.choices, rng.random, rng.expovariate
+    order_ids = range(first_order_id, last_order_id)
+    n = len(order_ids)
+    statuses = choices(ctx["statuses"], cum_weights=ctx["status_weights"], k=n)
+    lines = [1 + min(int(expovariate(1 / extra_lines)), 19) for _ in order_ids] if extra_lines else [1] * n
+    line_count = sum(lines)
+    batch_products = choices(products, cum_weights=ctx["product_weights"], k=line_count)
+    batch_quantities = choices(QUANTITIES, cum_weights=ctx["quantity_weights"], k=line_count)
+
+    orders, items = [], []
+    line = 0
+    for order_id, status, order_lines in zip(order_ids, statuses, lines):
+        if status == "pending":
+            age = rand() * ctx["pending_window"]
+        elif args.growth:
+            age = span_seconds * (1 - (1 - rand()) ** 0.5)
+        else:
+            age = span_seconds * rand()
+        created = int(now - age)
+        day, second = divmod(created, 86400)
+        prefix = day_prefixes.get(day)
+        if prefix is None:
+            prefix = day_prefixes[day] = time.strftime("%Y-%m-%dT", time.gmtime(day * 86400))
+        hour, second = divmod(second, 3600)
+        created_at = f"{prefix}{hour:02d}:{second // 60:02d}:{second % 60:02d}+00:00"
+
+        total = 0.0
+        seen = set()
+        for i in range(line, line + order_lines):
+            product_id, product_name, price = batch_products[i]
+            if product_id in seen:
+                continue   # a product appears once per order
+            seen.add(product_id)
+            quantity = batch_quantities[i]
+            total += price * quantity
+            items.append((order_id, product_id, product_name, quantity, price))
+        line += order_lines
+
+        # 7919 is coprime with 10**12, so every order gets a distinct UTR
+        utr = f"{(utr_base + order_id * 7919) % 10 ** 12:012d}" if status in UTR_STATUSES else None
+        orders.append((
+            order_id, user_ids[int(user_count * rand() ** user_skew)], round(total, 2), status,
+            f"ORD{order_id}-{created}", utr, created_at,
+        ))
+    return orders, items
+
+
+def generate_orders(args, first_order_id: int, user_ids: range, products: List[tuple]) -> Iterator[Tuple[List[tuple], List[tuple]]]:
+    """Order batches in id order, generated by up to --jobs processes."""
+    context = (args, user_ids, products, time.time(), random.Random(args.seed).randrange(10 ** 11, 10 ** 12))
+    last = first_order_id + args.orders
+    bounds = [(start, min(start + args.batch_size, last)) for start in range(first_order_id, last, args.batch_size)]
+    if args.jobs <= 1:
+        init_order_batches(*context)
+        for start, end in bounds:
+            yield order_batch(start, end)
+        return
+
+    with ProcessPoolExecutor(args.jobs, initializer=init_order_batches, initargs=context) as pool:
+        # Bounded look-ahead keeps memory flat whatever the order count
+        pending = deque()
+        for start, end in bounds:
+            pending.append(pool.submit(order_batch, start, end))
+            if len(pending) >= args.jobs * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+USER_COLUMNS = ("id", "email", "hashed_password", "full_name", "phone", "shipping_address", "is_active")
+PRODUCT_COLUMNS = ("id", "name", "description", "price", "image_url", "is_available", "stock")
+ORDER_COLUMNS = ("id", "user_id", "total_amount", "status", "transaction_id", "utr_number", "created_at")
+ITEM_COLUMNS = ("order_id", "product_id", "product_name", "quantity", "price")
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    writer = BulkWriter(database.engine)
+    started = time.perf_counter()
+    try:
+        first_user = next_id(db, models.User)
+        first_product = next_id(db, models.Product)
+        first_order = next_id(db, models.Order)
+
+        hashed_password = auth.get_password_hash(args.password)
+        users = generate_users(rng, first_user, args.users, hashed_password)
+        while True:
+            batch = list(itertools.islice(users, args.batch_size))
+            if not batch:
+                break
+            writer.write("users", USER_COLUMNS, batch)
+
+        product_rows = list(generate_products(rng, first_product, args.products))
+        writer.write("products", PRODUCT_COLUMNS, product_rows)
+        print(f"{args.users} users, {args.products} products")
+
+        # Orders draw from every user and product, including pre-existing ones
+        user_ids = range(1, first_user + args.users)
+        products = [
+            (p.id, p.name, p.price)
+            for p in db.query(models.Product.id, models.Product.name, models.Product.price).order_by(models.Product.id)
+        ]
+        if not products or not len(user_ids):
+            raise SystemExit("Need at least one user and one product to generate orders")
+        rng.shuffle(products)   # popularity shouldn't follow id order
+
+        def write_batch(order_rows, item_rows):
+            writer.write("orders", ORDER_COLUMNS, order_rows)
+            writer.write("order_items", ITEM_COLUMNS, item_rows)
+
+        # The database call releases the GIL, so the next batch is generated
+        # while the previous one is written
+        orders_written = items_written = 0
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            for order_rows, item_rows in generate_orders(args, first_order, user_ids, products):
+                in_flight.append(pool.submit(write_batch, order_rows, item_rows))
+                if len(in_flight) > 1:
+                    in_flight.popleft().result()
+                orders_written += len(order_rows)
+                items_written += len(item_rows)
+                elapsed = time.perf_counter() - started
+                print(f"\r{orders_written}/{args.orders} orders, {items_written} items "
+                      f"({writer.rows_written / elapsed:,.0f} rows/s)", end="", flush=True)
+            while in_flight:
+                in_flight.popleft().result()
+        print()
+    finally:
+        writer.close(("users", "products", "orders"))
+
+    try:
+        if not args.skip_rollups:
+            counts = rollups.rebuild(db)
+            print(f"Rebuilt sales rollups: {counts['daily_rows']} daily rows, {counts['product_rows']} product rows")
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {writer.rows_written:,} rows in {elapsed:.1f}s ({writer.rows_written / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--items-per-order", type=float, default=2.5, help="mean lines per order")
+    parser.add_argument("--days", type=int, default=365, help="history covered by order dates")
+    parser.add_argument("--no-growth", dest="growth", action="store_false", help="spread orders evenly over --days")
+    parser.add_argument("--user-skew", type=float, default=2.0, help="1 = uniform; higher = more repeat customers")
+    parser.add_argument("--product-skew", type=float, default=1.1, help="Zipf exponent; 0 = uniform")
+    parser.add_argument("--status-mix", default=DEFAULT_STATUS_MIX, help="status=weight,...")
+    parser.add_argument("--password", default="password123", help="password of every generated user")
+    parser.add_argument("--batch-size", type=int, default=20000, help="orders per insert batch / transaction")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="processes generating order batches")
+    parser.add_argument("--skip-rollups", action="store_true", help="don't rebuild the sales rollups afterwards")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    try:
+        parse_mix(args.status_mix)
+    except ValueError as e:
+        parser.error(str(e))
+    run(args)
@@ -0,0 +1,349 @@
+"""
+Resized product images.
+
+Product.image_url points at full-size originals. ProductImageService fetches
+the original (http(s) URL, or a path under PRODUCT_IMAGE_ROOT), downsizes it
+to the nearest width bucket and encodes WebP or JPEG in a worker pool. The
+encoded variants live in a size-bounded on-disk LRU cache, so a repeat view
+costs one file read.
+
+Products can be created without authentication, so remote originals are only
+fetched from public addresses: the host must not resolve to a private,
+loopback, link-local or reserved address, and redirects are re-checked hop by
+hop. The connection goes to the address that was checked (TLS still verifies
+the hostname), so a second DNS answer can't point it elsewhere.
+IMAGE_SOURCE_HOSTS narrows this further to a list of allowed hosts.
+
+Pillow is optional: without it the service reports itself unavailable and
+the endpoint redirects to the original image.
+"""
+
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+import tempfile
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import certifi
+import urllib3
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+IMAGE_WIDTHS = tuple(sorted(int(w) for w in os.getenv("IMAGE_WIDTHS", "160,320,480,640,960,1280").split(",")))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "webplate-images"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+IMAGE_FETCH_TIMEOUT = float(os.getenv("IMAGE_FETCH_TIMEOUT", "10"))
+IMAGE_SOURCE_MAX_BYTES = int(os.getenv("IMAGE_SOURCE_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_RENDER_TIMEOUT = float(os.getenv("IMAGE_RENDER_TIMEOUT", "15"))
+IMAGE_FETCH_MAX_REDIRECTS = 3
+# Comma-separated hosts remote originals may come from; empty = any public host
+IMAGE_SOURCE_HOSTS = {h.strip().lower() for h in os.getenv("IMAGE_SOURCE_HOSTS", "").split(",") if h.strip()}
+# Relative image_url values ("/images/plate.jpg") are read from here
+PRODUCT_IMAGE_ROOT = os.getenv(
+    "PRODUCT_IMAGE_ROOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "public"),
+)
+IMAGE_CACHE_CONTROL = "public, max-age=2592000, stale-while-revalidate=86400"
+
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+# Bump to invalidate every cached variant after changing the encoder settings
+_VARIANT_VERSION = "1"
+
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+class ImageSourceError(Exception):
+    """The original image could not be fetched or decoded."""
+
+
+class ImageVariant(NamedTuple):
+    path: str
+    media_type: str
+    etag: str
+
+
+def bucket_width(width: int) -> int:
+    """Smallest configured width >= `width` (the largest one for anything bigger)."""
+    i = bisect_left(IMAGE_WIDTHS, width)
+    return IMAGE_WIDTHS[min(i, len(IMAGE_WIDTHS) - 1)]
+
+
+def negotiate_format(requested: str, accept: str) -> str:
+    if requested in MEDIA_TYPES:
+        return requested
+    return "webp" if "image/webp" in accept else "jpeg"
+
+
+class DiskLRUCache:
+    """
+    Files in one directory, evicted least-recently-used first once their
+    total size passes `max_bytes`. The recency order is rebuilt from file
+    mtimes on startup and hits bump the mtime, so it survives restarts.
+    """
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()   # name -> size
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def get(self, name: str) -> Optional[str]:
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another worker sharing the directory
+            with self._lock:
+                size = self._entries.pop(name, None)
+                if size is not None:
+                    self._total -= size
+                self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, name: str, data: bytes) -> str:
+        path = self.path(name)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._total += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old, size = self._entries.popitem(last=False)
+                self._total -= size
+                self.evictions += 1
+                try:
+                    os.remove(self.path(old))
+                except FileNotFoundError:
+                    pass
+        return path
+
+    def discard(self, name: str):
+        with self._lock:
+            size = self._entries.pop(name, None)
+            if size is not None:
+                self._total -= size
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def _check_remote(url: str) -> str:
+    """
+    The address to connect to for `url`. Refuses URLs whose host is not
+    allowed or resolves to any non-public address.
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise ImageSourceError("Image URL must be an http(s) URL")
+    if IMAGE_SOURCE_HOSTS and host not in IMAGE_SOURCE_HOSTS:
+        raise ImageSourceError(f"Image host {host} is not allowed")
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, parts.port or 443, proto=socket.IPPROTO_TCP)]
+    except (socket.gaierror, UnicodeError) as e:
+        raise ImageSourceError(f"Could not resolve image host {host}: {e}")
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise ImageSourceError(f"Image host {host} resolves to a non-public address")
+    return addresses[0]
+
+
+def _open_pinned(url: str, address: str) -> urllib3.BaseHTTPResponse:
+    """GET `url` over a connection to `address`, with the URL's Host header, SNI and certificate check."""
+    parts = urlsplit(url)
+    if parts.scheme == "https":
+        pool = urllib3.HTTPSConnectionPool(
+            address, parts.port or 443,
+            server_hostname=parts.hostname, assert_hostname=parts.hostname,
+            cert_reqs="CERT_REQUIRED", ca_certs=certifi.where(),
+            timeout=IMAGE_FETCH_TIMEOUT, retries=False,
+        )
+    else:
+        pool = urllib3.HTTPConnectionPool(address, parts.port or 80, timeout=IMAGE_FETCH_TIMEOUT, retries=False)
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    host = parts.hostname if parts.port is None else f"{parts.hostname}:{parts.port}"
+    return pool.urlopen("GET", path, headers={"Host": host}, redirect=False, preload_content=False)
+
+
+def _fetch_remote(url: str) -> bytes:
+    for _ in range(IMAGE_FETCH_MAX_REDIRECTS + 1):
+        address = _check_remote(url)
+        try:
+            res = _open_pinned(url, address)
+            try:
+                if res.get_redirect_location():
+                    url = urljoin(url, res.get_redirect_location())
+                    continue
+                if res.status >= 400:
+                    raise ImageSourceError(f"Could not fetch source image: HTTP {res.status}")
+                data = bytearray()
+                for chunk in res.stream(64 * 1024):
+                    data += chunk
+                    if len(data) > IMAGE_SOURCE_MAX_BYTES:
+                        raise ImageSourceError("Source image is too large")
+                return bytes(data)
+            finally:
+                res.release_conn()
+        except urllib3.exceptions.HTTPError as e:
+            raise ImageSourceError(f"Could not fetch source image: {e}")
+    raise ImageSourceError("Too many redirects fetching the source image")
+
+
+def _read_source(image_url: str) -> bytes:
+    if image_url.startswith(("http://", "https://")):
+        return _fetch_remote(image_url)
+
+    root = os.path.realpath(PRODUCT_IMAGE_ROOT)
+    path = os.path.realpath(os.path.join(root, image_url.lstrip("/")))
+    if not path.startswith(root + os.sep):
+        raise ImageSourceError("Image path is outside the image root")
+    try:
+        if os.path.getsize(path) > IMAGE_SOURCE_MAX_BYTES:
+            raise ImageSourceError("Source image is too large")
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError as e:
+        raise ImageSourceError(f"Could not read source image: {e}")
+
+
+def render_variant(source: bytes, width: int, fmt: str) -> bytes:
+    try:
+        img = Image.open(io.BytesIO(source))
+        # JPEG sources can decode straight at a reduced scale, much cheaper
+        # than decoding the full frame and shrinking it afterwards
+        img.draft("RGB", (width, width * 4))
+        img = ImageOps.exif_transpose(img)
+    except Exception as e:
+        raise ImageSourceError(f"Could not decode source image: {e}")
+
+    if img.width > width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+
+    out = io.BytesIO()
+    if fmt == "webp":
+        keep_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if keep_alpha else "RGB")
+        img.save(out, "WEBP", quality=WEBP_QUALITY, method=4)
+    else:
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+class ProductImageService:
+    def __init__(self, workers: int = IMAGE_WORKERS, cache: Optional[DiskLRUCache] = None):
+        self._cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="product-image")
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    @property
+    def cache(self) -> DiskLRUCache:
+        # Created lazily so importing the app never touches the filesystem
+        if self._cache is None:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = DiskLRUCache()
+        return self._cache
+
+    @staticmethod
+    def variant_key(image_url: str, width: int, fmt: str) -> str:
+        digest = hashlib.sha256(f"{_VARIANT_VERSION}|{image_url}|{width}".encode()).hexdigest()[:32]
+        return f"{digest}-{width}.{fmt}"
+
+    def _render(self, name: str, image_url: str, width: int, fmt: str) -> str:
+        return self.cache.put(name, render_variant(_read_source(image_url), width, fmt))
+
+    def _done(self, name: str, fut: Future):
+        with self._lock:
+            if self._inflight.get(name) is fut:
+                del self._inflight[name]
+
+    def get(self, image_url: str, width: int, fmt: str, timeout: float = IMAGE_RENDER_TIMEOUT) -> ImageVariant:
+        """
+        The cached variant, rendering it first if needed. Concurrent requests
+        for the same variant share one render.
+        """
+        width = bucket_width(width)
+        name = self.variant_key(image_url, width, fmt)
+        path = self.cache.get(name)
+        if path is None:
+            with self._lock:
+                fut = self._inflight.get(name)
+                started = fut is None
+                if started:
+                    fut = self._executor.submit(self._render, name, image_url, width, fmt)
+                    self._inflight[name] = fut
+            if started:
+                # Outside the lock: a render that already finished runs _done inline
+                fut.add_done_callback(lambda f: self._done(name, f))
+            path = fut.result(timeout=timeout)
+        return ImageVariant(path, MEDIA_TYPES[fmt], f'"{name}"')
+
+    def read(self, image_url: str, width: int, fmt: str, timeout: float = IMAGE_RENDER_TIMEOUT) -> Tuple[ImageVariant, bytes]:
+        """
+        Like get(), with the variant's bytes. Another worker sharing the cache
+        directory can evict the file between get() and the read; it is then
+        rendered again once.
+        """
+        for _ in range(2):
+            variant = self.get(image_url, width, fmt, timeout)
+            try:
+                with open(variant.path, "rb") as f:
+                    return variant, f.read()
+            except FileNotFoundError:
+                self.cache.discard(os.path.basename(variant.path))
+        raise ImageSourceError("Cached image was evicted while it was read")
+
+
+product_images = ProductImageService()
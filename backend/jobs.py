@@ -0,0 +1,279 @@
+"""
+Durable background jobs backed by the `jobs` table.
+
+    jobs.enqueue(db, "notify.admin", {"order_id": 42})   # caller commits
+
+Enqueueing only adds a row to the caller's session, so a job exists if and
+only if the transaction that asked for it commits. Workers claim due jobs in
+small batches:
+  - Postgres: the candidate rows are selected FOR UPDATE SKIP LOCKED, so any
+    number of workers and processes claim disjoint batches without waiting;
+  - SQLite: one conditional UPDATE claims the batch; SQLite runs one writer
+    at a time, so a job is only ever claimed by one worker.
+Each job runs its handler in a thread (handlers are plain sync functions
+taking a Session and the payload). Failures are retried with exponential
+backoff; after max_attempts the job is left as 'failed'. Jobs whose worker
+died mid-run are reclaimed after JOB_LOCK_TIMEOUT.
+
+Workers run inside the API process (JOB_WORKERS, default 2; 0 disables) or
+as a separate process:
+    python jobs.py
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import traceback
+import uuid
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import database
+import models
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.orm import Session
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "10"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_LOCK_TIMEOUT = float(os.getenv("JOB_LOCK_TIMEOUT", "300"))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "2"))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "600"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+log = logging.getLogger("backend.jobs")
+
+_handlers: Dict[str, Callable] = {}
+
+
+def handler(kind: str):
+    """Register `fn(db, **payload)` as the handler for a job kind."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(db: Session, kind: str, payload: Optional[dict] = None, delay: float = 0.0, max_attempts: int = 5) -> models.Job:
+    now = time.time()
+    job = models.Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        status="queued",
+        attempts=0,
+        max_attempts=max_attempts,
+        run_at=now + delay,
+        created_at=now,
+    )
+    db.add(job)
+    return job
+
+
+def backoff(attempts: int) -> float:
+    delay = min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim(db: Session, limit: int = JOB_BATCH_SIZE) -> List[models.Job]:
+    """Atomically mark up to `limit` due jobs as running and return them."""
+    now = time.time()
+    Job = models.Job
+    due = or_(
+        and_(Job.status == "queued", Job.run_at <= now),
+        and_(Job.status == "running", Job.locked_at < now - JOB_LOCK_TIMEOUT),
+    )
+    candidates = db.query(Job.id).filter(due).order_by(Job.run_at).limit(limit)
+    if db.get_bind().dialect.name == "postgresql":
+        candidates = candidates.with_for_update(skip_locked=True)
+
+    token = uuid.uuid4().hex
+    db.execute(
+        update(Job)
+        .where(Job.id.in_(candidates.scalar_subquery()), due)
+        .values(status="running", locked_by=token, locked_at=now, attempts=Job.attempts + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return db.query(Job).filter(Job.locked_by == token, Job.status == "running").all()
+
+
+def _finish(db: Session, job: models.Job, error: Optional[str]):
+    Job = models.Job
+    if error is None:
+        values = {"status": "done", "last_error": None}
+    elif job.attempts >= job.max_attempts:
+        values = {"status": "failed", "last_error": error}
+    else:
+        values = {"status": "queued", "last_error": error, "run_at": time.time() + backoff(job.attempts)}
+    # Only the holder of the claim may finish the job; a reclaimed job
+    # belongs to whoever reclaimed it
+    db.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.locked_by == job.locked_by)
+        .values(locked_by=None, locked_at=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def run_job(job_id: int, locked_by: str):
+    """Run one claimed job to completion in the calling thread."""
+    db = database.SessionLocal()
+    try:
+        job = db.get(models.Job, job_id)
+        if job is None or job.locked_by != locked_by:
+            return
+        fn = _handlers.get(job.kind)
+        error = None
+        if fn is None:
+            error = f"No handler registered for job kind '{job.kind}'"
+            job.attempts = job.max_attempts
+        else:
+            try:
+                fn(db, **json.loads(job.payload or "{}"))
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                error = f"{e.__class__.__name__}: {e}\n{traceback.format_exc(limit=5)}"
+        if error:
+            log.warning(
+                "Job attempt failed: %s", error.splitlines()[0],
+                extra={"job_id": job.id, "kind": job.kind, "attempt": job.attempts, "max_attempts": job.max_attempts},
+            )
+        _finish(db, job, error)
+    finally:
+        db.close()
+
+
+def _prune():
+    db = database.SessionLocal()
+    try:
+        prune(db)
+    finally:
+        db.close()
+
+
+def _claim_batch(limit: int) -> List[tuple]:
+    db = database.SessionLocal()
+    try:
+        return [(job.id, job.locked_by) for job in claim(db, limit)]
+    finally:
+        db.close()
+
+
+def prune(db: Session, older_than: float = JOB_RETENTION_SECONDS) -> int:
+    deleted = db.query(models.Job).filter(
+        models.Job.status == "done", models.Job.created_at < time.time() - older_than
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def stats(db: Session) -> dict:
+    counts = dict(db.query(models.Job.status, func.count(models.Job.id)).group_by(models.Job.status).all())
+    failed = db.query(models.Job).filter(models.Job.status == "failed").order_by(models.Job.id.desc()).limit(20)
+    return {
+        "counts": {s: counts.get(s, 0) for s in ("queued", "running", "done", "failed")},
+        "recent_failures": [
+            {"id": j.id, "kind": j.kind, "attempts": j.attempts, "error": (j.last_error or "").split("\n", 1)[0]}
+            for j in failed
+        ],
+    }
+
+
+class JobWorkers:
+    """asyncio workers polling the jobs table; `wake()` skips the poll wait."""
+
+    def __init__(self, count: int = JOB_WORKERS, poll_interval: float = JOB_POLL_INTERVAL):
+        self.count = count
+        self.poll_interval = poll_interval
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def wake(self):
+        """Thread-safe nudge after enqueueing from a request handler."""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _worker(self):
+        while True:
+            try:
+                batch = await asyncio.to_thread(_claim_batch, JOB_BATCH_SIZE)
+                for job_id, locked_by in batch:
+                    await asyncio.to_thread(run_job, job_id, locked_by)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception("Job worker error")
+                batch = []
+            if len(batch) < JOB_BATCH_SIZE:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _pruner(self):
+        while True:
+            await asyncio.sleep(3600)
+            try:
+                await asyncio.to_thread(_prune)
+            except Exception as e:
+                log.exception("Job prune failed")
+
+    def start(self):
+        if self._tasks or self.count <= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [self._loop.create_task(self._worker()) for _ in range(self.count)]
+        self._tasks.append(self._loop.create_task(self._pruner()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._loop = None
+
+
+workers = JobWorkers()
+
+
+if __name__ == "__main__":
+    import argparse
+    import tasks  # noqa: F401  (registers the handlers)
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), "..", "Payment_gateway"))
+    from utils.structured_log import configure_logging
+    configure_logging("backend.jobs")
+
+    parser = argparse.ArgumentParser(description="Run background job workers without the API")
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1))
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+
+    async def main():
+        standalone = JobWorkers(count=args.workers)
+        standalone.start()
+        log.info("Job workers running", extra={"workers": args.workers})
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await standalone.stop()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
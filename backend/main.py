@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status, WebSocket, WebSocketDisconnect, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 import yaml
@@ -7,25 +7,56 @@ import sys
 
 # Add backend directory to path so absolute imports work on Vercel
 sys.path.insert(0, os.path.dirname(__file__))
+# Shared UPI link / QR helpers live in the payment gateway's utils package
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "Payment_gateway"))
 
 import models
 import schemas
 import crud
 import database
 import auth
+import events
+import reconcile
+import qr
+import search
+import rollups
+import archive
+import export
+import pricing
+import images
+import jobs
+import tasks  # registers background job handlers
+from utils.upi_links import build_upi_uri, build_gpay_intent_url
+from utils.compression import CompressionMiddleware, PrecompressedBody
+from utils.structured_log import configure_logging, RequestLogMiddleware
+from utils import tracing
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-import urllib.parse
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager
 from datetime import timedelta
+from typing import Optional
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
 import time
 
+configure_logging("backend")
+log = logging.getLogger("backend")
+migration_log = logging.getLogger("backend.migrations")
+order_log = logging.getLogger("backend.orders")
+admin_log = logging.getLogger("backend.admin")
+
 # Ensure tables exist (especially important for PostgreSQL/Supabase)
 try:
-    print("Initializing database tables...")
+    migration_log.info("Initializing database tables")
     models.Base.metadata.create_all(bind=database.engine)
-    print("Database tables initialized successfully.")
+    migration_log.info("Database tables initialized")
 except Exception as e:
-    print(f"Error initializing tables: {e}")
+    migration_log.error("Error initializing tables: %s", e)
 
 # Run schema migration to fix orders table schema
 # Strategy: if any stale columns exist, drop order_items + orders and recreate fresh
@@ -41,15 +72,15 @@ try:
     _needs_recreate = any(c in _existing_cols for c in _stale)
 
     if _needs_recreate:
-        print("Schema migration: stale columns detected - dropping and recreating orders tables...")
+        migration_log.warning("Stale columns detected; dropping and recreating orders tables")
         with database.engine.connect() as _conn:
             _conn.execute(text("DROP TABLE IF EXISTS order_items CASCADE"))
             _conn.execute(text("DROP TABLE IF EXISTS orders CASCADE"))
             _conn.commit()
-            print("  -> orders and order_items tables dropped.")
+            migration_log.info("orders and order_items tables dropped")
         # Recreate with current models
         models.Base.metadata.create_all(bind=database.engine)
-        print("  -> orders and order_items tables recreated cleanly.")
+        migration_log.info("orders and order_items tables recreated")
     else:
         # Just add any missing columns (safe path when table is already correct)
         with database.engine.connect() as _conn:
@@ -63,18 +94,119 @@ try:
             }
             for _col, _sql in _migrations.items():
                 if _col not in _existing_cols:
-                    print(f"Schema migration: adding column '{_col}' to orders...")
+                    migration_log.info("Adding column to orders", extra={"column": _col})
                     _conn.execute(text(_sql))
                     _conn.commit()
 
-    print("Schema migration complete.")
+    _product_cols = [col["name"] for col in _insp.get_columns("products")]
+    if "stock" not in _product_cols:
+        migration_log.info("Adding column to products", extra={"column": "stock"})
+        with database.engine.connect() as _conn:
+            _conn.execute(text("ALTER TABLE products ADD COLUMN stock INTEGER"))
+            _conn.commit()
+
+    # Item lookups by order (listings, exports) scan order_items without it
+    with database.engine.connect() as _conn:
+        _conn.execute(text("CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)"))
+        _conn.commit()
+
+    migration_log.info("Schema migration complete")
+except Exception as e:
+    migration_log.warning("Schema migration warning: %s", e)
+
+# First deploy of the sales rollups: backfill them from existing orders
+try:
+    _db = database.SessionLocal()
+    try:
+        if rollups.backfill_if_empty(_db):
+            migration_log.info("Sales rollups backfilled from existing orders")
+    finally:
+        _db.close()
 except Exception as e:
-    print(f"Schema migration warning: {e}")
+    migration_log.warning("Sales rollup backfill skipped: %s", e)
+
+# How often unpaid orders past ORDER_RESERVATION_TTL are expired
+ORDER_EXPIRY_INTERVAL = float(os.getenv("ORDER_EXPIRY_INTERVAL", "60"))
+
+def _expire_stale_orders():
+    db = database.SessionLocal()
+    try:
+        expired = crud.expire_stale_orders(db)
+        for db_order in expired:
+            events.order_events.publish(db, "order.status_changed", db_order)
+        db.commit()
+        events.order_events.wake()
+        if expired:
+            order_log.info("Expired unpaid orders and released their stock", extra={"count": len(expired)})
+    finally:
+        db.close()
+
+async def _order_expiry_loop():
+    while True:
+        try:
+            await asyncio.to_thread(_expire_stale_orders)
+        except Exception as e:
+            order_log.exception("Order expiry pass failed")
+        await asyncio.sleep(ORDER_EXPIRY_INTERVAL)
+
+def _archive_old_orders():
+    db = database.SessionLocal()
+    try:
+        moved = archive.archive_old_orders(db)
+        if moved:
+            order_log.info("Archived old finished orders", extra={"count": moved})
+    finally:
+        db.close()
+
+async def _order_archive_loop():
+    while True:
+        try:
+            await asyncio.to_thread(_archive_old_orders)
+        except Exception as e:
+            order_log.exception("Order archival pass failed")
+        await asyncio.sleep(archive.ORDER_ARCHIVE_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loops = [asyncio.create_task(_order_expiry_loop())]
+    if archive.ORDER_ARCHIVE_AFTER_DAYS > 0:
+        loops.append(asyncio.create_task(_order_archive_loop()))
+    jobs.workers.start()
+    await events.order_events.start()
+    yield
+    await events.order_events.stop()
+    await jobs.workers.stop()
+    for loop in loops:
+        loop.cancel()
+        try:
+            await loop
+        except asyncio.CancelledError:
+            pass
+
+def prepare_fork():
+    """serve.py: runs once in the parent before workers are forked."""
+    # Connections opened by the migrations above must not be shared with workers
+    database.engine.dispose()
+
+def warm_up():
+    """serve.py: runs in each worker before it accepts connections."""
+    pool_size = database.engine.pool.size() if hasattr(database.engine.pool, "size") else 1
+    connections = [database.engine.connect() for _ in range(pool_size)]
+    for conn in connections:
+        conn.close()
+    db = database.SessionLocal()
+    try:
+        search.product_search.warm_up(db)
+        pricing.price_book.current(db)
+        _cached_products(db, 0, 100)   # the storefront's default listing
+    finally:
+        db.close()
 
 app = FastAPI(
     title="Leaf Plate Sales API",
     description="API for Leaf Plate Sales Business",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Load config
@@ -95,6 +227,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(CompressionMiddleware)
+# Opt-in span tracing: X-Debug-Trace: <ADMIN_PASSWORD>, or TRACE_SAMPLE_RATE
+app.add_middleware(tracing.TracingMiddleware, secret=os.getenv("ADMIN_PASSWORD", "Naveen12345"))
+# Outermost, so the logged duration covers compression too
+app.add_middleware(RequestLogMiddleware)
+tracing.instrument_sqlalchemy(database.engine)
+
 def get_db():
     db = database.SessionLocal()
     try:
@@ -106,7 +245,8 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 async def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
     try:
-        payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+        with tracing.span("auth.jwt_decode"):
+            payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(
@@ -141,14 +281,99 @@ async def get_current_user(db: Session = Depends(get_db), token: str = Depends(o
 def read_root():
     return {"message": "Welcome to Leaf Plate Sales API"}
 
+# Serialized product listings keyed by (skip, limit), with their compressed
+# variants built once per entry. Short TTL bounds staleness across workers.
+PRODUCTS_CACHE_TTL = float(os.getenv("PRODUCTS_CACHE_TTL", "30"))
+_products_cache: dict = {}   # (skip, limit) -> (expires_at, PrecompressedBody)
+
+def _product_dict(product) -> dict:
+    # Support both Pydantic v1 and v2
+    if hasattr(schemas.Product, "model_validate"):
+        return schemas.Product.model_validate(product).model_dump()
+    return schemas.Product.from_orm(product).dict()
+
+def _cached_products(db: Session, skip: int, limit: int) -> PrecompressedBody:
+    key = (skip, limit)
+    cached = _products_cache.get(key)
+    if cached is None or cached[0] < time.time():
+        products = crud.get_products(db, skip=skip, limit=limit)
+        with tracing.span("serialize.products", count=len(products)):
+            body = json.dumps([_product_dict(p) for p in products], separators=(",", ":")).encode()
+        if len(_products_cache) >= 64:
+            _products_cache.clear()
+        cached = _products_cache[key] = (time.time() + PRODUCTS_CACHE_TTL, PrecompressedBody(body))
+    return cached[1]
+
 @app.get("/products/", response_model=list[schemas.Product], tags=["Products"])
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    products = crud.get_products(db, skip=skip, limit=limit)
-    return products
+def read_products(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    return _cached_products(db, skip, limit).response(request)
+
+@app.get("/products/search", response_model=list[schemas.Product], tags=["Products"])
+def search_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """
+    Ranked search over product name and description.
+    Matches word prefixes ("plat" -> "plate") and tolerates small typos ("palte").
+    """
+    ids = search.product_search.search(db, q, limit)
+    return crud.get_products_by_ids(db, ids)
+
+@app.get("/products/{product_id}/image", tags=["Products"])
+def product_image(
+    product_id: int,
+    request: Request,
+    w: int = Query(480, ge=16, le=4096),
+    format: str = "auto",
+    db: Session = Depends(get_db),
+):
+    """
+    The product's image resized to the nearest width bucket, as WebP when the
+    browser accepts it (or as forced by `format=webp|jpeg`), otherwise JPEG.
+    """
+    db_product = crud.get_product(db, product_id)
+    if not db_product or not db_product.image_url:
+        raise HTTPException(status_code=404, detail="Product image not found")
+    if not images.product_images.available:
+        return RedirectResponse(db_product.image_url)
+
+    fmt = images.negotiate_format(format, request.headers.get("accept", ""))
+    try:
+        variant, body = images.product_images.read(db_product.image_url, w, fmt)
+    except images.ImageSourceError as e:
+        log.warning("Product image failed: %s", e, extra={"product_id": product_id})
+        raise HTTPException(status_code=502, detail="Could not load the product image")
+    except FutureTimeoutError:
+        raise HTTPException(status_code=503, detail="Image is still rendering, retry shortly", headers={"Retry-After": "1"})
+
+    headers = {"ETag": variant.etag, "Cache-Control": images.IMAGE_CACHE_CONTROL}
+    if format not in images.MEDIA_TYPES:
+        headers["Vary"] = "Accept"
+    if request.headers.get("if-none-match") == variant.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=variant.media_type, headers=headers)
 
 @app.post("/products/", response_model=schemas.Product, status_code=status.HTTP_201_CREATED, tags=["Products"])
 def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)):
-    return crud.create_product(db=db, product=product)
+    db_product = crud.create_product(db=db, product=product)
+    _products_cache.clear()
+    pricing.price_book.invalidate()
+    search.product_search.product_changed(db_product)
+    return db_product
+
+@app.post("/cart/quote", tags=["Orders"])
+def quote_cart(cart: schemas.CartQuote, db: Session = Depends(get_db)):
+    """
+    Prices a cart from the in-memory price snapshot (no database round trip
+    while it is fresh). Returns line totals, the total and `price_version`;
+    send `price_version` with POST /orders/ to skip re-reading the prices.
+    """
+    try:
+        return pricing.price_book.quote(db, cart.items)
+    except pricing.QuoteError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # --- Auth Routes ---
 
@@ -158,19 +383,20 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         db_user = crud.get_user_by_email(db, email=user.email)
         if db_user:
             raise HTTPException(status_code=400, detail="Email already registered")
-        return crud.create_user(db=db, user=user)
+        with tracing.span("auth.create_user"):
+            return crud.create_user(db=db, user=user)
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Unexpected registration error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Unexpected registration error")
         raise HTTPException(status_code=500, detail=f"Registration failed due to server error: {str(e)}")
 
 @app.post("/auth/token", response_model=schemas.Token, tags=["Auth"])
 async def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
     user = crud.get_user_by_email(db, email=form_data.username)
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    with tracing.span("auth.verify_password"):
+        valid = user is not None and auth.verify_password(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -191,14 +417,31 @@ def create_contact(contact: schemas.ContactCreate, db: Session = Depends(get_db)
     try:
         return crud.create_contact(db=db, contact=contact)
     except Exception as e:
-        print(f"Error creating contact: {str(e)}")
+        log.exception("Error creating contact")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Database error: {str(e)}"
         )
 
+def _order_upi_uri(db_order) -> str:
+    return build_upi_uri(
+        amount=db_order.total_amount,
+        note=f"Order #{db_order.id}",
+        transaction_id=db_order.transaction_id,
+    )
+
+def _order_qr_token(order_id: int, transaction_id: str) -> str:
+    # Capability for the public QR URL; transaction_id alone is guessable
+    message = f"order-qr:{order_id}:{transaction_id}".encode()
+    return hmac.new(auth.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()[:32]
+
 @app.post("/orders/", tags=["Orders"])
-def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_order(order: schemas.OrderCreate, include_qr: bool = False, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """
+    Places an order and returns its UPI payment links.
+    The QR code is rendered in the background and served at `qr_url`;
+    pass include_qr=true to get it inline as an SVG data URI instead.
+    """
     # Ensure user has shipping details
     if not current_user.shipping_address or not current_user.phone:
         raise HTTPException(
@@ -207,53 +450,125 @@ def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db), curr
         )
 
     try:
-        # Create order in DB
-        db_order = crud.create_order(db=db, order=order, user_id=current_user.id)
-
-        # --- Inline UPI Payment Generation (no external service needed) ---
-        RECEIVER_UPI_ID = os.getenv("RECEIVER_UPI_ID", "naveen1998726-1@okicici")
-        RECEIVER_NAME   = os.getenv("RECEIVER_NAME", "Naveen")
-        transaction_id  = f"ORD{db_order.id}-{int(time.time())}"
-
-        # Save transaction_id to order record
+        # Create order in DB (reserves stock atomically)
+        try:
+            db_order = crud.create_order(db=db, order=order, user_id=current_user.id)
+        except crud.OutOfStockError as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+        except crud.InvalidQuantityError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+        # --- UPI Payment Generation (shared with the payment gateway) ---
+        order_id = db_order.id
+        transaction_id  = f"ORD{order_id}-{int(time.time())}"
+
+        # Save transaction_id to order record; follow-up work is queued in
+        # the same commit and runs off the request path
         try:
             db_order.transaction_id = transaction_id
+            jobs.enqueue(db, "notify.admin", {"event": "order.created", "order_id": order_id})
+            events.order_events.publish(db, "order.created", db_order)
             db.commit()
         except Exception:
-            pass
+            # The order is already saved without a transaction id the customer
+            # could pay against; the expiry sweep releases its stock
+            db.rollback()
+            order_log.exception("Could not save the new order's transaction id", extra={"order_id": order_id})
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Your order could not be completed. Please try again."
+            )
+        jobs.workers.wake()
+        events.order_events.wake()
 
-        upi_params = {
-            "pa": RECEIVER_UPI_ID,
-            "pn": RECEIVER_NAME,
-            "am": f"{order.total_amount:.2f}",
-            "cu": "INR",
-            "tn": f"Order #{db_order.id}",
-            "tr": transaction_id,
-        }
-        upi_uri = "upi://pay?" + urllib.parse.urlencode(upi_params)
+        # Use the server-calculated total, not the client-supplied one
+        upi_uri = _order_upi_uri(db_order)
+        gpay_url = build_gpay_intent_url(upi_uri)
+        qr_pending = qr.order_qr.prerender(upi_uri)
 
-        # GPay Android intent deep-link
-        gpay_url = (
-            "intent://pay?" + urllib.parse.urlencode(upi_params)
-            + "#Intent;scheme=upi;package=com.google.android.apps.nbu.paisa.user;end"
-        )
-
-        print(f"UPI payment link generated for order #{db_order.id}: {upi_uri}")
-        return {
+        order_log.info("Order created", extra={"order_id": db_order.id, "total_amount": db_order.total_amount})
+        response = {
             "order_id": db_order.id,
             "transaction_id": transaction_id,
             "upi_uri": upi_uri,
             "gpay_url": gpay_url,
             "message": "Order placed! Scan the QR code or use UPI app to pay."
         }
+        if qr_pending is not None:
+            response["qr_url"] = f"/orders/{db_order.id}/qr?token={_order_qr_token(db_order.id, transaction_id)}"
+            if include_qr:
+                try:
+                    with tracing.span("qr.render_wait"):
+                        response["qr_code"] = qr.OrderQRService.data_uri(
+                            qr_pending.result(timeout=qr.ORDER_QR_INLINE_TIMEOUT)
+                        )
+                except FutureTimeoutError:
+                    pass  # client falls back to qr_url
+        return response
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error creating order: {str(e)}")
+        order_log.exception("Error creating order")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Database error: {str(e)}"
         )
 
+@app.get("/orders/", tags=["Orders"])
+def read_my_orders(
+    before: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """
+    The current user's orders, newest first, including archived ones.
+    Pass the last order_id of a page as `before` to get the next page.
+    """
+    orders = archive.list_orders(db, user_id=current_user.id, before_id=before, limit=limit)
+    return [
+        {
+            "order_id": o.id,
+            "status": o.status,
+            "total_amount": o.total_amount,
+            "utr_number": o.utr_number,
+            "created_at": o.created_at,
+            "items": [
+                {"product_id": item.product_id, "product_name": item.product_name, "quantity": item.quantity, "price": item.price}
+                for item in o.items
+            ],
+        }
+        for o in orders
+    ]
+
+@app.get("/orders/{order_id}/qr", tags=["Orders"])
+def order_payment_qr(order_id: int, token: str, db: Session = Depends(get_db)):
+    """
+    SVG QR code for an order's UPI payment link.
+    `token` is an HMAC of the order and its transaction_id (part of the
+    `qr_url` returned by POST /orders/), so the URL works in an <img> tag
+    without an auth header but cannot be guessed from the order id.
+    """
+    db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    if not db_order or not db_order.transaction_id or not hmac.compare_digest(
+        _order_qr_token(db_order.id, db_order.transaction_id).encode(), token.encode()
+    ):
+        raise HTTPException(status_code=404, detail="Order not found")
+    if not qr.order_qr.available:
+        raise HTTPException(status_code=501, detail="QR rendering is not installed on this server")
+
+    try:
+        with tracing.span("qr.render"):
+            entry = qr.order_qr.get(_order_upi_uri(db_order))
+    except FutureTimeoutError:
+        raise HTTPException(status_code=503, detail="QR code is still rendering, retry shortly", headers={"Retry-After": "1"})
+    return Response(
+        content=entry.content,
+        media_type=qr.ORDER_QR_MEDIA_TYPE,
+        headers={"ETag": entry.etag, "Cache-Control": qr.ORDER_QR_CACHE_CONTROL},
+    )
+
 @app.post("/orders/{order_id}/confirm", tags=["Orders"])
 def confirm_order_payment(
     order_id: int,
@@ -274,7 +589,16 @@ def confirm_order_payment(
     ).first()
 
     if not db_order:
-        raise HTTPException(status_code=404, detail="Order not found")
+        archived = archive.get_archived_order(db, order_id, current_user.id)
+        if archived is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        if archived.status == "confirmed":
+            return {
+                "message": "Payment already submitted for this order. We are verifying it.",
+                "order_id": order_id,
+                "status": archived.status
+            }
+        raise HTTPException(status_code=409, detail="This order is closed. Please place a new order.")
 
     if db_order.status in ("awaiting_verification", "confirmed"):
         return {
@@ -301,12 +625,8 @@ def confirm_order_payment(
         )
 
     # --- Duplicate UTR Check ---
-    # Prevent the same UTR being used for multiple orders
-    existing = db.query(models.Order).filter(
-        models.Order.utr_number == utr,
-        models.Order.id != order_id
-    ).first()
-    if existing:
+    # Prevent the same UTR being used for multiple orders, archived ones included
+    if archive.utr_used_by(db, utr, exclude_order_id=order_id) is not None:
         raise HTTPException(
             status_code=400,
             detail=(
@@ -317,10 +637,22 @@ def confirm_order_payment(
 
     # Save UTR and mark as awaiting verification (not yet confirmed)
     db_order.utr_number = utr
-    db_order.status = "awaiting_verification"
+    try:
+        # A paid-for expired order takes its stock back if it is still there
+        crud.set_order_status(db, db_order, "awaiting_verification")
+    except crud.OutOfStockError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail=f"This order expired and is no longer in stock ({e}). Please contact us with your UTR for a refund.",
+        )
+    jobs.enqueue(db, "notify.admin", {"event": "payment.submitted", "order_id": order_id})
+    events.order_events.publish(db, "order.status_changed", db_order)
     db.commit()
+    jobs.workers.wake()
+    events.order_events.wake()
 
-    print(f"Order #{order_id} UTR submitted: {utr} — awaiting manual verification")
+    order_log.info("UTR submitted, awaiting verification", extra={"order_id": order_id, "utr_number": utr})
     return {
         "message": (
             "UTR submitted successfully! Your order is now awaiting verification. "
@@ -343,7 +675,8 @@ def get_all_orders(x_admin_key: str = None, db: Session = Depends(get_db)):
     if x_admin_key != secret:
         raise HTTPException(status_code=403, detail="Forbidden: invalid admin password")
 
-    orders = db.query(models.Order).order_by(models.Order.id.desc()).all()
+    # Live and archived orders, newest first
+    orders = archive.list_orders(db)
     result = []
     for o in orders:
         user = o.user
@@ -371,6 +704,51 @@ def get_all_orders(x_admin_key: str = None, db: Session = Depends(get_db)):
         })
     return result
 
+def _export_chunks(fmt: str, status: Optional[str], date_from: Optional[str], date_to: Optional[str]):
+    # Its own session: the response outlives the request's dependencies
+    db = database.SessionLocal()
+    try:
+        chunks = export.stream(db, fmt, status, date_from, date_to)
+    except ValueError:
+        db.close()
+        raise
+    def generate():
+        try:
+            yield from chunks
+        finally:
+            db.close()
+    return generate()
+
+@app.get("/admin/orders/export", tags=["Admin"])
+def export_orders(
+    x_admin_key: str = None,
+    format: str = "csv",
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+):
+    """
+    Admin endpoint to download every order (live and archived) with customer
+    and item details, streamed as CSV (one row per item) or NDJSON (one order
+    per line). date_from / date_to: inclusive YYYY-MM-DD bounds (UTC days).
+    """
+    secret = os.getenv("ADMIN_PASSWORD", "Naveen12345")
+    if x_admin_key != secret:
+        raise HTTPException(status_code=403, detail="Forbidden: invalid admin password")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(export.FORMATS)}")
+
+    try:
+        chunks = _export_chunks(format, status, date_from, date_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date_from / date_to must be YYYY-MM-DD")
+    admin_log.info("Order export started", extra={"format": format, "status": status})
+    return StreamingResponse(
+        chunks,
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="orders.{format}"'},
+    )
+
 @app.patch("/admin/orders/{order_id}/status", tags=["Admin"])
 def update_order_status(order_id: int, payload: dict, x_admin_key: str = None, db: Session = Depends(get_db)):
     """
@@ -384,18 +762,143 @@ def update_order_status(order_id: int, payload: dict, x_admin_key: str = None, d
 
     db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
     if not db_order:
+        if archive.get_archived_order(db, order_id) is not None:
+            raise HTTPException(status_code=409, detail="Archived orders are read-only")
         raise HTTPException(status_code=404, detail="Order not found")
 
     new_status = payload.get("status")
-    allowed = {"pending", "awaiting_verification", "confirmed", "cancelled"}
+    allowed = {"pending", "awaiting_verification", "confirmed", "cancelled", "expired"}
     if new_status not in allowed:
         raise HTTPException(status_code=400, detail=f"Status must be one of {allowed}")
 
-    db_order.status = new_status
+    try:
+        # Cancelling releases the order's stock; reopening takes it again
+        crud.set_order_status(db, db_order, new_status)
+    except crud.OutOfStockError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"Cannot reopen order: {e}")
+    events.order_events.publish(db, "order.status_changed", db_order)
     db.commit()
-    print(f"Admin: order #{order_id} status -> {new_status}")
+    events.order_events.wake()
+    admin_log.info("Order status changed", extra={"order_id": order_id, "status": new_status})
     return {"order_id": order_id, "status": new_status}
 
+@app.post("/admin/reconcile", tags=["Admin"])
+def reconcile_bank_statement(
+    statement: UploadFile = File(...),
+    x_admin_key: str = None,
+    dry_run: bool = False,
+    utr_column: Optional[str] = None,
+    amount_column: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Admin endpoint to reconcile a bank statement export (CSV or XLSX).
+    Credits whose UTR and amount match an order in 'awaiting_verification'
+    are confirmed in bulk; mismatches and unmatched credits are reported.
+    Pass dry_run=true to get the report without confirming anything.
+    """
+    secret = os.getenv("ADMIN_PASSWORD", "Naveen12345")
+    if x_admin_key != secret:
+        raise HTTPException(status_code=403, detail="Forbidden: invalid admin password")
+
+    try:
+        rows = reconcile.iter_statement_rows(statement.file, statement.filename or "")
+        report = reconcile.reconcile_statement(db, rows, dry_run, utr_column, amount_column)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    admin_log.info("Bank statement reconciled", extra={
+        "confirmed": len(report["confirmed"]),
+        "mismatches": len(report["amount_mismatches"]),
+        "unmatched_credits": report["unmatched_credits_total"],
+        "dry_run": dry_run,
+    })
+    return report
+
+@app.get("/admin/analytics/sales", tags=["Admin"])
+def sales_analytics(
+    x_admin_key: str = None,
+    group_by: str = "day",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    status: Optional[str] = None,
+    product_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Admin endpoint for revenue / order / unit totals, read from the sales rollups.
+    group_by: comma-separated subset of day, product, status (e.g. "day,status").
+    date_from / date_to: inclusive YYYY-MM-DD bounds (UTC days).
+    """
+    secret = os.getenv("ADMIN_PASSWORD", "Naveen12345")
+    if x_admin_key != secret:
+        raise HTTPException(status_code=403, detail="Forbidden: invalid admin password")
+
+    fields = [f.strip() for f in group_by.split(",") if f.strip()]
+    unknown = set(fields) - set(rollups.GROUP_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"group_by fields must be among {rollups.GROUP_FIELDS}")
+
+    rows = rollups.query_sales(db, fields, date_from, date_to, status, product_id)
+    totals = {"orders": sum(r["orders"] for r in rows), "revenue": round(sum(r["revenue"] for r in rows), 2)}
+    if "product" in fields or product_id is not None:
+        totals["units"] = sum(r["units"] for r in rows)
+        # An order with several products appears once per product
+        totals.pop("orders")
+    return {"group_by": fields, "rows": rows, "totals": totals}
+
+@app.get("/admin/jobs", tags=["Admin"])
+def background_jobs(x_admin_key: str = None, db: Session = Depends(get_db)):
+    """
+    Admin endpoint for the background job queue: counts per status and the
+    most recent jobs that failed all their attempts.
+    """
+    secret = os.getenv("ADMIN_PASSWORD", "Naveen12345")
+    if x_admin_key != secret:
+        raise HTTPException(status_code=403, detail="Forbidden: invalid admin password")
+    return jobs.stats(db)
+
+@app.websocket("/admin/orders/ws")
+async def admin_orders_feed(websocket: WebSocket, x_admin_key: str = None, cursor: Optional[str] = None):
+    """
+    Live feed of order.created / order.status_changed events for the admin dashboard.
+    Pass x_admin_key query param equal to ADMIN_PASSWORD env var.
+    Reconnect with ?cursor=<last event cursor> to receive only the missed events;
+    a {"type": "reset"} message means the cursor is too old and /admin/orders
+    should be reloaded once.
+    """
+    secret = os.getenv("ADMIN_PASSWORD", "Naveen12345")
+    if x_admin_key != secret:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    subscription = events.order_events.subscribe(cursor)
+    try:
+        await websocket.send_json({"type": "hello", "cursor": subscription.cursor})
+        if subscription.reset:
+            await websocket.send_json({"type": "reset", "cursor": subscription.cursor})
+        for event in subscription.backlog:
+            await websocket.send_json(event)
+
+        while True:
+            if subscription.lagged:
+                # Too slow to keep up: client should reconnect with its last cursor
+                await websocket.close(code=1013)
+                return
+            try:
+                event = await subscription.get(timeout=30)
+            except asyncio.TimeoutError:
+                # Heartbeat so dead connections are noticed and dropped
+                await websocket.send_json({"type": "ping"})
+                continue
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        events.order_events.unsubscribe(subscription)
+
 @app.get("/contact-info/", tags=["Contact"])
 def get_contact_info():
     contact = config.get("contact", {})
@@ -403,3 +906,6 @@ def get_contact_info():
         "phone": contact.get("phone", "N/A"),
         "email": contact.get("email", "N/A")
     }
+
+# After every route is registered
+tracing.instrument_endpoints(app)
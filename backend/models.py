@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, Boolean, Float, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -11,6 +11,7 @@ class Product(Base):
     price = Column(Float)
     image_url = Column(String)
     is_available = Column(Boolean, default=True)
+    stock = Column(Integer, nullable=True)  # units on hand; NULL = not tracked
 
 class Contact(Base):
     __tablename__ = "contacts"
@@ -39,10 +40,10 @@ class Order(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     total_amount = Column(Float)
-    status = Column(String, default="pending")  # pending, paid, confirmed, cancelled
+    status = Column(String, default="pending")  # pending, awaiting_verification, confirmed, cancelled, expired
     transaction_id = Column(String, nullable=True)  # internal transaction ref
     utr_number = Column(String, nullable=True)       # customer-submitted UTR
-    created_at = Column(String)  # For simplicity, can be DateTime later
+    created_at = Column(String, index=True)  # ISO-8601 UTC
 
     user = relationship("User", back_populates="orders")
     items = relationship("OrderItem", back_populates="order")
@@ -51,10 +52,90 @@ class OrderItem(Base):
     __tablename__ = "order_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"))
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
     product_id = Column(Integer)
     product_name = Column(String)
     quantity = Column(Integer)
     price = Column(Float)
 
     order = relationship("Order", back_populates="items")
+
+# Sales rollups, maintained incrementally by rollups.py.
+# `day` is the UTC date prefix of Order.created_at ("undated" when missing).
+class SalesDaily(Base):
+    __tablename__ = "sales_daily"
+
+    day = Column(String(10), primary_key=True)
+    status = Column(String, primary_key=True)
+    orders = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0.0, nullable=False)
+
+class SalesDailyProduct(Base):
+    __tablename__ = "sales_daily_products"
+
+    day = Column(String(10), primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    status = Column(String, primary_key=True)
+    product_name = Column(String)
+    orders = Column(Integer, default=0, nullable=False)
+    units = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0.0, nullable=False)
+
+# Durable background jobs, claimed and run by jobs.py workers
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_status_run_at", "status", "run_at"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    payload = Column(Text, nullable=False, default="{}")   # JSON
+    status = Column(String, nullable=False, default="queued")  # queued, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(Float, nullable=False)                 # epoch seconds
+    locked_by = Column(String, nullable=True)              # claim token of the running worker
+    locked_at = Column(Float, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(Float, nullable=False)
+
+# Admin feed events (events.py); the row id is the feed cursor in every worker
+class OrderEvent(Base):
+    __tablename__ = "order_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    type = Column(String, nullable=False)
+    order_id = Column(Integer, nullable=False)
+    status = Column(String)
+    total_amount = Column(Float)
+    transaction_id = Column(String)
+    utr_number = Column(String)
+    created_at = Column(Float, nullable=False, index=True)  # epoch seconds
+
+# Cold tier: terminal orders moved out of `orders` by archive.py once they
+# are older than ORDER_ARCHIVE_AFTER_DAYS. Same columns, ids kept.
+class ArchivedOrder(Base):
+    __tablename__ = "orders_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    total_amount = Column(Float)
+    status = Column(String)
+    transaction_id = Column(String, nullable=True)
+    utr_number = Column(String, nullable=True, index=True)
+    created_at = Column(String, index=True)
+    archived_at = Column(String)
+
+    user = relationship("User")
+    items = relationship("ArchivedOrderItem", back_populates="order")
+
+class ArchivedOrderItem(Base):
+    __tablename__ = "order_items_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    order_id = Column(Integer, ForeignKey("orders_archive.id"), index=True)
+    product_id = Column(Integer)
+    product_name = Column(String)
+    quantity = Column(Integer)
+    price = Column(Float)
+
+    order = relationship("ArchivedOrder", back_populates="items")
@@ -0,0 +1,112 @@
+"""
+In-memory price snapshot for cart quotes.
+
+`POST /cart/quote` prices a cart from a snapshot of every product's name and
+price, so editing a cart costs no database round trip. The snapshot carries
+a version: a hash of its contents, so every worker holding the same prices
+reports the same version. It is rebuilt with one query when it is older than
+PRICE_SNAPSHOT_TTL, or right away when a product is added in this worker.
+Prices edited directly in the database show up within the TTL.
+
+A checkout that sends back the `price_version` of its quote is priced from
+the snapshot while that version is still current (one string comparison),
+skipping the product read. Otherwise prices are read from the database as
+before. Stock is never taken from the snapshot: crud.reserve_stock guards it
+at checkout either way.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Iterable, NamedTuple, Optional
+
+import models
+from sqlalchemy.orm import Session
+
+PRICE_SNAPSHOT_TTL = float(os.getenv("PRICE_SNAPSHOT_TTL", "30"))
+MAX_QUOTE_LINES = 200
+
+
+class QuoteError(ValueError):
+    pass
+
+
+class PricedProduct(NamedTuple):
+    id: int
+    name: str
+    price: float
+
+
+class PriceSnapshot:
+    __slots__ = ("products", "version", "built_at")
+
+    def __init__(self, products: Iterable[PricedProduct]):
+        self.products: Dict[int, PricedProduct] = {p.id: p for p in products}
+        digest = hashlib.sha256()
+        for product_id in sorted(self.products):
+            p = self.products[product_id]
+            digest.update(f"{p.id}\x1f{p.name}\x1f{p.price!r}\x1e".encode())
+        self.version = digest.hexdigest()[:16]
+        self.built_at = time.monotonic()
+
+
+class PriceBook:
+    def __init__(self, ttl: float = PRICE_SNAPSHOT_TTL):
+        self.ttl = ttl
+        self._snapshot: Optional[PriceSnapshot] = None
+        self._lock = threading.Lock()
+
+    def _fresh(self, snapshot: Optional[PriceSnapshot]) -> bool:
+        return snapshot is not None and time.monotonic() - snapshot.built_at < self.ttl
+
+    def current(self, db: Session) -> PriceSnapshot:
+        snapshot = self._snapshot
+        if self._fresh(snapshot):
+            return snapshot
+        with self._lock:
+            # Another thread may have rebuilt it while we waited
+            snapshot = self._snapshot
+            if not self._fresh(snapshot):
+                rows = db.query(models.Product.id, models.Product.name, models.Product.price).all()
+                snapshot = self._snapshot = PriceSnapshot(PricedProduct(*row) for row in rows)
+        return snapshot
+
+    def matching(self, db: Session, version: Optional[str]) -> Optional[PriceSnapshot]:
+        """The current snapshot if `version` is its version, else None."""
+        if not version:
+            return None
+        snapshot = self.current(db)
+        return snapshot if snapshot.version == version else None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def quote(self, db: Session, items) -> dict:
+        """Line totals and total for `items` (product_id, quantity). Raises QuoteError."""
+        if len(items) > MAX_QUOTE_LINES:
+            raise QuoteError(f"A cart can have at most {MAX_QUOTE_LINES} lines")
+        snapshot = self.current(db)
+        lines, unknown, total = [], [], 0.0
+        for item in items:
+            if item.quantity < 1:
+                raise QuoteError("Quantities must be at least 1")
+            product = snapshot.products.get(item.product_id)
+            if product is None or product.price is None:
+                unknown.append(item.product_id)
+                continue
+            line_total = product.price * item.quantity
+            total += line_total
+            lines.append({
+                "product_id": product.id,
+                "product_name": product.name,
+                "quantity": item.quantity,
+                "unit_price": product.price,
+                "line_total": round(line_total, 2),
+            })
+        if unknown:
+            raise QuoteError(f"Unknown products: {', '.join(map(str, unknown))}")
+        return {"price_version": snapshot.version, "items": lines, "total_amount": round(total, 2)}
+
+
+price_book = PriceBook()
@@ -0,0 +1,83 @@
+"""
+Order payment QR codes, rendered off the request thread.
+
+Uses the gateway's compact SVG renderer (Payment_gateway/utils/upi.py) and
+its LRU cache. qrcode/Pillow are optional here: without them the service
+reports itself unavailable and orders are returned without a QR.
+"""
+
+import base64
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from utils.qr_cache import CachedQR, QRCodeCache
+
+try:
+    from utils.upi import generate_qr_code_svg
+except ImportError:
+    generate_qr_code_svg = None
+
+ORDER_QR_WORKERS = int(os.getenv("ORDER_QR_WORKERS", "2"))
+ORDER_QR_CACHE_ENTRIES = int(os.getenv("ORDER_QR_CACHE_ENTRIES", "2048"))
+ORDER_QR_INLINE_TIMEOUT = float(os.getenv("ORDER_QR_INLINE_TIMEOUT", "2"))
+ORDER_QR_CACHE_CONTROL = "private, max-age=3600"
+ORDER_QR_MEDIA_TYPE = "image/svg+xml"
+
+
+class OrderQRService:
+    def __init__(self, workers: int = ORDER_QR_WORKERS, cache_entries: int = ORDER_QR_CACHE_ENTRIES):
+        self.cache = QRCodeCache(max_entries=cache_entries)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="order-qr")
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return generate_qr_code_svg is not None
+
+    def _render(self, upi_uri: str) -> CachedQR:
+        started = time.perf_counter()
+        content = generate_qr_code_svg(upi_uri)
+        self.cache.record_render(time.perf_counter() - started)
+        return self.cache.put(upi_uri, content)
+
+    def _done(self, upi_uri: str, fut: Future):
+        with self._lock:
+            if self._inflight.get(upi_uri) is fut:
+                del self._inflight[upi_uri]
+
+    def prerender(self, upi_uri: str) -> Optional[Future]:
+        """Start rendering in the background (or join a render already running)."""
+        if not self.available:
+            return None
+        entry = self.cache.get(upi_uri)
+        if entry is not None:
+            fut = Future()
+            fut.set_result(entry)
+            return fut
+        with self._lock:
+            fut = self._inflight.get(upi_uri)
+            started = fut is None
+            if started:
+                fut = self._executor.submit(self._render, upi_uri)
+                self._inflight[upi_uri] = fut
+        if started:
+            # Outside the lock: a render that already finished runs _done inline
+            fut.add_done_callback(lambda f: self._done(upi_uri, f))
+        return fut
+
+    def get(self, upi_uri: str, timeout: float = ORDER_QR_INLINE_TIMEOUT) -> Optional[CachedQR]:
+        fut = self.prerender(upi_uri)
+        if fut is None:
+            return None
+        return fut.result(timeout=timeout)
+
+    @staticmethod
+    def data_uri(entry: CachedQR) -> str:
+        return f"data:{ORDER_QR_MEDIA_TYPE};base64," + base64.b64encode(entry.content).decode("ascii")
+
+
+order_qr = OrderQRService()
@@ -0,0 +1,272 @@
+"""
+Bank statement reconciliation.
+
+Streams a bank statement export (CSV or XLSX) once, hash-joins each credit
+against the orders in 'awaiting_verification' on UTR, and bulk-confirms the
+rows whose amount matches. Everything else comes back in the report:
+amount mismatches, credits with no matching order, and orders with no credit.
+
+UTRs are only read from the UTR/reference column and the narration, never
+from other columns (account or cheque numbers also have 12 digits). With a
+single amount column plus a Dr/Cr column, rows marked as debits are skipped.
+
+Usage as a script:
+    python reconcile.py statement.csv [--dry-run]
+"""
+
+import csv
+import io
+import re
+import sys
+import os
+from typing import Iterator, List, Optional
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import models
+import events
+import rollups
+from sqlalchemy import update
+from sqlalchemy.orm import Session, selectinload
+
+UTR_RE = re.compile(r"(?<!\d)\d{12}(?!\d)")
+
+# Header names (lower-cased substrings) tried in order
+UTR_HEADERS = ("utr", "ref no", "reference", "ref", "transaction id", "txn id", "cheque")
+CREDIT_HEADERS = ("credit", "deposit", "cr amount", "amount")
+NARRATION_HEADERS = ("narration", "description", "particulars", "remarks")
+# Debit/credit indicator next to a single amount column
+INDICATOR_HEADERS = ("dr/cr", "cr/dr", "dr / cr", "cr / dr", "debit/credit", "credit/debit",
+                     "transaction type", "txn type", "type")
+DEBIT_MARKS = ("dr", "d", "debit", "withdrawal")
+
+HEADER_SCAN_ROWS = 50        # bank exports often start with a preamble
+AMOUNT_TOLERANCE = 0.01
+REPORT_LIMIT = 1000          # cap on itemised unmatched credits in the report
+UPDATE_CHUNK = 500
+
+
+def _iter_csv_rows(fileobj) -> Iterator[List[str]]:
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", errors="replace", newline="")
+    yield from csv.reader(text)
+
+
+def _iter_xlsx_rows(fileobj) -> Iterator[List[str]]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("XLSX statements need the 'openpyxl' package; upload a CSV instead")
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ["" if cell is None else str(cell) for cell in row]
+    finally:
+        workbook.close()
+
+
+def iter_statement_rows(fileobj, filename: str) -> Iterator[List[str]]:
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        return _iter_xlsx_rows(fileobj)
+    return _iter_csv_rows(fileobj)
+
+
+def _find_column(header: List[str], candidates, skip: Optional[int] = None) -> Optional[int]:
+    lowered = [h.strip().lower() for h in header]
+    for candidate in candidates:
+        for i, name in enumerate(lowered):
+            if candidate in name and i != skip:
+                return i
+    return None
+
+
+def _is_debit(mark: str) -> bool:
+    return mark.strip().rstrip(".").lower() in DEBIT_MARKS
+
+
+def _parse_amount(value: str) -> Optional[float]:
+    cleaned = value.replace(",", "").replace("₹", "").replace("INR", "").strip()
+    if not cleaned:
+        return None
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+
+def _confirm_awaiting(db: Session, order_ids: List[int]) -> List[int]:
+    """
+    Confirm the orders still awaiting verification, with a conditional
+    UPDATE so a concurrent status change wins. Returns the ids updated.
+    """
+    Order = models.Order
+    stmt = (
+        update(Order)
+        .where(Order.id.in_(order_ids), Order.status == "awaiting_verification")
+        .values(status="confirmed")
+        .execution_options(synchronize_session=False)
+    )
+    if db.get_bind().dialect.update_returning:
+        return list(db.execute(stmt.returning(Order.id)).scalars())
+    # No UPDATE ... RETURNING (SQLite < 3.35): claim one order at a time
+    return [
+        order_id for order_id in order_ids
+        if db.execute(stmt.where(Order.id == order_id)).rowcount
+    ]
+
+
+def reconcile_statement(
+    db: Session,
+    rows: Iterator[List[str]],
+    dry_run: bool = False,
+    utr_column: Optional[str] = None,
+    amount_column: Optional[str] = None,
+) -> dict:
+    """
+    Matches statement rows against orders awaiting verification and, unless
+    dry_run, confirms the exact (UTR + amount) matches in bulk.
+    """
+    # Build side: one query, UTR -> (order id, expected amount)
+    awaiting = {
+        utr: (order_id, total)
+        for order_id, utr, total in db.query(
+            models.Order.id, models.Order.utr_number, models.Order.total_amount
+        ).filter(
+            models.Order.status == "awaiting_verification",
+            models.Order.utr_number.isnot(None),
+        )
+    }
+
+    # Locate the header row
+    rows = iter(rows)
+    header_row = 0
+    utr_idx = amount_idx = narration_idx = indicator_idx = None
+    for header in rows:
+        header_row += 1
+        # "Debit/Credit" is an indicator, not the credit column
+        indicator_idx = _find_column(header, INDICATOR_HEADERS)
+        amount_idx = _find_column(header, (amount_column.lower(),) if amount_column else CREDIT_HEADERS, indicator_idx)
+        if amount_idx is not None:
+            utr_idx = _find_column(header, (utr_column.lower(),) if utr_column else UTR_HEADERS, indicator_idx)
+            narration_idx = _find_column(header, NARRATION_HEADERS, indicator_idx)
+            break
+        if header_row >= HEADER_SCAN_ROWS:
+            break
+    if amount_idx is None:
+        raise ValueError("Could not find a credit/amount column in the statement header")
+    if utr_idx is None and narration_idx is None:
+        raise ValueError("Could not find a UTR/reference or narration column in the statement header")
+
+    matched = []
+    mismatches = []
+    unmatched_credits = []
+    unmatched_total = 0
+    seen_utrs = set()
+    rows_scanned = credits = 0
+
+    # Probe side: single pass over the statement
+    for line_no, row in enumerate(rows, start=header_row + 1):
+        rows_scanned += 1
+        if amount_idx >= len(row):
+            continue
+        amount = _parse_amount(row[amount_idx])
+        if not amount or amount <= 0:
+            continue  # debit or blank line
+        if indicator_idx is not None and indicator_idx < len(row) and _is_debit(row[indicator_idx]):
+            continue
+        credits += 1
+
+        utr_match = None
+        for idx in (utr_idx, narration_idx):
+            if idx is not None and idx < len(row):
+                utr_match = UTR_RE.search(row[idx])
+                if utr_match:
+                    break
+        utr = utr_match.group(0) if utr_match else None
+
+        hit = awaiting.get(utr) if utr else None
+        if hit is None or utr in seen_utrs:
+            unmatched_total += 1
+            if len(unmatched_credits) < REPORT_LIMIT:
+                unmatched_credits.append({
+                    "row": line_no,
+                    "utr_number": utr,
+                    "amount": amount,
+                    "reason": "duplicate UTR in statement" if utr in seen_utrs else "no order awaiting this UTR",
+                })
+            continue
+        seen_utrs.add(utr)
+
+        order_id, expected = hit
+        entry = {"order_id": order_id, "utr_number": utr, "row": line_no, "amount": amount}
+        if abs((expected or 0) - amount) <= AMOUNT_TOLERANCE:
+            matched.append(entry)
+        else:
+            entry["expected_amount"] = expected
+            mismatches.append(entry)
+
+    if matched and not dry_run:
+        confirmed_ids = set()
+        matched_ids = [m["order_id"] for m in matched]
+        for start in range(0, len(matched_ids), UPDATE_CHUNK):
+            chunk = _confirm_awaiting(db, matched_ids[start:start + UPDATE_CHUNK])
+            orders = db.query(models.Order).options(selectinload(models.Order.items)).filter(
+                models.Order.id.in_(chunk)
+            ).all()
+            for order in orders:
+                rollups.record_status_change(db, order, "awaiting_verification", "confirmed")
+                events.order_events.publish(db, "order.status_changed", order)
+            confirmed_ids.update(chunk)
+        db.commit()
+        events.order_events.wake()
+        # Orders whose status changed since the build side was read were skipped
+        skipped = [m for m in matched if m["order_id"] not in confirmed_ids]
+        matched = [m for m in matched if m["order_id"] in confirmed_ids]
+    else:
+        skipped = []
+
+    return {
+        "dry_run": dry_run,
+        "rows_scanned": rows_scanned,
+        "credits_considered": credits,
+        "awaiting_orders": len(awaiting),
+        "confirmed": matched,
+        "no_longer_awaiting": skipped,
+        "amount_mismatches": mismatches,
+        "unmatched_credits": unmatched_credits,
+        "unmatched_credits_total": unmatched_total,
+        "orders_without_credit": sorted(
+            order_id for utr, (order_id, _) in awaiting.items() if utr not in seen_utrs
+        ),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Reconcile a bank statement against orders awaiting verification")
+    parser.add_argument("statement", help="CSV or XLSX export from the bank")
+    parser.add_argument("--dry-run", action="store_true", help="report only, don't confirm orders")
+    parser.add_argument("--utr-column")
+    parser.add_argument("--amount-column")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        with open(args.statement, "rb") as f:
+            report = reconcile_statement(
+                db, iter_statement_rows(f, args.statement), args.dry_run,
+                args.utr_column, args.amount_column,
+            )
+    finally:
+        db.close()
+
+    print(f"Rows scanned: {report['rows_scanned']}, credits: {report['credits_considered']}")
+    print(f"Confirmed: {len(report['confirmed'])}{' (dry run)' if args.dry_run else ''}")
+    if report["no_longer_awaiting"]:
+        print(f"Skipped (status changed meanwhile): {len(report['no_longer_awaiting'])}")
+    print(f"Amount mismatches: {len(report['amount_mismatches'])}")
+    for m in report["amount_mismatches"]:
+        print(f"  order #{m['order_id']} UTR {m['utr_number']}: expected {m['expected_amount']}, got {m['amount']}")
+    print(f"Unmatched credits: {report['unmatched_credits_total']}")
+    print(f"Orders still without a credit: {len(report['orders_without_credit'])}")
@@ -0,0 +1,207 @@
+"""
+Sales rollups for admin analytics.
+
+Two small tables hold running totals:
+  - sales_daily:          day x status            -> orders, revenue
+  - sales_daily_products: day x product x status  -> orders, units, revenue
+
+They are updated inside the same transaction that creates an order or
+changes its status (an order moving from A to B is subtracted from A's
+rows and added to B's), so dashboards read a few hundred rows instead of
+scanning order history. `rebuild` recomputes both tables from scratch.
+
+Usage as a script (backfill or repair):
+    python rollups.py --rebuild
+"""
+
+import os
+import sys
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import archive
+import models
+from sqlalchemy import func, literal
+from sqlalchemy.orm import Session
+
+UNDATED = "undated"
+GROUP_FIELDS = ("day", "product", "status")
+
+
+def order_day(order) -> str:
+    return order.created_at[:10] if order.created_at else UNDATED
+
+
+def _upsert_insert(db: Session, table):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"Sales rollups don't support the '{dialect}' database")
+    return insert(table)
+
+
+def _add(db: Session, model, keys: dict, deltas: dict, extra: Optional[dict] = None):
+    """Atomically add `deltas` to the row at `keys`, creating it if needed."""
+    table = model.__table__
+    stmt = _upsert_insert(db, table).values(**keys, **deltas, **(extra or {}))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: table.c[name] + stmt.excluded[name] for name in deltas},
+    )
+    db.execute(stmt)
+
+
+def _apply(db: Session, order, status: str, sign: int):
+    day = order_day(order)
+    _add(db, models.SalesDaily, {"day": day, "status": status},
+         {"orders": sign, "revenue": sign * (order.total_amount or 0.0)})
+
+    per_product = {}
+    for item in order.items:
+        entry = per_product.setdefault(item.product_id, [item.product_name, 0, 0.0])
+        entry[1] += item.quantity or 0
+        entry[2] += (item.quantity or 0) * (item.price or 0.0)
+    for product_id, (name, units, revenue) in per_product.items():
+        _add(db, models.SalesDailyProduct,
+             {"day": day, "product_id": product_id, "status": status},
+             {"orders": sign, "units": sign * units, "revenue": sign * revenue},
+             {"product_name": name})
+
+
+def record_order(db: Session, order):
+    """Count a new order (and its items, which must be flushed). Caller commits."""
+    _apply(db, order, order.status or "pending", +1)
+
+
+def record_status_change(db: Session, order, old_status: Optional[str], new_status: str):
+    """Move an order's contribution between statuses. Caller commits."""
+    old_status = old_status or "pending"
+    if old_status == new_status:
+        return
+    _apply(db, order, old_status, -1)
+    _apply(db, order, new_status, +1)
+
+
+def rebuild(db: Session) -> dict:
+    """Recompute both rollup tables from all orders (live and archived), in one transaction."""
+    orders, items = archive.all_orders(), archive.all_items()
+    Order, Item = orders.c, items.c
+    day = func.coalesce(func.substr(Order.created_at, 1, 10), literal(UNDATED))
+    status = func.coalesce(Order.status, literal("pending"))
+
+    db.query(models.SalesDaily).delete(synchronize_session=False)
+    db.query(models.SalesDailyProduct).delete(synchronize_session=False)
+
+    daily = db.query(
+        day, status, func.count(Order.id), func.coalesce(func.sum(Order.total_amount), 0.0)
+    ).select_from(orders).group_by(day, status)
+    db.execute(models.SalesDaily.__table__.insert().from_select(
+        ["day", "status", "orders", "revenue"], daily
+    ))
+
+    products = db.query(
+        day, Item.product_id, status, func.max(Item.product_name),
+        func.count(func.distinct(Order.id)),
+        func.coalesce(func.sum(Item.quantity), 0),
+        func.coalesce(func.sum(Item.quantity * Item.price), 0.0),
+    ).select_from(items).join(orders, Item.order_id == Order.id).group_by(day, Item.product_id, status)
+    db.execute(models.SalesDailyProduct.__table__.insert().from_select(
+        ["day", "product_id", "status", "product_name", "orders", "units", "revenue"], products
+    ))
+    db.commit()
+    return {
+        "daily_rows": db.query(models.SalesDaily).count(),
+        "product_rows": db.query(models.SalesDailyProduct).count(),
+    }
+
+
+def backfill_if_empty(db: Session) -> bool:
+    """Build the rollups on first run against a database that already has orders."""
+    if db.query(models.SalesDaily.day).first() is not None:
+        return False
+    if db.query(models.Order.id).first() is None and db.query(models.ArchivedOrder.id).first() is None:
+        return False
+    rebuild(db)
+    return True
+
+
+def query_sales(
+    db: Session,
+    group_by: List[str],
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    status: Optional[str] = None,
+    product_id: Optional[int] = None,
+) -> List[dict]:
+    """
+    Totals grouped by any of day / product / status, read from the rollups.
+    Order counts come from sales_daily unless grouping or filtering by
+    product (an order with two products would otherwise count twice).
+    """
+    by_product = "product" in group_by or product_id is not None
+    model = models.SalesDailyProduct if by_product else models.SalesDaily
+
+    columns, labels, group_columns = [], [], []
+    if "day" in group_by:
+        columns.append(model.day)
+        labels.append("day")
+        group_columns.append(model.day)
+    if "product" in group_by:
+        columns += [model.product_id, func.max(model.product_name)]
+        labels += ["product_id", "product_name"]
+        group_columns.append(model.product_id)
+    if "status" in group_by:
+        columns.append(model.status)
+        labels.append("status")
+        group_columns.append(model.status)
+
+    aggregates = [func.sum(model.orders), func.sum(model.revenue)]
+    agg_labels = ["orders", "revenue"]
+    if by_product:
+        aggregates.append(func.sum(model.units))
+        agg_labels.append("units")
+
+    q = db.query(*columns, *aggregates)
+    if date_from:
+        q = q.filter(model.day >= date_from, model.day != UNDATED)
+    if date_to:
+        q = q.filter(model.day <= date_to)
+    if status:
+        q = q.filter(model.status == status)
+    if product_id is not None:
+        q = q.filter(model.product_id == product_id)
+    if group_columns:
+        q = q.group_by(*group_columns).order_by(*group_columns)
+
+    rows = []
+    for row in q:
+        item = dict(zip(labels + agg_labels, row))
+        if item.get("orders") is None:
+            continue  # no matching rows at all
+        item["revenue"] = round(item["revenue"] or 0.0, 2)
+        rows.append(item)
+    # Statuses an order left are kept as zero rows; hide them
+    return [r for r in rows if r["orders"] or r.get("units")]
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="Maintain the sales rollup tables")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollups from all orders")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.error("nothing to do (pass --rebuild)")
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        counts = rebuild(db)
+    finally:
+        db.close()
+    print(f"Rebuilt sales rollups: {counts['daily_rows']} daily rows, {counts['product_rows']} product rows")
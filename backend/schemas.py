@@ -7,6 +7,7 @@ class ProductBase(BaseModel):
     price: float
     image_url: str
     is_available: bool = True
+    stock: Optional[int] = None
 
 class ProductCreate(ProductBase):
     pass
@@ -56,7 +57,7 @@ class User(UserBase):
 
 class OrderItemCreate(BaseModel):
     product_id: int
-    quantity: int
+    quantity: int = Field(..., gt=0)
 
 class OrderItemBase(BaseModel):
     product_id: int
@@ -75,6 +76,10 @@ class OrderBase(BaseModel):
 
 class OrderCreate(OrderBase):
     items: List[OrderItemCreate]
+    price_version: Optional[str] = None   # from POST /cart/quote
+
+class CartQuote(BaseModel):
+    items: List[OrderItemCreate]
 
 class Order(OrderBase):
     id: int
@@ -0,0 +1,357 @@
+"""
+Ranked product search over Product.name and Product.description.
+
+The engine is picked on first use from the database in use:
+  - postgres: pg_trgm + tsvector GIN indexes (prefix via tsquery `:*`,
+    typos via trigram similarity on the name);
+  - fts5:     SQLite FTS5 external-content table kept in sync by triggers;
+    typos are corrected against the FTS vocabulary before querying;
+  - memory:   in-process inverted index with prefix and typo-tolerant
+    matching, updated incrementally as products are added.
+Set PRODUCT_SEARCH_ENGINE to force one. If a database engine can't be set up
+(e.g. no permission to create pg_trgm) search falls back to memory.
+"""
+
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import models
+
+log = logging.getLogger("backend.search")
+
+PRODUCT_SEARCH_ENGINE = os.getenv("PRODUCT_SEARCH_ENGINE", "auto")
+# How often the memory engine looks for products added by other workers
+PRODUCT_SEARCH_REFRESH = float(os.getenv("PRODUCT_SEARCH_REFRESH", "5"))
+
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.0
+MAX_PREFIX_EXPANSIONS = 50
+MAX_QUERY_TERMS = 8
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    normalized = unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode()
+    return _TOKEN_RE.findall(normalized.lower())
+
+
+def max_typos(term: str) -> int:
+    if len(term) <= 3:
+        return 0
+    return 1 if len(term) <= 7 else 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance with transpositions, giving up above `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        best = i
+        for j, cb in enumerate(b, 1):
+            cost = ca != cb
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+            best = min(best, cur[j])
+        if best > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def _trigrams(term: str) -> Set[str]:
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InMemoryProductIndex:
+    """
+    Inverted index: term -> {product_id: weighted term frequency}.
+    A sorted vocabulary serves prefix lookups and a trigram index over the
+    vocabulary narrows the candidates checked for typos.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_terms: Dict[int, Dict[str, float]] = {}
+        self._vocabulary: List[str] = []
+        self._trigram_terms: Dict[str, Set[str]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self.max_id = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def _add_term(self, term: str):
+        insort(self._vocabulary, term)
+        for gram in _trigrams(term):
+            self._trigram_terms[gram].add(term)
+
+    def _drop_term(self, term: str):
+        i = bisect_left(self._vocabulary, term)
+        if i < len(self._vocabulary) and self._vocabulary[i] == term:
+            del self._vocabulary[i]
+        for gram in _trigrams(term):
+            self._trigram_terms[gram].discard(term)
+
+    def _remove_locked(self, product_id: int):
+        for term in self._doc_terms.pop(product_id, {}):
+            posting = self._postings[term]
+            posting.pop(product_id, None)
+            if not posting:
+                del self._postings[term]
+                self._drop_term(term)
+
+    def upsert(self, product_id: int, name: Optional[str], description: Optional[str]):
+        weights: Dict[str, float] = defaultdict(float)
+        for term in tokenize(name):
+            weights[term] += NAME_WEIGHT
+        for term in tokenize(description):
+            weights[term] += DESCRIPTION_WEIGHT
+        with self._lock:
+            self._remove_locked(product_id)
+            self._doc_terms[product_id] = dict(weights)
+            for term, weight in weights.items():
+                posting = self._postings.get(term)
+                if posting is None:
+                    posting = self._postings[term] = {}
+                    self._add_term(term)
+                posting[product_id] = weight
+            self.max_id = max(self.max_id, product_id)
+
+    def remove(self, product_id: int):
+        with self._lock:
+            self._remove_locked(product_id)
+
+    def _expand(self, term: str) -> List[Tuple[str, float]]:
+        """Vocabulary terms matching a query term, with a match-quality factor."""
+        matches: Dict[str, float] = {}
+        if term in self._postings:
+            matches[term] = 1.0
+        i = bisect_left(self._vocabulary, term)
+        while i < len(self._vocabulary) and len(matches) < MAX_PREFIX_EXPANSIONS:
+            candidate = self._vocabulary[i]
+            if not candidate.startswith(term):
+                break
+            matches.setdefault(candidate, 0.8)
+            i += 1
+        limit = max_typos(term)
+        if limit and not matches:
+            grams = _trigrams(term)
+            shared: Dict[str, int] = defaultdict(int)
+            for gram in grams:
+                for candidate in self._trigram_terms.get(gram, ()):
+                    shared[candidate] += 1
+            # An edit destroys at most 3 trigrams, a transposition 4
+            needed = max(1, len(grams) - 4 * limit)
+            for candidate, count in shared.items():
+                if count >= needed:
+                    distance = edit_distance(term, candidate, limit)
+                    if distance <= limit:
+                        matches[candidate] = 0.6 / distance
+        return list(matches.items())
+
+    def search(self, query: str, limit: int) -> List[int]:
+        terms = tokenize(query)[:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+        with self._lock:
+            total = len(self._doc_terms) or 1
+            scores: Dict[int, float] = defaultdict(float)
+            coverage: Dict[int, int] = defaultdict(int)
+            for term in terms:
+                best: Dict[int, float] = {}
+                for match, factor in self._expand(term):
+                    posting = self._postings[match]
+                    idf = math.log(1 + total / len(posting))
+                    for product_id, weight in posting.items():
+                        score = factor * idf * weight
+                        if score > best.get(product_id, 0.0):
+                            best[product_id] = score
+                for product_id, score in best.items():
+                    scores[product_id] += score
+                    coverage[product_id] += 1
+        ranked = sorted(scores, key=lambda pid: (coverage[pid], scores[pid]), reverse=True)
+        return ranked[:limit]
+
+
+_FTS5_SETUP = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts_vocab USING fts5vocab(products_fts, 'row')",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+_PG_DOCUMENT = "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))"
+_PG_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (name gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS ix_products_search_tsv ON products USING gin ({_PG_DOCUMENT})",
+]
+
+
+class ProductSearch:
+    def __init__(self, preferred: str = PRODUCT_SEARCH_ENGINE):
+        self.preferred = preferred
+        self.engine: Optional[str] = None
+        self.index = InMemoryProductIndex()
+        self._setup_lock = threading.Lock()
+        self._last_refresh = 0.0
+
+    # -- setup -----------------------------------------------------------
+
+    def _ensure_engine(self, db: Session):
+        if self.engine is not None:
+            return
+        with self._setup_lock:
+            if self.engine is not None:
+                return
+            dialect = db.get_bind().dialect.name
+            candidates = []
+            if self.preferred in ("auto", "postgres") and dialect == "postgresql":
+                candidates.append(("postgres", _PG_SETUP))
+            if self.preferred in ("auto", "fts5") and dialect == "sqlite":
+                candidates.append(("fts5", _FTS5_SETUP))
+            for name, statements in candidates:
+                try:
+                    self._run_setup(db, name, statements)
+                    self.engine = name
+                    break
+                except Exception as e:
+                    db.rollback()
+                    log.warning("Product search engine %s unavailable (%s); falling back", name, e)
+            if self.engine is None:
+                self.engine = "memory"
+            log.info("Product search engine: %s", self.engine)
+
+    @staticmethod
+    def _run_setup(db: Session, name: str, statements: List[str]):
+        existed = True
+        if name == "fts5":
+            existed = db.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")
+            ).first() is not None
+        for statement in statements:
+            db.execute(text(statement))
+        if not existed:
+            # Index products that predate the FTS table
+            db.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+        db.commit()
+
+    def _refresh_memory_index(self, db: Session):
+        # Picks up products added since the last look (including by other workers)
+        now = time.monotonic()
+        if now - self._last_refresh < PRODUCT_SEARCH_REFRESH and len(self.index):
+            return
+        self._last_refresh = now
+        rows = db.query(models.Product.id, models.Product.name, models.Product.description).filter(
+            models.Product.id > self.index.max_id
+        ).all()
+        for product_id, name, description in rows:
+            self.index.upsert(product_id, name, description)
+
+    def warm_up(self, db: Session):
+        """Pick the engine and fill the memory index now rather than on the first search."""
+        self._ensure_engine(db)
+        if self.engine == "memory":
+            self._refresh_memory_index(db)
+
+    # -- queries ---------------------------------------------------------
+
+    def _fts5_terms(self, db: Session, term: str) -> List[str]:
+        """FTS5 query fragments for one term: prefix match, or typo corrections."""
+        fragments = [f'"{term}"*']
+        limit = max_typos(term)
+        if not limit:
+            return fragments
+        known = db.execute(
+            text("SELECT 1 FROM products_fts_vocab WHERE term >= :t AND term < :end LIMIT 1"),
+            {"t": term, "end": term + "\x7f"},
+        ).first()
+        if known:
+            return fragments
+        # Unknown term: look for close vocabulary words with the same first letter
+        rows = db.execute(
+            text(
+                "SELECT term FROM products_fts_vocab WHERE term >= :lo AND term < :hi "
+                "AND length(term) BETWEEN :min_len AND :max_len"
+            ),
+            {"lo": term[0], "hi": term[0] + "\x7f", "min_len": len(term) - limit, "max_len": len(term) + limit},
+        )
+        fragments += [f'"{t}"' for (t,) in rows if edit_distance(term, t, limit) <= limit]
+        return fragments
+
+    def _search_fts5(self, db: Session, terms: List[str], limit: int) -> List[int]:
+        groups = ["(" + " OR ".join(self._fts5_terms(db, t)) + ")" for t in terms]
+        for joiner in (" AND ", " OR "):
+            rows = db.execute(
+                text(
+                    "SELECT rowid FROM products_fts WHERE products_fts MATCH :q "
+                    "ORDER BY bm25(products_fts, :wn, :wd) LIMIT :limit"
+                ),
+                {"q": joiner.join(groups), "wn": NAME_WEIGHT, "wd": DESCRIPTION_WEIGHT, "limit": limit},
+            ).fetchall()
+            if rows or len(groups) == 1:
+                return [r[0] for r in rows]
+        return []
+
+    def _search_postgres(self, db: Session, query: str, terms: List[str], limit: int) -> List[int]:
+        tsquery = " & ".join(f"{t}:*" for t in terms)
+        rows = db.execute(
+            text(
+                f"SELECT id FROM products "
+                f"WHERE {_PG_DOCUMENT} @@ to_tsquery('simple', :tsq) OR name % :q "
+                f"ORDER BY ts_rank({_PG_DOCUMENT}, to_tsquery('simple', :tsq)) * 2 + similarity(name, :q) DESC "
+                f"LIMIT :limit"
+            ),
+            {"tsq": tsquery, "q": " ".join(terms), "limit": limit},
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def search(self, db: Session, query: str, limit: int = 20) -> List[int]:
+        """Product ids, best match first."""
+        self._ensure_engine(db)
+        terms = tokenize(query)[:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+        if self.engine == "postgres":
+            return self._search_postgres(db, query, terms, limit)
+        if self.engine == "fts5":
+            return self._search_fts5(db, terms, limit)
+        self._refresh_memory_index(db)
+        return self.index.search(query, limit)
+
+    def product_changed(self, product):
+        """Keep the in-process index current; database engines use their own indexes."""
+        if self.engine == "memory" and self._last_refresh:
+            self.index.upsert(product.id, product.name, product.description)
+
+
+product_search = ProductSearch()
@@ -0,0 +1,19 @@
+"""
+Production entry point for the backend: preforked, warmed-up uvicorn workers.
+
+    python backend/serve.py [--workers N] [--port 8000]
+
+See Payment_gateway/utils/launcher.py for the environment variables.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# The launcher is shared with the payment gateway, like the other utils
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Payment_gateway"))
+
+from utils.launcher import main
+
+if __name__ == "__main__":
+    main("main:app", prepare="main:prepare_fork", warm_up="main:warm_up")
@@ -0,0 +1,40 @@
+"""
+Background job handlers (see jobs.py). Importing this module registers them.
+"""
+
+import logging
+import os
+
+import requests
+
+import jobs
+import models
+
+log = logging.getLogger("backend.tasks")
+
+# Optional chat/webhook URL (Slack/Discord-compatible JSON) for admin alerts
+ADMIN_NOTIFY_WEBHOOK = os.getenv("ADMIN_NOTIFY_WEBHOOK")
+
+_MESSAGES = {
+    "order.created": "New order #{id}: ₹{total} ({items} items), awaiting payment",
+    "payment.submitted": "Order #{id}: customer submitted UTR {utr} for ₹{total}, please verify",
+}
+
+
+@jobs.handler("notify.admin")
+def notify_admin(db, event: str, order_id: int):
+    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    if order is None:
+        return
+    text = _MESSAGES[event].format(
+        id=order.id,
+        total=order.total_amount,
+        items=sum(item.quantity or 0 for item in order.items),
+        utr=order.utr_number,
+    )
+    if not ADMIN_NOTIFY_WEBHOOK:
+        log.info("Admin notification: %s", text, extra={"order_id": order_id, "event": event})
+        return
+    # Raising lets the job be retried with backoff
+    res = requests.post(ADMIN_NOTIFY_WEBHOOK, json={"text": text, "content": text}, timeout=10)
+    res.raise_for_status()
@@ -0,0 +1,154 @@
+"""
+Concurrency check for stock reservation.
+
+Fires many parallel checkouts at a single product with limited stock and
+checks that:
+  - units sold never exceed the starting stock and stock never goes negative;
+  - every checkout either succeeds or gets a clean OutOfStockError (no lock
+    timeouts or deadlocks);
+  - cancelling and expiring orders gives their units back exactly once;
+  - zero or negative quantities are refused and never put stock back.
+
+Runs against DATABASE_URL (a throwaway SQLite file by default):
+
+    python verify_stock_reservation.py --checkouts 500 --threads 32 --stock 200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='stock-'), 'stock.db')}"
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import crud
+import database
+import models
+import schemas
+from pydantic import ValidationError
+
+
+def checkout(product_id: int, quantity: int):
+    db = database.SessionLocal()
+    started = time.perf_counter()
+    try:
+        order = schemas.OrderCreate(items=[{"product_id": product_id, "quantity": quantity}], total_amount=0)
+        db_order = crud.create_order(db, order, user_id=1)
+        return "ok", db_order.id, quantity, time.perf_counter() - started
+    except crud.OutOfStockError:
+        return "out_of_stock", None, quantity, time.perf_counter() - started
+    except Exception as e:
+        return f"error: {e}", None, quantity, time.perf_counter() - started
+    finally:
+        db.close()
+
+
+def negative_checkout(product_id: int, quantity: int) -> list:
+    """Problems found when ordering `quantity` (<= 0) units, [] if it was refused."""
+    problems = []
+    try:
+        schemas.OrderItemCreate(product_id=product_id, quantity=quantity)
+        problems.append(f"schema accepted quantity {quantity}")
+    except ValidationError:
+        pass
+    # The schema is the first guard; create_order must refuse it on its own too
+    item = schemas.OrderItemCreate.model_construct(product_id=product_id, quantity=quantity)
+    order = schemas.OrderCreate.model_construct(items=[item], total_amount=0, price_version=None)
+    db = database.SessionLocal()
+    try:
+        crud.create_order(db, order, user_id=1)
+        problems.append(f"create_order accepted quantity {quantity}")
+    except crud.InvalidQuantityError:
+        db.rollback()
+    finally:
+        db.close()
+    return problems
+
+
+def current_stock(product_id: int) -> int:
+    db = database.SessionLocal()
+    try:
+        return db.query(models.Product.stock).filter(models.Product.id == product_id).scalar()
+    finally:
+        db.close()
+
+
+def run(args) -> bool:
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    product = models.Product(name="Verify SKU", description="", price=10.0, image_url="", stock=args.stock)
+    db.add(product)
+    db.commit()
+    product_id = product.id
+    db.close()
+
+    quantities = [1 + i % 3 for i in range(args.checkouts)]
+    print(f"--- {args.checkouts} checkouts on {args.threads} threads for {args.stock} units ---")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(lambda q: checkout(product_id, q), quantities))
+    elapsed = time.perf_counter() - started
+
+    failures = []
+    sold = [(order_id, qty) for outcome, order_id, qty, _ in results if outcome == "ok"]
+    errors = [outcome for outcome, *_ in results if outcome.startswith("error")]
+    units_sold = sum(qty for _, qty in sold)
+    stock_left = current_stock(product_id)
+    latencies = sorted(r[3] for r in results)
+
+    print(f"Sold {units_sold} units in {len(sold)} orders, "
+          f"{sum(1 for r in results if r[0] == 'out_of_stock')} rejected, {len(errors)} errors, {elapsed:.2f}s")
+    print(f"Latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms")
+    if errors:
+        failures.append(f"{len(errors)} checkouts failed with errors, e.g. {errors[0]}")
+    if stock_left < 0:
+        failures.append(f"stock went negative: {stock_left}")
+    if units_sold + stock_left != args.stock:
+        failures.append(f"oversold: {units_sold} sold + {stock_left} left != {args.stock}")
+    if args.checkouts * 2 > args.stock and stock_left > 2:
+        failures.append(f"undersold: {stock_left} units left although demand exceeded stock")
+
+    print("--- Cancelling half the orders, expiring the rest ---")
+    db = database.SessionLocal()
+    half = len(sold) // 2
+    for order_id, _ in sold[:half]:
+        db_order = db.get(models.Order, order_id)
+        crud.set_order_status(db, db_order, "cancelled")
+        crud.set_order_status(db, db_order, "cancelled")  # repeated cancel releases nothing
+    db.commit()
+    crud.ORDER_RESERVATION_TTL = -60
+    crud.expire_stale_orders(db, limit=args.checkouts)
+    crud.expire_stale_orders(db, limit=args.checkouts)
+    db.close()
+    stock_after = current_stock(product_id)
+    print(f"Stock after release: {stock_after}")
+    if stock_after != args.stock:
+        failures.append(f"release mismatch: stock is {stock_after}, expected {args.stock}")
+
+    print("--- Ordering zero and negative quantities ---")
+    for quantity in (0, -3):
+        failures.extend(negative_checkout(product_id, quantity))
+    if current_stock(product_id) != stock_after:
+        failures.append(f"non-positive quantity changed stock to {current_stock(product_id)}")
+
+    if failures:
+        print("FAILURE:")
+        for failure in failures:
+            print("  " + failure)
+        return False
+    print("SUCCESS: no oversell, no lock errors, releases are exact.")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkouts", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--stock", type=int, default=200)
+    sys.exit(0 if run(parser.parse_args()) else 1)
@@ -1,4 +1,4 @@
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import { useCart } from '../context/CartContext';
 import { useAuth } from '../context/AuthContext';
 import axios from 'axios';
@@ -14,10 +14,13 @@ const PaymentScreen = ({ paymentInfo, onClose }) => {
     const [confirmed, setConfirmed] = useState(false);
     const [confirmError, setConfirmError] = useState('');
 
-    // Generate QR code URL via Google Charts API (no library needed)
-    const qrUrl = paymentInfo.upi_uri
-        ? `https://api.qrserver.com/v1/create-qr-code/?size=220x220&data=${encodeURIComponent(paymentInfo.upi_uri)}`
-        : null;
+    // QR code rendered by the backend (inline data URI, or its cacheable URL);
+    // fall back to the public QR API if the backend can't render one
+    const qrUrl = paymentInfo.qr_code
+        || (paymentInfo.qr_url && `${API_URL}${paymentInfo.qr_url}`)
+        || (paymentInfo.upi_uri
+            ? `https://api.qrserver.com/v1/create-qr-code/?size=220x220&data=${encodeURIComponent(paymentInfo.upi_uri)}`
+            : null);
 
     // Amount from UPI URI param
     const amount = paymentInfo.upi_uri?.match(/[?&]am=([^&]+)/)?.[1] || '';
@@ -214,6 +217,30 @@ const CartModal = ({ isOpen, onClose, onAuthRequired }) => {
     const [isProcessing, setIsProcessing] = useState(false);
     const [orderMessage, setOrderMessage] = useState('');
     const [paymentInfo, setPaymentInfo] = useState(null);
+    const [quote, setQuote] = useState(null);
+
+    // Server prices for the cart, re-quoted shortly after each edit; the local
+    // total shows until the quote for the current cart arrives
+    const cartKey = cart.map(item => `${item.id}x${item.quantity}`).join(',');
+    useEffect(() => {
+        if (!isOpen || cart.length === 0) return;
+        let cancelled = false;
+        const timer = setTimeout(async () => {
+            try {
+                const res = await axios.post(`${API_URL}/cart/quote`, {
+                    items: cart.map(item => ({ product_id: item.id, quantity: item.quantity }))
+                });
+                if (!cancelled) setQuote({ key: cartKey, ...res.data });
+            } catch {
+                if (!cancelled) setQuote(null);
+            }
+        }, 250);
+        return () => { cancelled = true; clearTimeout(timer); };
+    }, [isOpen, cartKey]);
+
+    const currentQuote = quote?.key === cartKey ? quote : null;
+    const quotedPrices = Object.fromEntries((currentQuote?.items || []).map(line => [line.product_id, line.unit_price]));
+    const displayTotal = currentQuote ? currentQuote.total_amount : cartTotal;
 
     const handleCheckout = async () => {
         if (!user) { onAuthRequired(); return; }
@@ -224,10 +251,12 @@ const CartModal = ({ isOpen, onClose, onAuthRequired }) => {
 
         try {
             const orderData = {
-                total_amount: cartTotal,
-                items: cart.map(item => ({ product_id: item.id, quantity: item.quantity }))
+                total_amount: displayTotal,
+                items: cart.map(item => ({ product_id: item.id, quantity: item.quantity })),
+                // Lets the server skip re-reading prices that haven't changed
+                price_version: currentQuote?.price_version,
             };
-            const response = await axios.post(`${API_URL}/orders/`, orderData, {
+            const response = await axios.post(`${API_URL}/orders/?include_qr=true`, orderData, {
                 headers: { Authorization: `Bearer ${token}` }
             });
             const data = response.data;
@@ -287,7 +316,7 @@ const CartModal = ({ isOpen, onClose, onAuthRequired }) => {
                                         </div>
                                         <div className="flex-1 min-w-0">
                                             <h3 className="font-bold text-gray-800 text-sm truncate">{item.name}</h3>
-                                            <p className="text-green-600 font-bold text-sm">₹{item.price}</p>
+                                            <p className="text-green-600 font-bold text-sm">₹{quotedPrices[item.id] ?? item.price}</p>
                                         </div>
                                         <div className="flex items-center gap-2 flex-shrink-0">
                                             <div className="flex items-center border rounded-lg bg-white">
@@ -309,7 +338,7 @@ const CartModal = ({ isOpen, onClose, onAuthRequired }) => {
                             <div className="border-t pt-4">
                                 <div className="flex justify-between items-center mb-5">
                                     <span className="text-lg text-gray-600 font-medium">Total</span>
-                                    <span className="text-3xl font-extrabold text-green-600">₹{cartTotal}</span>
+                                    <span className="text-3xl font-extrabold text-green-600">₹{displayTotal}</span>
                                 </div>
 
                                 {orderMessage && (
@@ -4,6 +4,12 @@ import { useCart } from '../context/CartContext';
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
+// Resized variants served by the backend (see GET /products/{id}/image)
+const IMAGE_WIDTHS = [320, 480, 640, 960];
+const productImage = (product, width) => `${API_URL}/products/${product.id}/image?w=${width}`;
+// stock is null for products whose quantity isn't tracked
+const inStock = (product) => product.is_available && product.stock !== 0;
+
 const ProductList = () => {
     const [products, setProducts] = useState([]);
     const [loading, setLoading] = useState(true);
@@ -40,8 +46,16 @@ const ProductList = () => {
                         {products.map(product => (
                             <div key={product.id} className="group bg-white rounded-2xl shadow-sm border border-gray-100 overflow-hidden hover:shadow-xl transition-all duration-500 transform hover:-translate-y-2">
                                 <div className="relative overflow-hidden h-64">
-                                    <img src={product.image_url || "https://placehold.co/400x300?text=Leaf+Plate"} alt={product.name} className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-700" />
-                                    {!product.is_available && (
+                                    <img
+                                        src={product.image_url ? productImage(product, 480) : "https://placehold.co/400x300?text=Leaf+Plate"}
+                                        srcSet={product.image_url ? IMAGE_WIDTHS.map(w => `${productImage(product, w)} ${w}w`).join(', ') : undefined}
+                                        sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw"
+                                        loading="lazy"
+                                        decoding="async"
+                                        alt={product.name}
+                                        className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-700"
+                                    />
+                                    {!inStock(product) && (
                                         <div className="absolute top-4 right-4 bg-red-500 text-white px-3 py-1 rounded-full text-xs font-bold uppercase tracking-wider">
                                             Out of Stock
                                         </div>
@@ -53,9 +67,9 @@ const ProductList = () => {
                                     <div className="flex justify-between items-center pt-4 border-t border-gray-50">
                                         <span className="text-2xl font-extrabold text-green-600">₹{product.price}</span>
                                         <button
-                                            onClick={() => product.is_available && onAddToCart(product)}
-                                            className={`px-5 py-2.5 text-white text-sm font-semibold rounded-xl transition-all duration-300 ${product.is_available ? 'bg-green-600 hover:bg-green-700 hover:shadow-lg hover:shadow-green-200' : 'bg-gray-400 cursor-not-allowed'}`}
-                                            disabled={!product.is_available}
+                                            onClick={() => inStock(product) && onAddToCart(product)}
+                                            className={`px-5 py-2.5 text-white text-sm font-semibold rounded-xl transition-all duration-300 ${inStock(product) ? 'bg-green-600 hover:bg-green-700 hover:shadow-lg hover:shadow-green-200' : 'bg-gray-400 cursor-not-allowed'}`}
+                                            disabled={!inStock(product)}
                                         >
                                             Add to Cart
                                         </button>